@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the flattening of the responses of the vega line & bar charts
+(`VegaTranslator._iter_response`).
+
+The current implementation is compared to the previous recursive generator,
+kept below as a reference, on synthetic responses built for visualizations of
+the test fixtures. Both must yield the same points.
+
+The reference shares the helpers of the tree it runs on (date formatting,
+lookups of the visualization state), so the optimizations of those helpers
+speed it up as well.
+
+Usage: python benchmarks/bench_vega_response.py [--repeat N]
+"""
+
+import os
+import sys
+
+BASE_DIRECTORY = os.path.join(os.path.dirname(__file__), "..")  # NOQA
+sys.path.insert(0, BASE_DIRECTORY)  # NOQA
+
+import argparse  # noqa: E402
+import copy  # noqa: E402
+import json  # noqa: E402
+import random  # noqa: E402
+import time  # noqa: E402
+
+from pybana import Config, IndexPattern, VegaTranslator, Visualization  # noqa: E402
+from pybana.helpers.datetime import format_timestamp  # noqa: E402
+from pybana.translators.vega.metrics import VEGA_METRICS  # noqa: E402
+from pybana.translators.vega.visualization import ContextVisualization  # noqa: E402
+
+FIXTURES = os.path.join(BASE_DIRECTORY, "pybana", "index.json")
+
+INDEX_PATTERN_ID = "index-pattern:6c172f80-fb13-11e9-84e4-078763638bf3"
+
+# (visualization id, number of buckets of each level)
+CASES = [
+    ("visualization:5fa0ea20-ffdc-11e9-b6bd-4d907ad3c29d", [1000, 50]),
+    ("visualization:53b3da70-fbbc-11e9-84e4-078763638bf3", [10000]),
+]
+
+DATE_FORMAT = "YYYY-MM-DD HH:mm"
+
+
+def load_document(klass, id):
+    with open(FIXTURES, "r") as fd:
+        for line in fd:
+            hit = json.loads(line)
+            if hit["_id"] == id:
+                return klass.from_es(hit)
+    raise KeyError(id)
+
+
+def make_aggregations(state, sizes, depth=0):
+    """
+    Returns random aggregations with `sizes[i]` buckets at the level `i`.
+    """
+    bucket_aggs = state.bucket_aggs()
+    if depth == len(bucket_aggs):
+        node = {"doc_count": random.randint(0, 100)}
+        for agg in state.metric_aggs():
+            if agg["type"] == "median":
+                node[agg["id"]] = {"values": {"50.0": 1.5}}
+            elif agg["type"] == "std_dev":
+                node[agg["id"]] = {"std_deviation": 2.0}
+            elif agg["type"] != "count":
+                node[agg["id"]] = {"value": random.choice([None, 1.0, 3])}
+        return node
+    agg = bucket_aggs[depth]
+    buckets = []
+    for i in range(sizes[depth]):
+        bucket = make_aggregations(state, sizes, depth + 1)
+        if agg["type"] == "date_histogram":
+            bucket["key"] = 1546300800000 + i * 3600000
+        else:
+            bucket["key"] = "k%d" % i if i % 7 else ""
+        buckets.append(bucket)
+    return {agg["id"]: {"buckets": buckets}}
+
+
+def reference_iter_response(translator, node, bucket_aggs, it, point, state, response):
+    """
+    Previous implementation: a recursive generator which copies the point being
+    filled at each level and looks up the metrics for each leaf.
+    """
+    if it == len(bucket_aggs):
+        point["group"] = " - ".join(map(str, filter(bool, point.get("groups", []))))
+        for m, metric_agg in enumerate(state.metric_aggs()):
+            metric = VEGA_METRICS[metric_agg["type"]]()
+            y = metric.contribute(metric_agg, node, response)
+            if y is None:
+                continue
+            childpoint = point.copy()
+            childpoint.setdefault("x", "all")
+            childpoint.pop("groups", None)
+            childpoint.update(
+                {"y": y, "m": m, "metric": state.metric_label(metric_agg)}
+            )
+            if "seriesParams" in state._state["params"]:
+                series_params = state.series_params(metric_agg)
+                ax = state.valueax(series_params["valueAxis"])
+                childpoint.update({state.y(ax): y, "axis": series_params["valueAxis"]})
+            tooltip = {
+                childpoint.get("x_label", "x"): childpoint["x"],
+                childpoint["metric"]: translator._format_duration(y)
+                if translator._is_duration_bucket(state, metric_agg, metric)
+                else y,
+            }
+            if childpoint["group"]:
+                tooltip["group"] = childpoint["group"]
+            childpoint["tooltip"] = tooltip
+            yield childpoint
+        return
+    agg = bucket_aggs[it]
+    for child in node[agg["id"]]["buckets"]:
+        childpoint = point.copy()
+        if agg["type"] == "date_histogram":
+            key = format_timestamp(child.get("key"), DATE_FORMAT, "en")
+        else:
+            key = child.get("key_as_string") or child.get("key")
+        if agg["schema"] == "segment":
+            agg_params = agg.get("params", {})
+            childpoint["x"] = key
+            childpoint["key"] = child.get("key")
+            childpoint["x_label"] = (
+                agg_params.get("customLabel") or agg_params.get("field") or "x"
+            )
+        else:
+            childpoint["groups"] = childpoint.get("groups", []) + [key]
+        yield from reference_iter_response(
+            translator, child, bucket_aggs, it + 1, childpoint, state, response
+        )
+
+
+def run_reference(translator, state, aggregations, response):
+    return list(
+        reference_iter_response(
+            translator, aggregations, state.bucket_aggs(), 0, {}, state, response
+        )
+    )
+
+
+def run_current(translator, state, aggregations, response):
+    return list(
+        translator._iter_response(aggregations, state, response, DATE_FORMAT, "en")
+    )
+
+
+def best_time(func, translator, state, aggregations, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        # Metrics are written into the buckets: each run gets its own copy
+        copied = copy.deepcopy(aggregations)
+        response = {"hits": {"total": 1}, "aggregations": copied}
+        start = time.perf_counter()
+        points = func(translator, state, copied, response)
+        best = min(best, time.perf_counter() - start)
+    return best, points
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    index_pattern = load_document(IndexPattern, INDEX_PATTERN_ID)
+    translator = VegaTranslator(using=None)
+    for id, sizes in CASES:
+        visualization = load_document(Visualization, id)
+        state = ContextVisualization(
+            visualization, Config(config={}), index_pattern=index_pattern
+        )
+        random.seed(1)
+        aggregations = make_aggregations(state, sizes)
+        reference, expected = best_time(
+            run_reference, translator, state, aggregations, args.repeat
+        )
+        current, points = best_time(
+            run_current, translator, state, aggregations, args.repeat
+        )
+        assert points == expected, "The implementations yield different points"
+        print(
+            "%s %s: %d points, reference %.3fs, current %.3fs (x%.1f)"
+            % (id, sizes, len(points), reference, current, reference / current)
+        )
+
+
+if __name__ == "__main__":
+    main()
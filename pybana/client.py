@@ -6,11 +6,21 @@ import os
 from elasticsearch import NotFoundError, Elasticsearch
 import elasticsearch_dsl
 
+from pybana.elastic.async_client import AsyncElasticsearch, AsyncElasticsearchExtClient
 from pybana.elastic.elastic_client import ElasticsearchExtClient
 
-from .models import Config, Dashboard, DataView, IndexPattern, Visualization, Search
+from .models import (
+    Config,
+    Dashboard,
+    DataView,
+    IndexPattern,
+    SavedObjectGraph,
+    Search,
+    Visualization,
+    aget_document,
+)
 
-__all__ = ("Kibana",)
+__all__ = ("AsyncKibana", "Kibana")
 
 DEFAULT_CONFIG = {
     "timepicker:timeDefaults": json.dumps(
@@ -48,14 +58,16 @@ class Kibana:
             elasticsearch_dsl.connections.add_connection(using, es_ext)
         return es_ext
 
-    def __init__(self, *, using, index=".kibana"):
+    def __init__(self, *, using, index=".kibana", cache=None):
         """
         Initialize a client to kibana.
 
         :param index string: Index used by kibana (default: .kibana).
+        :param SavedObjectCache cache: Cache of saved objects (default: no cache).
         """
         self._default = self.get_es(using)
         self._index = index
+        self._cache = cache
 
     @property
     def using(self):
@@ -68,14 +80,22 @@ class Kibana:
         return search(index=self._index, using=es)
 
     def _get(self, klass, id, using):
-        return klass.get(index=self._index, id=id, using=self.get_es(using))
+        es = self.get_es(using)
+        if self._cache is not None:
+            return self._cache.get(
+                klass,
+                id,
+                index=self._index,
+                using=using if isinstance(using, str) else es,
+            )
+        return klass.get(index=self._index, id=id, using=es)
 
     def objects(self, type, using=None):
         return self._search(type, using=using).filter("term", type=type)
 
     def config_id(self, using=None):
         elastic = self.get_es(using)
-        return "config:%s" % elastic.info()["version"]["number"]
+        return "config:%s" % elastic.cluster_info.version
 
     def config(self, using=None):
         """
@@ -85,8 +105,7 @@ class Kibana:
 
     def is_v8(self, using=None):
         elastic = self.get_es(using)
-        version = elastic.info()["version"]["number"].split(".")[0]
-        return version >= "8"
+        return elastic.cluster_info.version_major >= 8
 
     def init_index(self, using=None):
         """
@@ -178,3 +197,95 @@ class Kibana:
         if not config.config.to_dict().get("defaultIndex"):
             config.config.defaultIndex = index_pattern.meta.id.split(":")[-1]
             config.save(refresh="wait_for", using=using or self.using)
+
+
+class AsyncKibana:
+    """
+    Asynchronous kibana client, on top of an `AsyncElasticsearchExtClient`:
+    saved objects are fetched by coroutines.
+
+    The documents returned are the same as with `Kibana`. Their related objects
+    are fetched with their asynchronous methods (`Dashboard.avisualizations`,
+    `Visualization.arelated_search`, `Visualization.aindex`...), which fill the
+    caches used by the synchronous ones (and hence by the translators).
+    """
+
+    klasses = Kibana.klasses
+
+    def get_es(self, using):
+        using = using or self._default
+        if isinstance(using, AsyncElasticsearchExtClient):
+            return using
+        es = elasticsearch_dsl.connections.get_connection(using)
+        if AsyncElasticsearch is None or not isinstance(es, AsyncElasticsearch):
+            return es
+        es_ext = AsyncElasticsearchExtClient(es)
+        if isinstance(using, str):
+            elasticsearch_dsl.connections.add_connection(using, es_ext)
+        return es_ext
+
+    def __init__(self, *, using, index=".kibana"):
+        """
+        Initialize an asynchronous client to kibana.
+
+        :param using: Asynchronous elasticsearch connection.
+        :param index string: Index used by kibana (default: .kibana).
+        """
+        self._default = self.get_es(using)
+        self._index = index
+
+    @property
+    def using(self):
+        return self._default
+
+    async def _get(self, klass, id, using):
+        return await aget_document(klass, id, self._index, using=self.get_es(using))
+
+    async def config_id(self, using=None):
+        cluster_info = await self.get_es(using).cluster_info()
+        return "config:%s" % cluster_info.version
+
+    async def config(self, using=None):
+        """
+        Return the config associated to the current version of elastic
+        """
+        return await self._get(Config, await self.config_id(using), using=using)
+
+    async def is_v8(self, using=None):
+        return await self.get_es(using).get_version_major() >= 8
+
+    async def index_pattern(self, id, using=None):
+        """
+        Return a index-pattern identified by its identifier.
+        """
+        return await self._get(
+            self.klasses["index-pattern"], f"index-pattern:{id}", using=using
+        )
+
+    async def search(self, id, using=None):
+        """
+        Return a search identified by its identifier.
+        """
+        return await self._get(self.klasses["search"], f"search:{id}", using=using)
+
+    async def visualization(self, id, using=None):
+        """
+        Return a visualization identified by its identifier.
+        """
+        return await self._get(
+            self.klasses["visualization"], f"visualization:{id}", using=using
+        )
+
+    async def dashboard(self, id, using=None):
+        """
+        Return a dashboard identified by its identifier.
+        """
+        return await self._get(
+            self.klasses["dashboard"], f"dashboard:{id}", using=using
+        )
+
+    async def load(self, dashboards, using=None):
+        """
+        Load the dependencies of dashboards (see `SavedObjectGraph`).
+        """
+        return await SavedObjectGraph.aload(dashboards, using=self.get_es(using))
@@ -9,19 +9,23 @@ from pybana.elastic.elastic_client import ElasticsearchExtClient
 def dumpindex(elastic, index, fn):
     """
     Helper which dump a whole db and returns in a format handled by bulk api
+
+    The hits are sorted by id so that the dump does not depend on the order of
+    the parallel scan.
     """
     search = Search(using=elastic, index=index).filter(
         "terms", type=["index-pattern", "visualization", "dashboard", "search"]
     )
+    hits = elastic.parallel_scan(index, query=search.to_dict(), doc_type="doc")
     with open(fn, "w+") as fd:
-        for doc in search.scan():
+        for hit in sorted(hits, key=lambda hit: hit["_id"]):
             fd.write(
                 json.dumps(
                     {
-                        "_index": doc.meta.index,
-                        "_type": doc.meta.doc_type,
-                        "_id": doc.meta.id,
-                        "_source": doc.to_dict(),
+                        "_index": hit["_index"],
+                        "_type": hit["_type"],
+                        "_id": hit["_id"],
+                        "_source": hit["_source"],
                     }
                 )
             )
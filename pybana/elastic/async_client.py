@@ -0,0 +1,370 @@
+"""
+Asynchronous counterpart of `ElasticsearchExtClient`, with the same fixes for
+v7 & v8 clusters.
+
+It requires an asynchronous elasticsearch client: `elasticsearch[async]>=7.8`
+(`elasticsearch.AsyncElasticsearch`), or `elasticsearch-async` with 6.x clients.
+"""
+
+from typing import Any, Dict, List, Optional
+
+from elasticsearch.client import SKIP_IN_PATH, _make_path
+from elasticsearch.client.utils import query_params
+from elasticsearch.exceptions import ConflictError
+from elasticsearch_dsl import MultiSearch
+
+from .elastic_client import (
+    ClusterInfo,
+    ScrollsCache,
+    _get_msearch_items,
+    _get_scroll_ids,
+    _get_single_doc_type,
+    _iter_bulk_lines,
+    cluster_infos,
+)
+from .fixes_for_v8 import thaw, v6_to_v8, v8_to_v6
+
+try:
+    from elasticsearch import AsyncElasticsearch
+except ImportError:  # pragma: no cover
+    try:
+        from elasticsearch_async import AsyncElasticsearch
+    except ImportError:
+        AsyncElasticsearch = None
+
+__all__ = ("AsyncElasticsearchExtClient",)
+
+
+class AsyncElasticsearchSubClient:
+    def __init__(self, parent: "AsyncElasticsearchExtClient"):
+        self._parent = parent
+
+    async def get_version_major(self) -> int:
+        return await self._parent.get_version_major()
+
+
+class AsyncElasticsearchExtIndice(AsyncElasticsearchSubClient):
+    def __init__(self, parent: "AsyncElasticsearchExtClient", indices):
+        super().__init__(parent)
+        self._indices = indices
+
+    async def fix_mappings(self, original_mappings: Optional[Dict]) -> Dict:
+        if await self.get_version_major() < 7:
+            return thaw(original_mappings or {})
+        return v6_to_v8.fix_mappings(original_mappings=original_mappings)
+
+    async def create(self, index, body: Optional[Dict[str, Any]] = None, **kwargs):
+        if body is not None and await self.get_version_major() >= 7:
+            body = v6_to_v8._shared_template(body)
+        await self._indices.create(index=index, body=body, **kwargs)
+        return 1
+
+    async def exists(self, index: str):
+        return await self._indices.exists(index=index)
+
+    async def refresh(self, index, **kwargs):
+        return await self._indices.refresh(index=index, **kwargs)
+
+    async def delete(self, index: Optional[str], **kwargs):
+        if not index:
+            return 0
+
+        nb_deleted = 0
+        if await self.get_version_major() >= 7 and "*" in index:
+            if await self._indices.exists_alias(index=index):
+                for i in await self._indices.get_alias(index=index):
+                    await self._indices.delete(index=i)
+                    nb_deleted += 1
+        else:
+            await self._indices.delete(index=index, **kwargs)
+            nb_deleted += 1
+        return nb_deleted
+
+    async def get(self, index, **kwargs):
+        return await self._indices.get(index=index, **kwargs)
+
+    async def get_alias(self, index=None, name=None, **kwargs):
+        return await self._indices.get_alias(index=index, name=name, **kwargs)
+
+    async def exists_alias(self, index=None, name=None, **kwargs):
+        return await self._indices.exists_alias(index=index, name=name, **kwargs)
+
+    async def put_alias(self, index, name, body=None, **kwargs):
+        return await self._indices.put_alias(
+            index=index, name=name, body=body, **kwargs
+        )
+
+    async def update_aliases(self, body, **kwargs):
+        return await self._indices.update_aliases(body=body, **kwargs)
+
+    async def get_mapping(self, index=None, doc_type=None, **kwargs):
+        version_major = await self.get_version_major()
+        if version_major >= 7:
+            mapping = await self._indices.get_mapping(index=index, **kwargs)
+            if doc_type:
+                v8_to_v6.correct_mappings(mapping, doc_type=doc_type)
+            return mapping
+        return await self._indices.get_mapping(index=index, doc_type=doc_type, **kwargs)
+
+    @query_params(
+        "allow_no_indices",
+        "expand_wildcards",
+        "ignore_unavailable",
+        "include_type_name",
+        "master_timeout",
+        "timeout",
+        "update_all_types",
+    )
+    async def put_mapping(self, doc_type, body, index=None, params=None):
+        for param in (doc_type, body):
+            if param in SKIP_IN_PATH:
+                raise ValueError("Empty value passed for a required argument.")
+        if await self.get_version_major() >= 7:
+            body = v6_to_v8._shared_mappings(body)
+            doc_type = None
+        return await self._parent._transport_perform_request(
+            "PUT", _make_path(index, "_mapping", doc_type), params=params, body=body
+        )
+
+    async def exists_template(self, name: str):
+        return await self._indices.exists_template(name=name)
+
+    async def get_template(self, name: str, doc_type=None, **kwargs):
+        template = await self._indices.get_template(name=name, **kwargs)
+        if doc_type and await self.get_version_major() >= 7:
+            v8_to_v6.correct_mappings(template, doc_type=doc_type)
+        return template
+
+    async def put_template(self, name: str, body: Dict[str, Any]):
+        if await self.get_version_major() >= 7:
+            body = v6_to_v8._shared_template(body)
+        return await self._indices.put_template(name=name, body=body)
+
+    async def delete_template(self, name: str, **kwargs):
+        return await self._indices.delete_template(name=name, **kwargs)
+
+
+class AsyncElasticsearchExtCat(AsyncElasticsearchSubClient):
+    def __init__(self, parent: "AsyncElasticsearchExtClient", cat):
+        super().__init__(parent)
+        self._cat = cat
+
+    async def indices(self, index=None, **kwargs):
+        return await self._cat.indices(index=index, **kwargs)
+
+    async def templates(self, name=None, **kwargs):
+        return await self._cat.templates(name=name, **kwargs)
+
+    async def count(self, index=None, **kwargs):
+        return await self._cat.count(index=index, **kwargs)
+
+
+class AsyncElasticsearchExtClient:
+    """
+    Asynchronous version of `ElasticsearchExtClient`: its methods are
+    coroutines, fixing the requests & responses the same way.
+
+    The metadata of the cluster is fetched by the first request needing it,
+    and shared with the synchronous clients through `cluster_infos`.
+
+    :param es: Asynchronous elasticsearch client (default: `AsyncElasticsearch()`).
+    """
+
+    def __init__(self, es=None):
+        if es is None:
+            if AsyncElasticsearch is None:
+                raise ImportError(
+                    "AsyncElasticsearchExtClient requires elasticsearch-async "
+                    "(pybana[async]) or elasticsearch[async]>=7.8"
+                )
+            es = AsyncElasticsearch()
+        self.es = es
+        self.indices = AsyncElasticsearchExtIndice(parent=self, indices=self.es.indices)
+        self.cat = AsyncElasticsearchExtCat(parent=self, cat=self.es.cat)
+        self.transport = self.es.transport
+        v6_to_v8.fix_async_transport_instance(self.transport)
+        self.scroll_cache = ScrollsCache()
+
+    async def cluster_info(self) -> ClusterInfo:
+        """
+        Metadata of the cluster (fetched on first use, then cached per connection).
+        """
+        info = cluster_infos.cached(self.es)
+        if info is None:
+            info = await self.refresh_cluster_info()
+        return info
+
+    async def refresh_cluster_info(self) -> ClusterInfo:
+        return cluster_infos.set(self.es, await self.es.info())
+
+    async def get_version_major(self) -> int:
+        return (await self.cluster_info()).version_major
+
+    async def close(self):
+        await self.es.close()
+
+    async def info(self, **kwargs):
+        return await self.es.info(**kwargs)
+
+    async def _transport_perform_request(
+        self, method, url, headers=None, params=None, body=None
+    ):
+        return await self.transport.perform_request(
+            method=method, url=url, headers=headers, params=params, body=body
+        )
+
+    @query_params(
+        "_source",
+        "_source_excludes",
+        "_source_includes",
+        "preference",
+        "realtime",
+        "refresh",
+        "routing",
+        "stored_fields",
+        "version",
+        "version_type",
+    )
+    async def _get(self, index, id, params=None):
+        for param in (index, id):
+            if param in SKIP_IN_PATH:
+                raise ValueError("Empty value passed for a required argument.")
+        return await self.transport.perform_request(
+            "GET", _make_path(index, "_doc", id), params=params
+        )
+
+    async def get(self, index, doc_type, id, **kwargs):
+        if await self.get_version_major() >= 7:
+            document = await self._get(index=index, id=id, **kwargs)
+            if isinstance(document, dict) and doc_type:
+                document["_type"] = doc_type
+            return document
+        return await self.es.get(index=index, doc_type=doc_type, id=id, **kwargs)
+
+    async def mget(self, body, index=None, doc_type=None, **kwargs):
+        if await self.get_version_major() >= 7:
+            return await self.es.mget(body=body, index=index, **kwargs)
+        return await self.es.mget(body=body, index=index, doc_type=doc_type, **kwargs)
+
+    async def index(self, index, doc_type, body, id=None, **kwargs):
+        if await self.get_version_major() >= 7:
+            doc_type = "_doc"
+            if "version" in kwargs and "version_type" not in kwargs:
+                kwargs["version_type"] = "external"
+            try:
+                return await self.es.index(
+                    index=index, doc_type=doc_type, body=body, id=id, **kwargs
+                )
+            except ConflictError:
+                # increase the version of 1 for update
+                if "version" in kwargs and isinstance(kwargs["version"], int):
+                    kwargs["version"] += 1
+                else:
+                    raise
+        return await self.es.index(
+            index=index, doc_type=doc_type, body=body, id=id, **kwargs
+        )
+
+    async def delete(self, index, doc_type, id, **kwargs):
+        if await self.get_version_major() >= 7:
+            doc_type = "_doc"
+            version = kwargs.get("version")
+            if version:
+                if isinstance(version, int):
+                    kwargs["version"] = version + 1
+                kwargs["version_type"] = kwargs.get("version_type", "external")
+        return await self.es.delete(index=index, doc_type=doc_type, id=id, **kwargs)
+
+    async def count(self, index=None, doc_type=None, body=None, **kwargs):
+        if await self.get_version_major() >= 7:
+            return await self.es.count(index=index, body=body, **kwargs)
+        return await self.es.count(index=index, doc_type=doc_type, body=body, **kwargs)
+
+    async def bulk(self, body, index=None, doc_type=None, **kwargs):
+        """
+        Bulk api. As for `ElasticsearchExtClient.bulk`, only the action lines
+        are rewritten on v7+.
+        """
+        if await self.get_version_major() >= 7:
+            body = v6_to_v8.fix_bulk_lines(_iter_bulk_lines(body))
+            return await self.es.bulk(body=body, index=index, **kwargs)
+        if isinstance(body, bytes) or hasattr(body, "read"):
+            body = _iter_bulk_lines(body)
+        return await self.es.bulk(body=body, index=index, doc_type=doc_type, **kwargs)
+
+    async def search(self, index=None, doc_type=None, body=None, **kwargs):
+        if await self.get_version_major() < 7:
+            return await self.es.search(
+                index=index, doc_type=doc_type, body=body, **kwargs
+            )
+        body = v6_to_v8.fix_search_body(body)
+        v6_to_v8.fix_search_params(kwargs)
+        old_doc_type = _get_single_doc_type(doc_type)
+        search_result = await self.es.search(index=index, body=body, **kwargs)
+        if isinstance(search_result, dict):
+            search_result = v8_to_v6.correct_search_result(
+                results=search_result, doc_type=old_doc_type
+            )
+            self.scroll_cache.add_item(
+                results=search_result,
+                doc_type=old_doc_type,
+                scroll=kwargs.get("scroll"),
+            )
+        return search_result
+
+    async def msearch(self, body, index=None, doc_type=None, **kwargs):
+        """
+        Multi search api, accepting the same bodies as
+        `ElasticsearchExtClient.msearch`.
+        """
+        if isinstance(body, MultiSearch):
+            index = body._index if index is None else index
+            kwargs = {**body._params, **kwargs}
+        items = _get_msearch_items(body)
+        if await self.get_version_major() < 7:
+            return await self.es.msearch(
+                body=items, index=index, doc_type=doc_type, **kwargs
+            )
+        doc_types: List[str] = [
+            _get_single_doc_type(
+                header.get("type", doc_type) if isinstance(header, dict) else doc_type
+            )
+            for header in items[::2]
+        ]
+        results = await self.es.msearch(
+            body=(
+                v6_to_v8.fix_msearch_item(position, item)
+                for position, item in enumerate(items)
+            ),
+            index=index,
+            **kwargs,
+        )
+        if isinstance(results, dict):
+            for result, old_doc_type in zip(results.get("responses", []), doc_types):
+                if isinstance(result, dict) and "error" not in result:
+                    v8_to_v6.correct_search_result(
+                        results=result, doc_type=old_doc_type
+                    )
+        return results
+
+    @query_params("rest_total_hits_as_int")
+    async def scroll(self, scroll_id=None, body=None, scroll=None, params=None):
+        body = body or {}
+        if scroll_id:
+            body["scroll_id"] = scroll_id
+        if scroll:
+            body["scroll"] = scroll
+        body = {k: v for k, v in body.items() if v is not None}
+        r = await self.transport.perform_request(
+            "GET", _make_path("_search", "scroll"), params=params, body=body
+        )
+        if isinstance(r, dict):
+            return self.scroll_cache.fix_results(
+                r, scroll=body.get("scroll"), scroll_id=body.get("scroll_id")
+            )
+        return r
+
+    async def clear_scroll(self, scroll_id: Optional[str] = None, body=None, **kwargs):
+        for id in _get_scroll_ids(scroll_id=scroll_id, body=body):
+            self.scroll_cache.remove(id)
+        return await self.es.clear_scroll(scroll_id=scroll_id, body=body, **kwargs)
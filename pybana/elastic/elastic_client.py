@@ -1,6 +1,13 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from queue import Full, Queue
 import logging
 import json
-from typing import Any, Dict, List, Optional
+import re
+import threading
+import time
+import weakref
+from typing import Any, Dict, Iterator, List, Optional
 
 from elasticsearch import Elasticsearch, helpers
 from elasticsearch.client import (
@@ -11,14 +18,37 @@ from elasticsearch.client import (
     IngestClient,
 )
 from elasticsearch.exceptions import ConflictError
+from elasticsearch_dsl import MultiSearch
 
 
 from elasticsearch.client.utils import query_params
-from .fixes_for_v8 import v6_to_v8, v8_to_v6
-import datetime
+from .fixes_for_v8 import thaw, v6_to_v8, v8_to_v6
+from .instrumentation import get_observer, instrument_operation
 
 logger = logging.getLogger("elasticsearch")
 
+# Marker put in the queue of `parallel_scan` when a slice is exhausted.
+_SLICE_DONE = object()
+
+# Operations of `ElasticsearchExtClient` reported by its instrumentation.
+INSTRUMENTED_OPERATIONS = (
+    "bulk",
+    "clear_scroll",
+    "count",
+    "create",
+    "delete",
+    "delete_by_query",
+    "get",
+    "helpers_bulk",
+    "index",
+    "mget",
+    "msearch",
+    "reindex",
+    "scroll",
+    "search",
+    "update_by_query",
+)
+
 
 class ElasticsearchBaseClient:
     def _transport_perform_request(
@@ -47,7 +77,7 @@ class ElasticsearchExtIndice(ElasticsearchSubClient):
 
     def fix_mappings(self, original_mappings: Optional[Dict]) -> Dict:
         if self.version_major < 7:
-            return original_mappings or {}
+            return thaw(original_mappings or {})
         return v6_to_v8.fix_mappings(original_mappings=original_mappings)
 
     def open(self, index: str, **kwargs) -> bool:
@@ -63,7 +93,7 @@ class ElasticsearchExtIndice(ElasticsearchSubClient):
         **kwargs,  # normally: only params
     ):
         if body is not None and self.version_major >= 7:
-            body = v6_to_v8.fix_template(body)
+            body = v6_to_v8._shared_template(body)
         self._indices.create(index=index, body=body, **kwargs)
         return 1
 
@@ -159,8 +189,8 @@ class ElasticsearchExtIndice(ElasticsearchSubClient):
         for param in (doc_type, body):
             if param in SKIP_IN_PATH:
                 raise ValueError("Empty value passed for a required argument.")
-        body = self.fix_mappings(body)
         if self.version_major >= 7:
+            body = v6_to_v8._shared_mappings(body)
             doc_type = None
         return self._parent._transport_perform_request(
             "PUT", _make_path(index, "_mapping", doc_type), params=params, body=body
@@ -174,7 +204,7 @@ class ElasticsearchExtIndice(ElasticsearchSubClient):
 
     def put_template(self, name: str, body: Dict[str, Any]):
         if self.version_major >= 7:
-            body = v6_to_v8.fix_template(body)
+            body = v6_to_v8._shared_template(body)
         return self._indices.put_template(name=name, body=body)
 
     def rollover(
@@ -215,13 +245,45 @@ class ElasticsearchExtIngest(ElasticsearchSubClient):
         return self._ingest.delete_pipeline(id, **kwargs)
 
 
+# Keep-alive (in seconds) of a scroll context opened without scroll parameter.
+DEFAULT_SCROLL_KEEP_ALIVE = 3600.0
+
+# Maximum number of scroll contexts kept by a `ScrollsCache`.
+DEFAULT_MAX_SCROLLS = 10000
+
+TIME_UNITS = {
+    "d": 86400.0,
+    "h": 3600.0,
+    "m": 60.0,
+    "s": 1.0,
+    "ms": 1e-3,
+    "micros": 1e-6,
+    "nanos": 1e-9,
+}
+
+TIME_VALUE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(d|h|m|s|ms|micros|nanos)\s*$")
+
+
+def _get_keep_alive(scroll) -> float:
+    """
+    Returns the duration (in seconds) of an elasticsearch time value like `5m`.
+    """
+    match = TIME_VALUE_RE.match(scroll) if isinstance(scroll, str) else None
+    if not match:
+        return DEFAULT_SCROLL_KEEP_ALIVE
+    return float(match.group(1)) * TIME_UNITS[match.group(2)]
+
+
 class ScrollContext:
-    def __init__(self, doc_type: str) -> None:
+    def __init__(
+        self, doc_type: str, keep_alive: float = DEFAULT_SCROLL_KEEP_ALIVE
+    ) -> None:
         self.doc_type = doc_type
-        self.date = datetime.datetime.now()
+        self.keep_alive = keep_alive
+        self.deadline = time.monotonic() + keep_alive
 
-    def is_old(self):
-        return datetime.datetime.now() - self.date > datetime.timedelta(hours=1)
+    def is_old(self, now: Optional[float] = None):
+        return (time.monotonic() if now is None else now) > self.deadline
 
 
 def _get_scroll_ids(scroll_id, body) -> List[str]:
@@ -239,64 +301,287 @@ def _get_scroll_id(scroll_id, body) -> str:
     return next(iter(_get_scroll_ids(scroll_id=scroll_id, body=body)), "")
 
 
+def _get_single_doc_type(doc_type) -> str:
+    if (
+        isinstance(doc_type, list)
+        and len(doc_type) == 1
+        and isinstance(doc_type[0], str)
+    ):
+        return doc_type[0]
+    return doc_type if isinstance(doc_type, str) else ""
+
+
+def _get_msearch_items(body) -> List[Any]:
+    """
+    Returns the alternated headers & bodies of a msearch body given as NDJSON
+    (str or bytes), as a `elasticsearch_dsl.MultiSearch`, or as a list of
+    alternated headers & bodies or of `(header, body)` pairs.
+    """
+    if isinstance(body, MultiSearch):
+        return body.to_dict()
+    if isinstance(body, bytes):
+        body = body.decode("utf-8")
+    if isinstance(body, str):
+        return [json.loads(line) for line in body.split("\n") if line.strip()]
+    items: List[Any] = []
+    for item in body:
+        if isinstance(item, (tuple, list)):
+            items.extend(item)
+        else:
+            items.append(item)
+    return [item.to_dict() if hasattr(item, "to_dict") else item for item in items]
+
+
+def _iter_bulk_lines(body) -> Iterator[Any]:
+    """
+    Iterate over the non-empty lines (without line breaks) of a bulk body given
+    as str, bytes, file-like object or iterable of lines, without splitting the
+    whole body at once. The dicts of an iterable are yielded as is.
+    """
+    if isinstance(body, (str, bytes)):
+        newline = "\n" if isinstance(body, str) else b"\n"
+        lines = _iter_split(body, newline)
+    else:
+        lines = body
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if isinstance(line, str):
+            line = line.rstrip("\r\n")
+            if not line.strip():
+                continue
+        yield line
+
+
+def _iter_split(text, separator):
+    start = 0
+    while start < len(text):
+        end = text.find(separator, start)
+        if end == -1:
+            end = len(text)
+        yield text[start:end]
+        start = end + 1
+
+
 class ScrollsCache:
-    def __init__(self) -> None:
+    """
+    Doc types of the scroll contexts opened on v7+ clusters, used to correct
+    the results of the next scroll requests.
+
+    A context expires when its keep-alive (the `scroll` parameter) elapses
+    without scroll request. The contexts are grouped by keep-alive in insertion
+    ordered dicts, which are therefore sorted by deadline: expired contexts are
+    dropped from their heads in amortized O(1). When `max_size` contexts are
+    live, the one expiring first is evicted.
+
+    :param int max_size: Maximum number of contexts.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SCROLLS) -> None:
+        self.max_size = max_size
         self.cache: Dict[str, ScrollContext] = {}
         self.nb_scrolls_added: int = 0
+        self.nb_expired: int = 0
+        self.nb_evicted: int = 0
+        self._queues: Dict[float, "OrderedDict[str, ScrollContext]"] = {}
+        self._lock = threading.RLock()
 
     def __len__(self):
         return len(self.cache)
 
-    def add_item(self, results: dict, doc_type: Optional[str]):
+    @property
+    def nb_live(self) -> int:
+        return len(self.cache)
+
+    def _push(self, scroll_id: str, context: ScrollContext):
+        self.cache[scroll_id] = context
+        self._queues.setdefault(context.keep_alive, OrderedDict())[scroll_id] = context
+
+    def _pop(self, scroll_id: str) -> Optional[ScrollContext]:
+        context = self.cache.pop(scroll_id, None)
+        if context is not None:
+            queue = self._queues[context.keep_alive]
+            del queue[scroll_id]
+            if not queue:
+                del self._queues[context.keep_alive]
+        return context
+
+    def add_item(self, results: dict, doc_type: Optional[str], scroll=None):
         if not doc_type:
             return False
         scroll_id = _get_scroll_id(scroll_id=None, body=results)
         if not scroll_id:
             return False
-        self.clear_scroll_cache()
-        self.cache[scroll_id] = ScrollContext(doc_type=doc_type)
-        self.nb_scrolls_added += 1
+        with self._lock:
+            self.clear_scroll_cache()
+            self._pop(scroll_id)
+            while self.cache and len(self.cache) >= self.max_size:
+                self._pop(
+                    min(
+                        (next(iter(queue)) for queue in self._queues.values()),
+                        key=lambda key: self.cache[key].deadline,
+                    )
+                )
+                self.nb_evicted += 1
+            self._push(
+                scroll_id, ScrollContext(doc_type, keep_alive=_get_keep_alive(scroll))
+            )
+            self.nb_scrolls_added += 1
         return True
 
-    def fix_results(self, results: Optional[dict]) -> Optional[dict]:
+    def fix_results(
+        self, results: Optional[dict], scroll=None, scroll_id: Optional[str] = None
+    ) -> Optional[dict]:
+        """
+        Correct the results of a scroll request, and postpone the expiry of its
+        context (given the `scroll` parameter of the request).
+        """
         if not results:
             return results
-        scroll_id = _get_scroll_id(scroll_id=None, body=results)
-        cached = self.cache.get(scroll_id)
-        if not cached:
-            return results
+        new_scroll_id = _get_scroll_id(scroll_id=None, body=results)
+        with self._lock:
+            cached = self._pop(new_scroll_id) or (
+                self._pop(scroll_id) if scroll_id else None
+            )
+            if not cached:
+                return results
+            keep_alive = _get_keep_alive(scroll) if scroll else cached.keep_alive
+            self._push(
+                new_scroll_id, ScrollContext(cached.doc_type, keep_alive=keep_alive)
+            )
         return v8_to_v6.correct_search_result(results=results, doc_type=cached.doc_type)
 
     def remove(self, scroll_id: str):
-        self.cache.pop(scroll_id, "")
+        with self._lock:
+            self._pop(scroll_id)
 
     def clear_scroll_cache(self):
-        keys = [k for k, v in self.cache.items() if v.is_old()]
-        for k in keys:
-            self.cache.pop(k)
-        return len(keys)
+        """
+        Drop the expired contexts, and returns their number.
+        """
+        now = time.monotonic()
+        expired = 0
+        with self._lock:
+            for queue in list(self._queues.values()):
+                while queue:
+                    scroll_id, context = next(iter(queue.items()))
+                    if not context.is_old(now):
+                        break
+                    self._pop(scroll_id)
+                    expired += 1
+            self.nb_expired += expired
+        return expired
+
+
+class ClusterInfo:
+    """
+    Metadata of an elasticsearch cluster, as returned by `GET /`.
+    """
+
+    def __init__(self, info: dict) -> None:
+        assert isinstance(info, dict)
+        version = info.get("version", {})
+        self.info = info
+        self.version: str = version.get("number")
+        self.version_major: int = int(self.version.split(".")[0])
+        self.build_flavor: Optional[str] = version.get("build_flavor")
+        self.cluster_name: Optional[str] = info.get("cluster_name")
+        self.cluster_uuid: Optional[str] = info.get("cluster_uuid")
+
+
+class ClusterInfoCache:
+    """
+    Cache of the metadata of the clusters, per connection. The metadata of a
+    cluster is fetched on first use.
+    """
+
+    def __init__(self) -> None:
+        self._infos: "weakref.WeakKeyDictionary[Elasticsearch, ClusterInfo]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._lock = threading.Lock()
+
+    def cached(self, es) -> Optional[ClusterInfo]:
+        """
+        Returns the metadata of a cluster if already fetched, else None.
+        """
+        with self._lock:
+            return self._infos.get(es)
+
+    def set(self, es, info: dict) -> ClusterInfo:
+        cluster_info = ClusterInfo(info)
+        with self._lock:
+            self._infos[es] = cluster_info
+        return cluster_info
+
+    def get(self, es: Elasticsearch) -> ClusterInfo:
+        info = self.cached(es)
+        return info if info is not None else self.refresh(es)
+
+    def refresh(self, es: Elasticsearch) -> ClusterInfo:
+        return self.set(es, es.info())
+
+    def clear(self):
+        with self._lock:
+            self._infos.clear()
+
+
+cluster_infos = ClusterInfoCache()
 
 
 class ElasticsearchExtClient(ElasticsearchBaseClient):
-    def __init__(self, es: Optional[Elasticsearch] = None):
+    """
+    Elasticsearch client fixing the requests & responses of v7 & v8 clusters
+    so that they behave as v6 ones.
+
+    :param es: Elasticsearch client (default: `Elasticsearch()`).
+    :param instrumentation: Callback (or adapter with an `observe` method, see
+        `RegistryAdapter`) receiving the `RequestMetrics` of each operation
+        listed in `INSTRUMENTED_OPERATIONS`, and of each request of the
+        transport made outside of them. Nothing is measured without it.
+    """
+
+    def __init__(self, es: Optional[Elasticsearch] = None, instrumentation=None):
         self.es = es or Elasticsearch()
-        info = self.es.info()
-        assert info is not None
-        assert isinstance(info, dict)
-        version = info.get("version", {}).get("number")
-        self.version = version
-        self._version_major = int(self.version.split(".")[0])
-        self.name = self.version  # temporary
         self.indices = ElasticsearchExtIndice(parent=self, indices=self.es.indices)
         self.cat = ElasticsearchExtCat(parent=self, cat=self.es.cat)
         self.ingest = ElasticsearchExtIngest(parent=self, ingest=self.es.ingest)
         self.transport = self.es.transport
-        v6_to_v8.fix_transport_instance(self.transport)
+        v6_to_v8.fix_transport_instance(self.transport, instrumentation=instrumentation)
         self.scroll_cache = ScrollsCache()
+        observe = get_observer(instrumentation)
+        if observe is not None:
+            for operation in INSTRUMENTED_OPERATIONS:
+                setattr(
+                    self,
+                    operation,
+                    instrument_operation(observe, operation, getattr(self, operation)),
+                )
+
+    @property
+    def cluster_info(self) -> ClusterInfo:
+        """
+        Metadata of the cluster (fetched on first use, then cached per connection).
+        """
+        return cluster_infos.get(self.es)
+
+    def refresh_cluster_info(self) -> ClusterInfo:
+        """
+        Fetch again the metadata of the cluster (after an upgrade for instance).
+        """
+        return cluster_infos.refresh(self.es)
+
+    @property
+    def version(self) -> str:
+        return self.cluster_info.version
+
+    @property
+    def name(self) -> str:
+        return self.version  # temporary
 
     @property
     def version_major(self) -> int:
-        return self._version_major
+        return self.cluster_info.version_major
 
     @property
     def tasks(self):
@@ -323,17 +608,16 @@ class ElasticsearchExtClient(ElasticsearchBaseClient):
         )
 
     def bulk(self, body, index=None, doc_type=None, **kwargs):
+        """
+        Bulk api. The body may be a str, bytes, a file-like object or an
+        iterable of lines (or dicts). On v7+, only the action lines are
+        rewritten: the source lines are streamed untouched.
+        """
         if self.version_major >= 7:
-            if isinstance(body, str):
-                actions = [json.loads(v.strip()) for v in body.split("\n") if v.strip()]
-                actions = v6_to_v8.fix_actions(actions)
-                body = "\n".join(
-                    [
-                        json.dumps(action) if isinstance(action, dict) else action
-                        for action in actions
-                    ]
-                )
+            body = v6_to_v8.fix_bulk_lines(_iter_bulk_lines(body))
             doc_type = None
+        elif isinstance(body, bytes) or hasattr(body, "read"):
+            body = _iter_bulk_lines(body)
         results = self.es.bulk(body, index=index, doc_type=doc_type, **kwargs)
         return results
 
@@ -425,14 +709,7 @@ class ElasticsearchExtClient(ElasticsearchBaseClient):
         if self.version_major >= 7:
             body = v6_to_v8.fix_search_body(body)
             v6_to_v8.fix_search_params(kwargs)
-            if (
-                isinstance(doc_type, list)
-                and len(doc_type) == 1
-                and isinstance(doc_type[0], str)
-            ):
-                old_doc_type = doc_type[0]
-            elif isinstance(doc_type, str):
-                old_doc_type = doc_type
+            old_doc_type = _get_single_doc_type(doc_type)
             doc_type = None
         search_result = self.es.search(
             index=index, doc_type=doc_type, body=body, **kwargs
@@ -441,9 +718,51 @@ class ElasticsearchExtClient(ElasticsearchBaseClient):
             search_result = v8_to_v6.correct_search_result(
                 results=search_result, doc_type=old_doc_type
             )
-            self.scroll_cache.add_item(results=search_result, doc_type=old_doc_type)
+            self.scroll_cache.add_item(
+                results=search_result,
+                doc_type=old_doc_type,
+                scroll=kwargs.get("scroll"),
+            )
         return search_result
 
+    def msearch(self, body, index=None, doc_type=None, **kwargs):
+        """
+        Multi search api. The body may be NDJSON (str or bytes), a
+        `elasticsearch_dsl.MultiSearch`, or a list of alternated headers &
+        bodies or of `(header, body)` pairs.
+
+        On v7+, headers & bodies are fixed one by one while the request is
+        serialized, and the responses are corrected as for `search`. Failing
+        searches do not fail the whole batch: their response holds an `error`.
+        """
+        if isinstance(body, MultiSearch):
+            index = body._index if index is None else index
+            kwargs = {**body._params, **kwargs}
+        items = _get_msearch_items(body)
+        doc_types: List[str] = []
+        if self.version_major >= 7:
+            doc_types = [
+                _get_single_doc_type(
+                    header.get("type", doc_type)
+                    if isinstance(header, dict)
+                    else doc_type
+                )
+                for header in items[::2]
+            ]
+            items = (
+                v6_to_v8.fix_msearch_item(position, item)
+                for position, item in enumerate(items)
+            )
+            doc_type = None
+        results = self.es.msearch(body=items, index=index, doc_type=doc_type, **kwargs)
+        if self.version_major >= 7 and isinstance(results, dict):
+            for result, old_doc_type in zip(results.get("responses", []), doc_types):
+                if isinstance(result, dict) and "error" not in result:
+                    v8_to_v6.correct_search_result(
+                        results=result, doc_type=old_doc_type
+                    )
+        return results
+
     def helpers_bulk(self, actions, *args, **kwargs):
         if self.version_major >= 7:
             actions = v6_to_v8.fix_actions(actions)
@@ -468,7 +787,9 @@ class ElasticsearchExtClient(ElasticsearchBaseClient):
             "GET", _make_path("_search", "scroll"), params=params, body=body
         )
         if isinstance(r, dict):
-            return self.scroll_cache.fix_results(r)
+            return self.scroll_cache.fix_results(
+                r, scroll=body.get("scroll"), scroll_id=body.get("scroll_id")
+            )
         return r
 
     def clear_scroll(self, scroll_id: Optional[str] = None, body=None, **kwargs):
@@ -476,6 +797,140 @@ class ElasticsearchExtClient(ElasticsearchBaseClient):
             self.scroll_cache.remove(id)
         return self.es.clear_scroll(scroll_id=scroll_id, body=body, **kwargs)
 
+    def _scan_slice_scroll(self, index, doc_type, body, size, keep_alive):
+        """
+        Yield the pages of hits of a slice using a scroll.
+        """
+        results = self.search(
+            index=index, doc_type=doc_type, body=body, scroll=keep_alive, size=size
+        )
+        scroll_id = results.get("_scroll_id")
+        try:
+            while scroll_id and results["hits"]["hits"]:
+                yield results["hits"]["hits"]
+                results = self.scroll(scroll_id=scroll_id, scroll=keep_alive)
+                scroll_id = results.get("_scroll_id")
+        finally:
+            if scroll_id:
+                self.clear_scroll(scroll_id=scroll_id, ignore=(404,))
+
+    def _scan_slice_pit(self, pit_id, doc_type, body, size, keep_alive):
+        """
+        Yield the pages of hits of a slice using a point in time & search_after.
+        """
+        body = {
+            **body,
+            "pit": {"id": pit_id, "keep_alive": keep_alive},
+            "sort": ["_shard_doc"],
+            "track_total_hits": False,
+        }
+        while True:
+            results = self.search(doc_type=doc_type, body=body, size=size)
+            hits = results["hits"]["hits"]
+            if not hits:
+                return
+            yield hits
+            body["pit"] = {
+                "id": results.get("pit_id", pit_id),
+                "keep_alive": keep_alive,
+            }
+            body["search_after"] = hits[-1]["sort"]
+
+    def parallel_scan(
+        self,
+        index,
+        query=None,
+        doc_type=None,
+        slices=4,
+        size=1000,
+        keep_alive="5m",
+        queue_size=None,
+    ) -> Iterator[dict]:
+        """
+        Yield all the hits of a search (in no particular order), fetching
+        `slices` slices concurrently: with a sliced scroll on v6/v7, with a
+        point in time & search_after on v8. The results are corrected as for
+        `search`.
+
+        The pages of hits are passed through a queue of `queue_size` pages
+        (default: 2 per slice), so that the memory used does not depend on the
+        number of hits.
+
+        :param index: Index (or indices) to scan.
+        :param dict query: Search body (query, _source...).
+        :param str doc_type: Doc type of the hits (v6).
+        :param int slices: Number of slices fetched concurrently.
+        :param int size: Number of hits per page.
+        :param str keep_alive: Keep-alive of the scroll / point in time.
+        :param int queue_size: Maximum number of pages waiting to be consumed.
+        """
+        pages = Queue(maxsize=queue_size or 2 * slices)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def scan_slice(slice_pages):
+            try:
+                for page in slice_pages:
+                    if not put(page):
+                        return
+            except Exception as e:
+                put(e)
+            finally:
+                # The consumer waits for the sentinel of every slice: it is
+                # queued even if the scroll can not be cleared.
+                try:
+                    slice_pages.close()
+                except Exception as e:
+                    put(e)
+                put(_SLICE_DONE)
+
+        pit_id = None
+        if self.version_major >= 8:
+            pit_id = self._transport_perform_request(
+                "POST", _make_path(index, "_pit"), params={"keep_alive": keep_alive}
+            )["id"]
+        try:
+            with ThreadPoolExecutor(max_workers=slices) as executor:
+                for slice_id in range(slices):
+                    body = dict(query or {})
+                    if slices > 1:
+                        body["slice"] = {"id": slice_id, "max": slices}
+                    executor.submit(
+                        scan_slice,
+                        self._scan_slice_pit(pit_id, doc_type, body, size, keep_alive)
+                        if pit_id
+                        else self._scan_slice_scroll(
+                            index,
+                            doc_type,
+                            {**body, "sort": ["_doc"]},
+                            size,
+                            keep_alive,
+                        ),
+                    )
+                try:
+                    done = 0
+                    while done < slices:
+                        page = pages.get()
+                        if page is _SLICE_DONE:
+                            done += 1
+                        elif isinstance(page, Exception):
+                            raise page
+                        else:
+                            yield from page
+                finally:
+                    stop.set()
+        finally:
+            if pit_id:
+                self._transport_perform_request("DELETE", "/_pit", body={"id": pit_id})
+
     def mget(self, body, index=None, doc_type=None, **kwargs):
         if self.version_major >= 7:
             doc_type = None
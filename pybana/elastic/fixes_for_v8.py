@@ -1,10 +1,16 @@
 import copy
+import functools
+import hashlib
 import logging
 import json
-from typing import Iterator, Dict, List, Any, Optional, Tuple, Union
+from typing import Iterable, Iterator, Dict, List, Any, Optional, Tuple, Union
 from elasticsearch.client import Transport
 from elasticsearch.exceptions import TransportError
 
+from pybana.helpers.cache import LRUCache
+
+from .instrumentation import get_observer, instrument_transport
+
 logger = logging.getLogger("elasticsearch")
 
 
@@ -69,6 +75,97 @@ def fusion_mappings(mappings: Dict[str, Any], key: str, override=True):
     del mappings[key]
 
 
+# Bulk operations, and those whose action line is followed by a source line.
+BULK_OPS = ("index", "create", "update", "delete")
+BULK_SOURCE_OPS = ("index", "create", "update")
+
+# Number of fixed search bodies (given as strings) kept in cache.
+SEARCH_BODY_CACHE_SIZE = 256
+
+# Number of fixed mappings & templates kept in cache.
+MAPPINGS_CACHE_SIZE = 128
+
+
+class FrozenDict(dict):
+    """
+    Read-only dict, shared by the callers of a cache. Copies (`copy.copy`,
+    `copy.deepcopy` or `thaw`) are mutable.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("%s is read-only, use thaw() to copy it" % type(self).__name__)
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+    __ior__ = _readonly
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+
+class FrozenList(list):
+    """
+    Read-only list, see `FrozenDict`.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("%s is read-only, use thaw() to copy it" % type(self).__name__)
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = clear = extend = insert = pop = remove = reverse = sort = _readonly
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return (type(self), (list(self),))
+
+
+def freeze(value):
+    """
+    Returns a read-only version of a json-like value.
+    """
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    """
+    Returns a mutable (deep) copy of a json-like value.
+    """
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [thaw(v) for v in value]
+    return value
+
+
+def _content_key(kind: str, value: Any) -> Optional[Tuple[str, bytes]]:
+    """
+    Returns a hash of the content of a json-like value (None if it can not be
+    serialized). Key order is kept: it matters when mappings types are fused.
+    """
+    try:
+        dumped = json.dumps(value, separators=(",", ":"))
+    except (TypeError, ValueError):
+        return None
+    return (kind, hashlib.sha1(dumped.encode("utf-8")).digest())
+
+
 HISTOGRAMS_CALENDARS = set(
     [
         "minute",
@@ -141,8 +238,23 @@ def _is_calendar_interval(interval: str) -> bool:
 
 
 class V6ToV8:
-    def fix_transport_instance(self, transport: Transport):
+    # Fixed mappings & templates, keyed by a hash of their content.
+    mappings_cache = LRUCache(maxsize=MAPPINGS_CACHE_SIZE)
+
+    def fix_transport_instance(self, transport: Transport, instrumentation=None):
+        """
+        Wrap the `perform_request` of a transport to fix the errors of v8.
+
+        :param instrumentation: Callback or adapter receiving the
+            `RequestMetrics` of each request (see `pybana.elastic.instrumentation`).
+        """
+        observe = get_observer(instrumentation)
         if hasattr(transport, "_perform_request_v8"):
+            if observe is not None:
+                transport.perform_request = instrument_transport(
+                    transport, transport._perform_request_fixed, observe
+                )
+                return
             print("Transport already fixed for v8")
             return
 
@@ -159,6 +271,34 @@ class V6ToV8:
 
         _perform_request_v8 = transport.perform_request
         transport._perform_request_v8 = _perform_request_v8  # type: ignore
+        transport._perform_request_fixed = new_perform_request  # type: ignore
+        transport.perform_request = new_perform_request
+        if observe is not None:
+            transport.perform_request = instrument_transport(
+                transport, new_perform_request, observe
+            )
+
+    def fix_async_transport_instance(self, transport):
+        """
+        Same as `fix_transport_instance`, for a transport whose
+        `perform_request` is a coroutine function.
+        """
+        if hasattr(transport, "_perform_request_v8"):
+            return
+
+        async def new_perform_request(
+            method, url, headers=None, params=None, body=None
+        ):
+            try:
+                return await transport._perform_request_v8(  # type: ignore
+                    method=method, url=url, headers=headers, params=params, body=body
+                )
+            except TransportError as e:
+                if len(e.args) > 2:
+                    e.args = v6_to_v8.fix_transport_error_args(e.args)
+                raise
+
+        transport._perform_request_v8 = transport.perform_request  # type: ignore
         transport.perform_request = new_perform_request
 
     def fix_dynamic_template(self, dynamic: Dict) -> bool:
@@ -198,37 +338,83 @@ class V6ToV8:
                 changed = True
         return changed
 
+    def _cached(self, kind: str, value: Any, fix):
+        """
+        Returns the fixed version of a mappings or template, cached by content.
+        Results are read-only (see `FrozenDict`) as they are shared.
+        """
+        key = _content_key(kind, value)
+        if key is None:
+            return fix(copy.deepcopy(value))
+        fixed = self.mappings_cache.get(key)
+        if fixed is None:
+            fixed = freeze(fix(thaw(value)))
+            self.mappings_cache[key] = fixed
+        return fixed
+
     def fix_mappings(self, original_mappings: Optional[Dict]) -> Dict:
+        """
+        Fuse the mappings types. Returns a new (mutable) dict: the given
+        mappings are not modified.
+        """
+        return thaw(self._shared_mappings(original_mappings))
+
+    def _shared_mappings(self, original_mappings: Optional[Dict]) -> Dict:
+        """
+        Same as `fix_mappings`, but the fixed mappings are cached by content
+        and read-only. Mappings without types are returned as is.
+        """
         if not original_mappings:
             return {}
         keys = [k for k in original_mappings if k not in ALLOWED_MAPPINGS_KEYS]
         if not keys:
             return original_mappings
+        return self._cached("mappings", original_mappings, self._fix_mappings)
 
-        mappings: Dict = json.loads(json.dumps(original_mappings))
+    def _fix_mappings(self, mappings: Dict) -> Dict:
+        keys = [k for k in mappings if k not in ALLOWED_MAPPINGS_KEYS]
         for key in keys:
             fusion_mappings(mappings=mappings, key=key, override=(key != "_default_"))
         self.fix_dynamic_templates(mappings.get("dynamic_templates"))
         return mappings
 
     def fix_template(self, template: Optional[Dict]) -> Dict:
+        """
+        Fix the mappings of a template (or index creation body), and enable the
+        best compression. Returns a new (mutable) dict: the given template is
+        not modified.
+        """
+        return thaw(self._shared_template(template))
+
+    def _shared_template(self, template: Optional[Dict]) -> Dict:
+        """
+        Same as `fix_template`, but the fixed template is cached by content and
+        read-only.
+        """
         if not template:
             return {}
+        return self._cached("template", template, self._fix_template)
+
+    def _fix_template(self, template: Dict) -> Dict:
         mappings_n = "mappings"
         if mappings_n in template:
-            template[mappings_n] = self.fix_mappings(template[mappings_n])
+            template[mappings_n] = self._shared_mappings(template[mappings_n])
         get_sub_dict(template, ["settings", "index"])["codec"] = "best_compression"
         return template
 
     def _remove_type(self, action):
-        if isinstance(action, list):
-            for v in action:
-                self._remove_type(v)
-        elif isinstance(action, dict):
-            if "_type" in action:
-                del action["_type"]
-            for v in action.values():
-                self._remove_type(v)
+        """
+        Remove the `_type` from the metadata of a bulk action: at the top level
+        (actions of `helpers.bulk`) and in its op header (`{"index": {...}}`).
+        The document itself is never walked.
+        """
+        if not isinstance(action, dict):
+            return
+        action.pop("_type", None)
+        if len(action) == 1:
+            op, header = next(iter(action.items()))
+            if op in BULK_OPS and isinstance(header, dict):
+                header.pop("_type", None)
 
     def fix_actions(
         self, origin_actions: Union[Iterator[Dict], List[Dict], None]
@@ -239,6 +425,27 @@ class V6ToV8:
             self._remove_type(action)
             yield action
 
+    def fix_bulk_lines(self, lines: Iterable[Union[str, Dict]]) -> Iterator[Any]:
+        """
+        Fix the non-empty lines (or dicts) of a bulk body one by one. Only the
+        action lines are parsed (and dumped again if they changed): the source
+        lines are passed through untouched.
+        """
+        expect_source = False
+        for line in lines:
+            if expect_source:
+                expect_source = False
+                yield line
+                continue
+            action = json.loads(line) if isinstance(line, str) else line
+            if isinstance(action, dict):
+                expect_source = next(iter(action), None) in BULK_SOURCE_OPS
+                if isinstance(line, str) and '"_type"' not in line:
+                    yield line
+                    continue
+                action = next(self.fix_actions([action]))
+            yield json.dumps(action) if isinstance(line, str) else action
+
     def fix_histogram(self, params: Union[List, Dict]):
         if isinstance(params, list):
             for v in params:
@@ -258,28 +465,77 @@ class V6ToV8:
                 elif isinstance(v, dict) or isinstance(v, list):
                     self.fix_histogram(v)
 
+    def fixed_histograms(self, params: Any) -> Any:
+        """
+        Same as `fix_histogram` but without modifying `params`: only the dicts &
+        lists leading to a date histogram are copied, other values are shared.
+        Returns `params` itself if there is nothing to fix.
+        """
+        fixed: Any = None
+        if isinstance(params, dict):
+            for k, v in params.items():
+                if k == "date_histogram" and isinstance(v, dict) and "interval" in v:
+                    interval = v["interval"]
+                    new = {key: value for key, value in v.items() if key != "interval"}
+                    new[
+                        "calendar_interval"
+                        if _is_calendar_interval(interval)
+                        else "fixed_interval"
+                    ] = interval
+                elif isinstance(v, (dict, list)):
+                    new = self.fixed_histograms(v)
+                    if new is v:
+                        continue
+                else:
+                    continue
+                if fixed is None:
+                    fixed = dict(params)
+                fixed[k] = new
+        elif isinstance(params, list):
+            for i, v in enumerate(params):
+                if isinstance(v, (dict, list)):
+                    new = self.fixed_histograms(v)
+                    if new is not v:
+                        if fixed is None:
+                            fixed = list(params)
+                        fixed[i] = new
+        return params if fixed is None else fixed
+
     def fix_search_body(
         self, params: Optional[Union[Dict, str]]
     ) -> Optional[Union[Dict, str]]:
+        """
+        Returns the search body fixed for v8, or `params` itself if there is
+        nothing to fix. `params` is never modified but the fixed body may share
+        its unchanged parts.
+        """
         if not params:
             return params
-        try:
-            to_change = json.loads(params) if isinstance(params, str) else params
-        except (ValueError, TypeError):
-            return params
-        if not isinstance(to_change, dict):
+        if isinstance(params, str):
+            return _fix_search_body_str(params)
+        if not isinstance(params, dict):
             return params
-        changed = copy.deepcopy(to_change)
+        changed = self.fixed_histograms(params)
         if "doc_type" in changed:
-            del changed["doc_type"]
-        self.fix_histogram(changed)
-        if changed == to_change:
-            return params
-        return (
-            changed
-            if not isinstance(params, str)
-            else json.dumps(changed, sort_keys=True)
-        )
+            changed = {k: v for k, v in changed.items() if k != "doc_type"}
+        return changed
+
+    def fix_msearch_item(self, position: int, item: Any) -> Any:
+        """
+        Fix an item of a msearch body (a header at even positions, a search
+        body at odd positions).
+        """
+        if position % 2 == 0:
+            if isinstance(item, dict) and "type" in item:
+                return {k: v for k, v in item.items() if k != "type"}
+            return item
+        return self.fix_search_body(item)
+
+    def fix_msearch_body(self, items: List[Any]) -> List[Any]:
+        """
+        Fix a msearch body given as a list of alternated headers and bodies.
+        """
+        return [self.fix_msearch_item(i, item) for i, item in enumerate(items)]
 
     def fix_search_params(self, params: Dict[str, Any]) -> Dict[str, Any]:
         # for the moment, only those params found, will probably add more rules later
@@ -316,3 +572,20 @@ class V6ToV8:
 
 v6_to_v8 = V6ToV8()
 v8_to_v6 = V8ToV6()
+
+
+@functools.lru_cache(maxsize=SEARCH_BODY_CACHE_SIZE)
+def _fix_search_body_str(params: str) -> str:
+    # Nothing to fix without an interval or a doc_type: skip the parsing.
+    if '"interval"' not in params and '"doc_type"' not in params:
+        return params
+    try:
+        to_change = json.loads(params)
+    except ValueError:
+        return params
+    if not isinstance(to_change, dict):
+        return params
+    changed = v6_to_v8.fix_search_body(to_change)
+    if changed is to_change:
+        return params
+    return json.dumps(changed, sort_keys=True)
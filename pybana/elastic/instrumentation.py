@@ -0,0 +1,248 @@
+"""
+Per-request instrumentation of `ElasticsearchExtClient` and of the transports
+fixed by `V6ToV8.fix_transport_instance`.
+
+Instrumentation is installed only when given: clients & transports created
+without it run exactly the same code as before.
+"""
+
+import inspect
+import threading
+import time
+from typing import Any, Callable, Optional
+
+__all__ = (
+    "RegistryAdapter",
+    "RequestMetrics",
+    "get_observer",
+    "instrument_operation",
+    "instrument_transport",
+)
+
+# Metrics of the operation (or transport request) in progress, per thread.
+_current = threading.local()
+
+
+class RequestMetrics:
+    """
+    Measures of an operation of `ElasticsearchExtClient` (or of a request of a
+    transport used outside of any operation).
+
+    :ivar str operation: Name of the operation (`search`, `bulk`...), or
+        `"<METHOD> <path>"` for a bare transport request.
+    :ivar index: Index (or indices) targeted, if any.
+    :ivar int request_bytes: Size of the serialized request bodies.
+    :ivar int response_bytes: Size of the raw response bodies.
+    :ivar int took: Server-side duration (in ms) reported by elasticsearch.
+    :ivar float wall_time: Duration (in seconds) of the operation.
+    :ivar float transport_time: Time (in seconds) spent in the transport
+        (serialization, network & deserialization).
+    :ivar float client_overhead_time: Rest of the wall time (in seconds),
+        spent in the clients: pybana rewriting requests & responses between
+        versions, and elasticsearch-py preparing the requests (e.g. the lines
+        of `msearch` & `bulk` bodies given as lists).
+    :ivar int nb_requests: Number of HTTP requests.
+    :ivar Exception error: Error raised by the operation, if any.
+    """
+
+    __slots__ = (
+        "operation",
+        "index",
+        "request_bytes",
+        "response_bytes",
+        "took",
+        "wall_time",
+        "transport_time",
+        "client_overhead_time",
+        "nb_requests",
+        "error",
+    )
+
+    def __init__(self, operation: str, index: Any = None) -> None:
+        self.operation = operation
+        self.index = index
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.took: Optional[int] = None
+        self.wall_time = 0.0
+        self.transport_time = 0.0
+        self.client_overhead_time = 0.0
+        self.nb_requests = 0
+        self.error: Optional[Exception] = None
+
+    def __repr__(self):
+        return "RequestMetrics(%s)" % ", ".join(
+            "%s=%r" % (name, getattr(self, name)) for name in self.__slots__
+        )
+
+    def add_took(self, response):
+        if isinstance(response, dict) and isinstance(response.get("took"), int):
+            self.took = (self.took or 0) + response["took"]
+
+
+class RegistryAdapter:
+    """
+    Feed a metrics registry with the measures of each request. `observe` is
+    called once per measure with a name (prefixed), a value and labels
+    (`operation` & `index`), which maps on the histograms of most registries.
+
+    :param observe: Callable `(name, value, labels)`.
+    :param str prefix: Prefix of the names of the measures.
+    """
+
+    MEASURES = (
+        ("wall_seconds", "wall_time"),
+        ("transport_seconds", "transport_time"),
+        ("client_overhead_seconds", "client_overhead_time"),
+        ("request_bytes", "request_bytes"),
+        ("response_bytes", "response_bytes"),
+        ("took_milliseconds", "took"),
+    )
+
+    def __init__(self, observe: Callable, prefix: str = "pybana_elasticsearch"):
+        self._observe = observe
+        self.prefix = prefix
+
+    def observe(self, metrics: RequestMetrics):
+        index = metrics.index
+        labels = {
+            "operation": metrics.operation,
+            "index": ",".join(index) if isinstance(index, (list, tuple)) else index,
+            "error": type(metrics.error).__name__ if metrics.error else "",
+        }
+        for name, attr in self.MEASURES:
+            value = getattr(metrics, attr)
+            if value is not None:
+                self._observe("%s_%s" % (self.prefix, name), value, labels)
+
+
+def get_observer(instrumentation) -> Optional[Callable[[RequestMetrics], Any]]:
+    """
+    Returns the callable receiving the metrics: the instrumentation itself if
+    it is a callback, or its `observe` method (see `RegistryAdapter`).
+    """
+    if instrumentation is None:
+        return None
+    if hasattr(instrumentation, "observe"):
+        return instrumentation.observe
+    if not callable(instrumentation):
+        raise TypeError("instrumentation must be a callable or have an observe method")
+    return instrumentation
+
+
+def get_current() -> Optional[RequestMetrics]:
+    return getattr(_current, "metrics", None)
+
+
+def instrument_operation(observe, operation, method):
+    """
+    Wrap a (bound) method of a client so that each call is measured and
+    reported. The requests of its transport are accounted to the call.
+
+    :param observe: Callable receiving the `RequestMetrics`.
+    :param str operation: Name of the operation.
+    :param method: Method to wrap.
+    """
+    signature = inspect.signature(method)
+
+    def instrumented(*args, **kwargs):
+        if get_current() is not None:
+            # Nested operation: accounted to the outer one.
+            return method(*args, **kwargs)
+        try:
+            index = signature.bind_partial(*args, **kwargs).arguments.get("index")
+        except TypeError:
+            index = None
+        metrics = RequestMetrics(operation, index)
+        _current.metrics = metrics
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except Exception as e:
+            metrics.error = e
+            raise
+        finally:
+            _current.metrics = None
+            metrics.wall_time = time.perf_counter() - start
+            metrics.client_overhead_time = max(
+                metrics.wall_time - metrics.transport_time, 0.0
+            )
+            observe(metrics)
+
+    instrumented.__wrapped__ = method  # type: ignore
+    instrumented.__doc__ = method.__doc__
+    return instrumented
+
+
+class MeasuringDeserializer:
+    """
+    Deserializer of a transport counting the size of the raw responses in the
+    metrics of the current request.
+    """
+
+    def __init__(self, deserializer) -> None:
+        self.deserializer = deserializer
+
+    def __getattr__(self, name):
+        return getattr(self.deserializer, name)
+
+    def loads(self, s, mimetype=None):
+        metrics = get_current()
+        if metrics is not None and s:
+            metrics.response_bytes += len(s)
+        return self.deserializer.loads(s, mimetype)
+
+
+def index_of_path(url: str) -> Optional[str]:
+    """
+    Returns the index targeted by a request path (None for apis like `/_search`).
+    """
+    first = url.lstrip("/").split("/", 1)[0]
+    return first if first and not first.startswith("_") else None
+
+
+def instrument_transport(transport, perform_request, observe):
+    """
+    Returns a `perform_request` for a transport measuring each request: its
+    metrics are added to the ones of the operation in progress, or reported on
+    their own outside of any operation.
+
+    :param transport: Transport (its deserializer is replaced by a `MeasuringDeserializer`).
+    :param perform_request: Function performing the requests.
+    :param observe: Callable receiving the `RequestMetrics`.
+    """
+    if not isinstance(transport.deserializer, MeasuringDeserializer):
+        transport.deserializer = MeasuringDeserializer(transport.deserializer)
+
+    def instrumented_perform_request(method, url, headers=None, params=None, body=None):
+        parent = get_current()
+        metrics = parent
+        if metrics is None:
+            metrics = RequestMetrics("%s %s" % (method, url), index_of_path(url))
+            _current.metrics = metrics
+        start = time.perf_counter()
+        try:
+            if body is not None:
+                body = transport.serializer.dumps(body)
+                if isinstance(body, str):
+                    body = body.encode("utf-8", "surrogatepass")
+                metrics.request_bytes += len(body)
+            response = perform_request(
+                method=method, url=url, headers=headers, params=params, body=body
+            )
+            metrics.add_took(response)
+            return response
+        except Exception as e:
+            if parent is None:
+                metrics.error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.transport_time += elapsed
+            metrics.nb_requests += 1
+            if parent is None:
+                _current.metrics = None
+                metrics.wall_time = elapsed
+                observe(metrics)
+
+    return instrumented_perform_request
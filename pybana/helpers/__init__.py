@@ -1,3 +1,4 @@
+from .cache import *  # NOQA
 from .datasweet import *  # NOQA
 from .datetime import *  # NOQA
 from .math import *  # NOQA
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+import threading
+
+__all__ = ("LRUCache",)
+
+
+class LRUCache:
+    """
+    Thread-safe mapping bounded by its number of items (and optionally by the
+    total size of its items). When full, the least recently used items are
+    dropped.
+
+    Hits & misses of `get` are counted in `hits` and `misses`.
+
+    :param int maxsize: Maximum number of items.
+    :param int maxbytes: Maximum total size of the items (as given to `set`).
+    """
+
+    def __init__(self, maxsize=128, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def keys(self):
+        with self._lock:
+            return list(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size=0):
+        """
+        Store an item of the given size (in bytes).
+        """
+        with self._lock:
+            self.pop(key)
+            self._items[key] = value
+            self._sizes[key] = size
+            self.nbytes += size
+            while len(self._items) > self.maxsize or (
+                self.maxbytes is not None and self.nbytes > self.maxbytes
+            ):
+                self.pop(next(iter(self._items)))
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            self.nbytes -= self._sizes.pop(key)
+            return self._items.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
@@ -1,10 +1,31 @@
 # -*- coding: utf-8 -*-
 
 import ast
+import functools
 import math
 import re
 
-__all__ = ("DatasweetTransformer",)
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+__all__ = (
+    "DatasweetTransformer",
+    "UnsupportedFormulaError",
+    "datasweet_compile",
+    "datasweet_eval_series",
+)
+
+# Maximum number of compiled formulas kept in memory.
+DATASWEET_CACHE_SIZE = 1024
+
+
+class UnsupportedFormulaError(ValueError):
+    """
+    Raised when a datasweet formula can not be evaluated or compiled by a
+    given backend (numpy series, painless...).
+    """
 
 
 def is_variable(name):
@@ -130,31 +151,203 @@ class DatasweetTransformer(ast.NodeTransformer):
         return node
 
 
-def datasweet_eval(expr, bucket):
+def datasweet_parse(expr):
+    """
+    Parse and validate a datasweet formula. Returns the `ast.Expression`.
+
+    :param string expr: The datasweet formula.
+    """
     fixed_expr = re.sub(r"([^\w_]*)if\(", r"\1_if(", expr)
     tree = ast.parse(fixed_expr, mode="eval")
-    tree = DatasweetTransformer().visit(tree)
+    return DatasweetTransformer().visit(tree)
+
+
+@functools.lru_cache(maxsize=DATASWEET_CACHE_SIZE)
+def datasweet_compile(expr):
+    """
+    Validate and compile a datasweet formula.
+
+    Compiled formulas are kept in a bounded LRU cache so that a formula is only
+    parsed once whatever the number of buckets it is evaluated on. Use
+    `datasweet_compile.cache_info()` to monitor hits & misses.
+
+    :param string expr: The datasweet formula.
+    """
+    return compile(datasweet_parse(expr), "a", mode="eval")
+
+
+@functools.lru_cache(maxsize=DATASWEET_CACHE_SIZE)
+def datasweet_compile_series(expr):
+    """
+    Validate and compile a datasweet formula for `datasweet_eval_series`.
+
+    An `UnsupportedFormulaError` is raised if the formula uses constructions
+    which can not be applied on numpy arrays (boolean operators, ternary
+    expressions or chained comparisons).
+
+    :param string expr: The datasweet formula.
+    """
+    tree = datasweet_parse(expr)
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, (ast.BoolOp, ast.IfExp))
+            or (isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not))
+            or (isinstance(node, ast.Compare) and len(node.ops) > 1)
+        ):
+            raise UnsupportedFormulaError(
+                f"{node.__class__.__name__} can not be evaluated on series"
+            )
+    return compile(tree, "a", mode="eval")
+
+
+def datasweet_value(value):
+    """
+    Returns the value of an aggregation node of a bucket.
+    """
+    if "hits" in value:
+        hits = value["hits"].get("hits", [])
+        if len(hits) > 0 and "_source" in value["hits"]["hits"][0]:
+            val = list(value["hits"]["hits"][0]["_source"].values())[0]
+        else:
+            val = None
+    else:
+        # TODO. Ugly. fix this.
+        # count agg are not supported here
+        val = (
+            value["std_deviation"]
+            if "std_deviation" in value
+            else value["values"]["50.0"]
+            if "values" in value
+            else value["value"]
+        )
+    return float("nan") if val is None else val
+
+
+def datasweet_eval(expr, bucket):
+    code = datasweet_compile(expr)
     scope = {}
     for key, value in bucket.items():
         if key.isdigit():
-            if "hits" in value:
-                hits = value["hits"].get("hits", [])
-                if len(hits) > 0 and "_source" in value["hits"]["hits"][0]:
-                    val = list(value["hits"]["hits"][0]["_source"].values())[0]
-                else:
-                    val = None
-            else:
-                # TODO. Ugly. fix this.
-                # count agg are not supported here
-                val = (
-                    value["std_deviation"]
-                    if "std_deviation" in value
-                    else value["values"]["50.0"]
-                    if "values" in value
-                    else value["value"]
-                )
-            scope[f"agg{key}"] = float("nan") if val is None else val
+            scope[f"agg{key}"] = datasweet_value(value)
     try:
-        return eval(compile(tree, "a", mode="eval"), FUNCS, scope)
+        return eval(code, FUNCS, scope)
     except ZeroDivisionError:
         return None
+
+
+def _series(arg):
+    return np.asarray(arg, dtype=float)
+
+
+def _series_reducer(reduce, elementwise):
+    """
+    Build a series function which reduces a single serie (and broadcast the
+    result) or which is applied elementwise when given several arguments.
+    """
+
+    def func(*args):
+        if len(args) == 1 and np.ndim(args[0]):
+            serie = _series(args[0])
+            return np.full(serie.shape, reduce(serie))
+        return elementwise(np.broadcast_arrays(*map(_series, args)))
+
+    return func
+
+
+def series_cusum(serie):
+    return np.cumsum(_series(serie))
+
+
+def series_derivative(serie):
+    serie = _series(serie)
+    return np.concatenate(([float("nan")], np.diff(serie)))
+
+
+def series_next(serie):
+    serie = _series(serie)
+    return np.concatenate((serie[1:], [float("nan")]))
+
+
+def series_prev(serie):
+    serie = _series(serie)
+    return np.concatenate(([float("nan")], serie[:-1]))
+
+
+def series_if(cond, yes, no):
+    cond = np.asarray(cond, dtype=bool)
+    try:
+        yes = _series(yes)
+    except (ValueError, TypeError):
+        return np.where(cond, yes, no)
+    return np.where(cond & ~np.isnan(yes), yes, no)
+
+
+def series_ifnan(arg, default_value):
+    arg = _series(arg)
+    return np.where(np.isnan(arg), default_value, arg)
+
+
+# Array-aware implementation of FUNCS (requires numpy).
+SERIES_FUNCS = {}
+if np is not None:
+    SERIES_FUNCS.update(
+        {
+            "avg": _series_reducer(np.mean, lambda args: np.mean(args, axis=0)),
+            "ceil": np.ceil,
+            "count": _series_reducer(
+                len, lambda args: np.full(args[0].shape, len(args))
+            ),
+            "cusum": series_cusum,
+            "derivative": series_derivative,
+            "floor": np.floor,
+            "_if": series_if,
+            "ifnan": series_ifnan,
+            "min": _series_reducer(np.min, lambda args: np.min(args, axis=0)),
+            "max": _series_reducer(np.max, lambda args: np.max(args, axis=0)),
+            "next": series_next,
+            "prev": series_prev,
+            "round": np.round,
+            "sum": _series_reducer(np.sum, lambda args: np.sum(args, axis=0)),
+            "trunc": np.trunc,
+        }
+    )
+
+
+def datasweet_eval_series(expr, buckets):
+    """
+    Evaluate a datasweet formula once over a whole list of buckets.
+
+    Each `aggX` variable is bound to the column of its values across the buckets
+    so that series functions (`cusum`, `derivative`, `prev`…) behave as in kibana.
+    Returns the list of values (one per bucket). Non finite values are returned
+    as None.
+
+    numpy is required (`pip install pybana[series]`). An
+    `UnsupportedFormulaError` is raised if the formula can not be evaluated on
+    series.
+
+    :param string expr: The datasweet formula.
+    :param list buckets: Buckets of the response.
+    """
+    if np is None:
+        raise ImportError("datasweet_eval_series requires numpy (pybana[series])")
+    code = datasweet_compile_series(expr)
+    keys = {key for bucket in buckets for key in bucket if key.isdigit()}
+    scope = {}
+    for key in keys:
+        values = [
+            datasweet_value(bucket[key]) if key in bucket else float("nan")
+            for bucket in buckets
+        ]
+        try:
+            scope[f"agg{key}"] = np.array(values, dtype=float)
+        except (ValueError, TypeError):
+            scope[f"agg{key}"] = np.array(values, dtype=object)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ret = np.broadcast_to(eval(code, SERIES_FUNCS, scope), (len(buckets),))
+    return [
+        None
+        if value is None or (isinstance(value, float) and not math.isfinite(value))
+        else value
+        for value in ret.tolist()
+    ]
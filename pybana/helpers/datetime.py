@@ -1,12 +1,22 @@
+import bisect
+import datetime
 import json
 import re
 
 import pendulum
+from pendulum.formatting.formatter import Formatter
+from pendulum.locales.locale import Locale
+
+from .cache import LRUCache
 
 __all__ = (
+    "compile_date_format",
     "convert",
+    "DateFormatter",
     "format_timestamp",
     "get_scaled_date_format",
+    "get_scaled_date_formats",
+    "ScaledDateFormats",
     "TOKEN_MAPPINGS",
     "UnknownMomentTokenError",
 )
@@ -127,23 +137,275 @@ def convert(fmt, ignore=True):
         raise
 
 
-def format_timestamp(timestamp, fmt=None, locale=None):
-    value = pendulum.from_timestamp(timestamp * 1e-3)
-    if fmt:
-        _fmt = convert(fmt)
+# Tokens of pendulum formats which are plain attributes of a datetime.
+_ATTRIBUTE_TOKENS = {
+    "YYYY": "{0.year:d}",
+    "Y": "{0.year:d}",
+    "MM": "{0.month:02d}",
+    "M": "{0.month:d}",
+    "DD": "{0.day:02d}",
+    "D": "{0.day:d}",
+    "HH": "{0.hour:02d}",
+    "H": "{0.hour:d}",
+    "mm": "{0.minute:02d}",
+    "m": "{0.minute:d}",
+    "ss": "{0.second:02d}",
+    "s": "{0.second:d}",
+    "SSSSSS": "{0.microsecond:06d}",
+}
+
+# Tokens of pendulum formats computed from a datetime.
+_COMPUTED_TOKENS = {
+    "YY": lambda dt: "{:d}".format(dt.year)[2:],
+    "Q": lambda dt: "{:d}".format((dt.month + 2) // 3),
+    "DDDD": lambda dt: "{:03d}".format(dt.timetuple().tm_yday),
+    "DDD": lambda dt: "{:d}".format(dt.timetuple().tm_yday),
+    "d": lambda dt: "{:d}".format(dt.isoweekday() % 7),
+    "E": lambda dt: "{:d}".format(dt.isoweekday()),
+    "hh": lambda dt: "{:02d}".format(dt.hour % 12 or 12),
+    "h": lambda dt: "{:d}".format(dt.hour % 12 or 12),
+    "S": lambda dt: "{:01d}".format(dt.microsecond // 100000),
+    "SS": lambda dt: "{:02d}".format(dt.microsecond // 10000),
+    "SSS": lambda dt: "{:03d}".format(dt.microsecond // 1000),
+    "SSSS": lambda dt: "{:04d}".format(dt.microsecond // 100),
+    "SSSSS": lambda dt: "{:05d}".format(dt.microsecond // 10),
+    "zz": lambda dt: dt.tzname() or "",
+}
+
+# Localized tokens: (translation, value of a datetime) or ordinals.
+_TRANSLATED_TOKENS = {
+    "MMM": ("translations.months.abbreviated", lambda dt: dt.month),
+    "MMMM": ("translations.months.wide", lambda dt: dt.month),
+    "dd": ("translations.days.short", lambda dt: dt.isoweekday() % 7),
+    "ddd": ("translations.days.abbreviated", lambda dt: dt.isoweekday() % 7),
+    "dddd": ("translations.days.wide", lambda dt: dt.isoweekday() % 7),
+}
+_ORDINAL_TOKENS = {
+    "Do": (range(1, 32), lambda dt: dt.day),
+    "do": (range(0, 7), lambda dt: dt.isoweekday() % 7),
+    "Mo": (range(1, 13), lambda dt: dt.month),
+    "Qo": (range(1, 5), lambda dt: (dt.month + 2) // 3),
+    "DDDo": (range(1, 367), lambda dt: dt.timetuple().tm_yday),
+}
+
+# Compiled formatters, by (format, locale, timezone).
+DATE_FORMATTERS_CACHE = LRUCache(maxsize=256)
+
+
+class DateFormatter:
+    """
+    Formatter of epoch timestamps (in ms, such as the keys of `date_histogram`
+    buckets) compiled once for a moment format, a locale & a timezone.
+
+    The format is converted & tokenized at compilation: formatting a timestamp
+    is then a single `str.format` of a `datetime`, with the same output as
+    pendulum. Use `compile_date_format` to share the compiled formatters.
+
+    :param str fmt: Moment format (None for ISO 8601).
+    :param str locale: Locale of the names of months & days (default: pendulum's locale).
+        Unknown locales fall back on the default one.
+    :param str tz: Timezone of the formatted dates.
+    """
+
+    def __init__(self, fmt=None, locale=None, tz="UTC"):
+        self.fmt = fmt
+        self.tz = tz
+        self._tzinfo = pendulum.timezone(tz)
+        self._fixed = self._tzinfo.utcoffset(None) is not None
+        self._epoch = datetime.datetime(
+            1970, 1, 1, tzinfo=self._tzinfo if self._fixed else pendulum.UTC
+        )
         try:
-            return value.format(_fmt, locale=locale)
+            self.locale = Locale.load(locale or pendulum.get_locale())
         except ValueError:
-            return value.format(_fmt)
-    return value.isoformat()
+            self.locale = Locale.load(pendulum.get_locale())
+        self._template = None
+        self._functions = []
+        if fmt:
+            self._template = self._compile(convert(fmt, ignore=False))
 
+    def _compile(self, fmt):
+        """
+        Returns the template of a pendulum format, adding the functions of its
+        computed tokens to `_functions`.
+        """
+        template = []
+        end = 0
+        for match in Formatter._FORMAT_RE.finditer(fmt):
+            template.append(self._literal(fmt[end : match.start()]))
+            template.append(self._token(match))
+            end = match.end()
+        template.append(self._literal(fmt[end:]))
+        return "".join(template)
 
-def get_scaled_date_format(config, interval):
+    @staticmethod
+    def _literal(text):
+        return text.replace("{", "{{").replace("}", "}}")
+
+    def _function(self, function):
+        self._functions.append(function)
+        return "{%d}" % len(self._functions)
+
+    def _token(self, match):
+        if match.group(1) or match.group(2):
+            return self._literal(match.group(1) or match.group(2))
+        token = match.group(3)
+        locale = self.locale
+        if token in Formatter._DATE_FORMATS:
+            fmt = locale.get("custom.date_formats.{}".format(token))
+            return self._compile(fmt or Formatter._DEFAULT_DATE_FORMATS[token])
+        if token in _ATTRIBUTE_TOKENS:
+            return _ATTRIBUTE_TOKENS[token]
+        if token in _COMPUTED_TOKENS:
+            return self._function(_COMPUTED_TOKENS[token])
+        if token in _TRANSLATED_TOKENS:
+            translation, value = _TRANSLATED_TOKENS[token]
+            names = locale.get(translation)
+            return self._function(lambda dt: names[value(dt)])
+        if token in _ORDINAL_TOKENS:
+            values, value = _ORDINAL_TOKENS[token]
+            ordinals = {number: locale.ordinalize(number) for number in values}
+            return self._function(lambda dt: ordinals[value(dt)])
+        if token == "A":
+            periods = (
+                locale.get("translations.day_periods.am"),
+                locale.get("translations.day_periods.pm"),
+            )
+            return self._function(lambda dt: periods[dt.hour >= 12])
+        # Less common tokens (timestamps, weeks, offsets...) are left to pendulum.
+        formatter = Formatter()
+        return self._function(
+            lambda dt: formatter._format_token(pendulum.instance(dt), token, locale)
+            or ""
+        )
+
+    def datetime(self, timestamp):
+        """
+        Returns the (aware) datetime of an epoch timestamp in ms.
+        """
+        value = self._epoch + datetime.timedelta(milliseconds=timestamp)
+        return value if self._fixed else value.astimezone(self._tzinfo)
+
+    def __call__(self, timestamp):
+        value = self.datetime(timestamp)
+        if self._template is None:
+            return value.isoformat()
+        return self._template.format(value, *[f(value) for f in self._functions])
+
+    def format_many(self, timestamps, memo=None):
+        """
+        Format a list of epoch timestamps in ms (such as the keys of the
+        buckets of a `date_histogram`). Repeated timestamps are formatted once.
+
+        :param timestamps: Iterable of timestamps.
+        :param dict memo: Timestamps already formatted, updated with the new
+            ones (to share them between several lists).
+        """
+        epoch, fixed, tzinfo = self._epoch, self._fixed, self._tzinfo
+        functions = self._functions
+        format = self._template.format if self._template is not None else None
+        timedelta = datetime.timedelta
+        formatted = {} if memo is None else memo
+        result = []
+        for timestamp in timestamps:
+            value = formatted.get(timestamp)
+            if value is None:
+                value = epoch + timedelta(milliseconds=timestamp)
+                if not fixed:
+                    value = value.astimezone(tzinfo)
+                if format is None:
+                    value = value.isoformat()
+                elif functions:
+                    value = format(value, *[f(value) for f in functions])
+                else:
+                    value = format(value)
+                formatted[timestamp] = value
+            result.append(value)
+        return result
+
+
+def compile_date_format(fmt=None, locale=None, tz="UTC"):
+    """
+    Returns the (shared) `DateFormatter` of a moment format, a locale & a timezone.
+
+    :param str fmt: Moment format (None for ISO 8601).
+    :param str locale: Locale (default: pendulum's locale).
+    :param str tz: Timezone.
+    """
+    key = (fmt or None, locale or pendulum.get_locale(), tz)
+    formatter = DATE_FORMATTERS_CACHE.get(key)
+    if formatter is None:
+        formatter = DateFormatter(*key)
+        DATE_FORMATTERS_CACHE.set(key, formatter)
+    return formatter
+
+
+def format_timestamp(timestamp, fmt=None, locale=None):
+    return compile_date_format(fmt, locale)(timestamp)
+
+
+class ScaledDateFormats:
+    """
+    Table of the date formats by interval of the `dateFormat:scaled` setting
+    of kibana: the format of an interval is the one of the greatest duration
+    lower than (or equal to) the interval.
+
+    The durations are parsed once and sorted, and a format is looked up by
+    bisection. Entries which can never be reached (after an entry without
+    duration, or with a greater duration than a following one) are dropped.
+
+    :param str scaled: JSON list of `[duration, format]` (`dateFormat:scaled`).
+    :param str default: Format of the intervals lower than all the durations
+        (`dateFormat`).
+    """
+
+    def __init__(self, scaled="[]", default=None):
+        durations = []
+        formats = []
+        bound = None
+        for duration, date_format in reversed(json.loads(scaled)):
+            if not duration:
+                default = date_format
+                break
+            duration = pendulum.parse(duration)
+            if bound is None or duration < bound:
+                durations.append(duration)
+                formats.append(date_format)
+                bound = duration
+        durations.reverse()
+        formats.reverse()
+        self.durations = durations
+        self.formats = formats
+        self.default = default
+
+    def get(self, interval):
+        """
+        Returns the date format of an interval.
+        """
+        position = bisect.bisect_right(self.durations, interval)
+        return self.formats[position - 1] if position else self.default
+
+
+# Tables of the scaled date formats, by settings.
+SCALED_DATE_FORMATS_CACHE = LRUCache(maxsize=64)
+
+
+def get_scaled_date_formats(config):
+    """
+    Returns the (shared) `ScaledDateFormats` of a kibana config. The table is
+    parsed once per value of the settings, hence once per version of the
+    config document.
+
+    :param Config config: Kibana config.
+    """
     config = config.config.to_dict()
-    scaled_date_formats = json.loads(config.get("dateFormat:scaled", "[]"))
-    scaled_date_formats.reverse()
-    default_date_format = config.get("dateFormat")
-    for (duration, date_format) in scaled_date_formats:
-        if not duration or interval >= pendulum.parse(duration):
-            return date_format
-    return default_date_format
+    key = (config.get("dateFormat:scaled", "[]"), config.get("dateFormat"))
+    table = SCALED_DATE_FORMATS_CACHE.get(key)
+    if table is None:
+        table = ScaledDateFormats(*key)
+        SCALED_DATE_FORMATS_CACHE.set(key, table)
+    return table
+
+
+def get_scaled_date_format(config, interval):
+    return get_scaled_date_formats(config).get(interval)
@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
 
 import json
+import time
+import weakref
 
 from elasticsearch import NotFoundError
 from elasticsearch_dsl import Document, Keyword
+from elasticsearch_dsl.utils import AttrDict, AttrList
+
+from pybana.helpers.cache import LRUCache
 
 from pybana.kibana_refs import (
     first_input_control_index_pattern_ref,
@@ -17,21 +22,122 @@ __all__ = (
     "IndexPattern",
     "Visualization",
     "Dashboard",
+    "SavedObjectCache",
+    "SavedObjectGraph",
+    "aget_document",
+    "aget_index_pattern_or_data_view",
+    "aget_index_pattern_or_data_view_flexible",
+    "amget_documents",
     "get_index_pattern_or_data_view",
     "get_index_pattern_or_data_view_flexible",
 )
 
 
-def get_index_pattern_or_data_view(document_id, index, using=None):
+# Caches of saved objects, notified when a document is saved or deleted.
+_SAVED_OBJECT_CACHES = weakref.WeakSet()
+
+
+def hit_revision(hit):
+    """
+    Returns the revision of a raw document (see `BaseDocument.revision`).
+    """
+    if "_seq_no" in hit and "_primary_term" in hit:
+        return (hit["_seq_no"], hit["_primary_term"])
+    return hit.get("_version")
+
+
+class SavedObjectCache:
+    """
+    In-process cache of kibana saved objects, keyed by connection, index and
+    document id, and bounded by its number of documents and by their size.
+
+    A cached document is revalidated by fetching its revision only (`_seq_no`
+    & `_primary_term`, or `_version` on old clusters). It is trusted without
+    revalidation for `ttl` seconds after being fetched or revalidated.
+    Documents saved or deleted in the process are dropped from all the caches.
+
+    Cached documents are shared between callers and must not be modified in
+    place without being saved.
+
+    :param int maxsize: Maximum number of documents.
+    :param int maxbytes: Maximum total size of the documents (json encoded).
+    :param float ttl: Duration (in seconds) during which a document is not revalidated.
+    """
+
+    def __init__(self, maxsize=1024, maxbytes=64 * 1024 * 1024, ttl=0):
+        self.ttl = ttl
+        self._documents = LRUCache(maxsize=maxsize, maxbytes=maxbytes)
+        _SAVED_OBJECT_CACHES.add(self)
+
+    def __len__(self):
+        return len(self._documents)
+
+    @property
+    def hits(self):
+        return self._documents.hits
+
+    @property
+    def misses(self):
+        return self._documents.misses
+
+    def _revision(self, klass, id, index, using):
+        es = klass._get_connection(using)
+        hit = es.get(index=index, doc_type=klass._doc_type.name, id=id, _source=False)
+        return hit_revision(hit)
+
+    def get(self, klass, id, index, using=None):
+        """
+        Returns a document, from the cache if it is still up to date.
+        """
+        key = (using or "default", index, id)
+        entry = self._documents.get(key)
+        if entry is not None:
+            document, checked = entry
+            now = time.monotonic()
+            try:
+                fresh = now - checked < self.ttl or (
+                    self._revision(klass, id, index, using) == document.revision()
+                )
+            except NotFoundError:
+                self._documents.pop(key)
+                raise
+            if fresh:
+                entry[1] = now
+                return document
+        document = klass.get(id=id, index=index, using=using)
+        document._saved_object_cache = self
+        if document.revision() is not None:
+            self._documents.set(
+                key, [document, time.monotonic()], len(json.dumps(document.to_dict()))
+            )
+        return document
+
+    def invalidate(self, id=None):
+        """
+        Drop a document from the cache (for all connections and indices), or
+        all the documents if no id is given.
+        """
+        if id is None:
+            self._documents.clear()
+            return
+        for key in self._documents.keys():
+            if key[-1] == id:
+                self._documents.pop(key)
+
+
+def get_index_pattern_or_data_view(document_id, index, using=None, cache=None):
     """
     Load an index-pattern or data-view saved object by full Elasticsearch document _id.
+
+    :param SavedObjectCache cache: Cache of saved objects to use (if any).
     """
-    if document_id.startswith("data-view:"):
-        return DataView.get(id=document_id, index=index, using=using)
-    return IndexPattern.get(id=document_id, index=index, using=using)
+    klass = DataView if document_id.startswith("data-view:") else IndexPattern
+    if cache is not None:
+        return cache.get(klass, document_id, index=index, using=using)
+    return klass.get(id=document_id, index=index, using=using)
 
 
-def get_index_pattern_or_data_view_flexible(raw_ref, index, using=None):
+def get_index_pattern_or_data_view_flexible(raw_ref, index, using=None, cache=None):
     """
     Resolve an index-pattern or data-view from a raw ``visState`` reference (id or title).
 
@@ -41,11 +147,13 @@ def get_index_pattern_or_data_view_flexible(raw_ref, index, using=None):
     if not raw_ref:
         return None
     if raw_ref.startswith("data-view:") or raw_ref.startswith("index-pattern:"):
-        return get_index_pattern_or_data_view(raw_ref, index, using=using)
+        return get_index_pattern_or_data_view(raw_ref, index, using=using, cache=cache)
     for prefix in ("index-pattern:", "data-view:"):
         doc_id = prefix + raw_ref
         try:
-            return get_index_pattern_or_data_view(doc_id, index, using=using)
+            return get_index_pattern_or_data_view(
+                doc_id, index, using=using, cache=cache
+            )
         except NotFoundError:
             pass
     for obj_type, klass in (("index-pattern", IndexPattern), ("data-view", DataView)):
@@ -62,6 +170,87 @@ def get_index_pattern_or_data_view_flexible(raw_ref, index, using=None):
     return None
 
 
+async def aget_document(klass, id, index, using=None):
+    """
+    Fetch a saved object on an asynchronous connection (see
+    `AsyncElasticsearchExtClient`).
+    """
+    es = klass._get_connection(using)
+    hit = await es.get(index=index, doc_type=klass._doc_type.name, id=id)
+    return klass.from_es(hit)
+
+
+async def amget_documents(klass, ids, index, using=None):
+    """
+    Fetch saved objects with a single `mget` on an asynchronous connection.
+    Missing documents are returned as None.
+    """
+    es = klass._get_connection(using)
+    response = await es.mget(
+        body={"docs": [{"_id": id} for id in ids]},
+        index=index,
+        doc_type=klass._doc_type.name,
+    )
+    return [
+        klass.from_es(hit) if hit.get("found") else None for hit in response["docs"]
+    ]
+
+
+async def aget_index_pattern_or_data_view(document_id, index, using=None):
+    """
+    Asynchronous version of `get_index_pattern_or_data_view`.
+    """
+    klass = DataView if document_id.startswith("data-view:") else IndexPattern
+    return await aget_document(klass, document_id, index, using=using)
+
+
+async def aget_index_pattern_or_data_view_flexible(raw_ref, index, using=None):
+    """
+    Asynchronous version of `get_index_pattern_or_data_view_flexible`. The
+    candidate ids are fetched with a single `mget`, then the titles are looked
+    up with a single `msearch`.
+    """
+    if not raw_ref:
+        return None
+    if raw_ref.startswith("data-view:") or raw_ref.startswith("index-pattern:"):
+        return await aget_index_pattern_or_data_view(raw_ref, index, using=using)
+    es = BaseDocument._get_connection(using)
+    ids = ["index-pattern:" + raw_ref, "data-view:" + raw_ref]
+    response = await es.mget(
+        body={"docs": [{"_id": id} for id in ids]},
+        index=index,
+        doc_type=BaseDocument._doc_type.name,
+    )
+    for id, hit in zip(ids, response["docs"]):
+        if hit.get("found"):
+            return SAVED_OBJECT_CLASSES[id.split(":")[0]].from_es(hit)
+    klasses = (IndexPattern, DataView)
+    responses = await es.msearch(
+        body=[
+            (
+                {"index": index},
+                {
+                    "query": {
+                        "bool": {
+                            "filter": [
+                                {"term": {"type": klass._type}},
+                                {"match_phrase": {"%s.title" % klass._type: raw_ref}},
+                            ]
+                        }
+                    },
+                    "size": 1,
+                },
+            )
+            for klass in klasses
+        ]
+    )
+    for klass, response in zip(klasses, responses["responses"]):
+        hits = response.get("hits", {}).get("hits", [])
+        if hits:
+            return klass.from_es(hits[0])
+    return None
+
+
 class KibanaSavedObjectReferencesMixin(object):
     """
     Kibana 8+ stores outbound links in a root-level ``references`` array on saved objects.
@@ -86,6 +275,12 @@ class BaseDocument(Document):
     # List of json attributes.
     json_attrs = []
 
+    # Per-instance caches, declared on the class so that they are not stored
+    # as fields of the document.
+    _json_attrs_cache = None
+    _data_source_cache = None
+    _saved_object_cache = None
+
     class Meta:
         doc_type = "doc"
 
@@ -97,13 +292,57 @@ class BaseDocument(Document):
     def __init__(self, **kwargs):
         super().__init__(type=self._type, **kwargs)
         self._json_attrs_cache = {}
+        self._data_source_cache = {}
+        self._saved_object_cache = None
+
+    def save(self, *args, **kwargs):
+        result = super().save(*args, **kwargs)
+        for cache in list(_SAVED_OBJECT_CACHES):
+            cache.invalidate(self.meta.id)
+        return result
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        for cache in list(_SAVED_OBJECT_CACHES):
+            cache.invalidate(self.meta.id)
+        return result
+
+    def _get_related(self, klass, id, using):
+        """
+        Fetch a saved object stored in the same index, through the cache this
+        document comes from (if any).
+        """
+        if self._saved_object_cache is not None:
+            return self._saved_object_cache.get(
+                klass, id, index=self.meta.index, using=using
+            )
+        return klass.get(id=id, index=self.meta.index, using=using)
+
+    async def _aget_related(self, klass, id, using):
+        return await aget_document(klass, id, self.meta.index, using=using)
+
+    def revision(self):
+        """
+        Returns an identifier of the revision of the document: `(seq_no, primary_term)`
+        if available, else its `version`. None if the document was not fetched
+        with any of them.
+        """
+        meta = self.meta.to_dict()
+        seq_no = meta.get("seq_no")
+        primary_term = meta.get("primary_term")
+        if seq_no is not None and primary_term is not None:
+            return (seq_no, primary_term)
+        return meta.get("version")
 
     def __getattr__(self, key):
         if key in self.json_attrs:
             if key not in self._json_attrs_cache:
-                self._json_attrs_cache[key] = json.loads(
-                    self.to_dict()[self._type].get(key, "null")
-                )
+                value = json.loads(self.to_dict()[self._type].get(key, "null"))
+                if isinstance(value, dict):
+                    value = AttrDict(value)
+                elif isinstance(value, list):
+                    value = AttrList(value)
+                self._json_attrs_cache[key] = value
             return self._json_attrs_cache[key]
         return super().__getattr__(key)
 
@@ -132,9 +371,28 @@ class Search(KibanaSavedObjectReferencesMixin, BaseDocument):
 
     def index(self, using):
         """
-        Returns the index-pattern associated to the visualization. Go through the
-        search if needed.
+        Returns the index-pattern associated to the search.
+
+        The index-pattern is fetched once per connection and then cached on the
+        instance, unless the search comes from a `SavedObjectCache`: it is then
+        revalidated through that cache on every call.
+        """
+        if self._saved_object_cache is not None:
+            return self._fetch_index(using=using)
+        if using not in self._data_source_cache:
+            self._data_source_cache[using] = self._fetch_index(using=using)
+        return self._data_source_cache[using]
+
+    def data_source_ids(self):
+        """
+        Returns the candidate ids of the index-pattern of the search.
         """
+        search_source = self.search["kibanaSavedObjectMeta"]["searchSourceJSON"]
+        refs = getattr(self, "_kibana_references", [])
+        doc_id = resolve_index_pattern_document_id(search_source, refs)
+        return [doc_id] if doc_id else []
+
+    def _fetch_index(self, using):
         search_source = self.search["kibanaSavedObjectMeta"]["searchSourceJSON"]
         refs = getattr(self, "_kibana_references", [])
         doc_id = resolve_index_pattern_document_id(search_source, refs)
@@ -142,40 +400,142 @@ class Search(KibanaSavedObjectReferencesMixin, BaseDocument):
             raise ValueError(
                 "Could not resolve data source from searchSourceJSON (missing index / references)"
             )
-        return get_index_pattern_or_data_view(doc_id, self.meta.index, using=using)
+        return get_index_pattern_or_data_view(
+            doc_id, self.meta.index, using=using, cache=self._saved_object_cache
+        )
+
+    async def aindex(self, using):
+        """
+        Asynchronous version of `index`, sharing its cache.
+        """
+        if using not in self._data_source_cache:
+            ids = self.data_source_ids()
+            if not ids:
+                raise ValueError(
+                    "Could not resolve data source from searchSourceJSON (missing index / references)"
+                )
+            self._data_source_cache[using] = await aget_index_pattern_or_data_view(
+                ids[0], self.meta.index, using=using
+            )
+        return self._data_source_cache[using]
 
 
 class Visualization(KibanaSavedObjectReferencesMixin, BaseDocument):
     _type = "visualization"
     json_attrs = ["visState", "uiStateJSON"]
 
+    _related_search_cache = None
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._related_search_cache = {}
+
     def related_search(self, using):
         """
         Returns the search associated to the visualization.
 
         An error is raised if the visualization is not associated to any search.
+        The search is cached per connection, unless the visualization comes from
+        a `SavedObjectCache`, which then revalidates it.
         """
-        return Search.get(
-            id=f"search:{self.visualization.savedSearchId}",
-            index=self.meta.index,
-            using=using,
-        )
+        if self._saved_object_cache is not None:
+            return self._get_related(
+                Search, f"search:{self.visualization.savedSearchId}", using=using
+            )
+        if using not in self._related_search_cache:
+            self._related_search_cache[using] = self._get_related(
+                Search, f"search:{self.visualization.savedSearchId}", using=using
+            )
+        return self._related_search_cache[using]
+
+    async def arelated_search(self, using):
+        """
+        Asynchronous version of `related_search`, sharing its cache.
+        """
+        if using not in self._related_search_cache:
+            self._related_search_cache[using] = await self._aget_related(
+                Search, f"search:{self.visualization.savedSearchId}", using=using
+            )
+        return self._related_search_cache[using]
+
+    def data_source_ids(self):
+        """
+        Returns the candidate ids of the index-pattern of the visualization
+        (without going through the search).
+        """
+        search_source = self.visualization.kibanaSavedObjectMeta.searchSourceJSON
+        refs = getattr(self, "_kibana_references", [])
+        doc_id = resolve_index_pattern_document_id(search_source, refs)
+        if doc_id:
+            return [doc_id]
+        raw = first_input_control_index_pattern_ref(self.visState)
+        if not raw:
+            return []
+        if raw.startswith("data-view:") or raw.startswith("index-pattern:"):
+            return [raw]
+        return ["index-pattern:" + raw, "data-view:" + raw]
 
     def index(self, using):
         """
         Returns the index-pattern associated to the visualization. Go through the
         search if needed.
+
+        The index-pattern is fetched once per connection and then cached on the
+        instance, so that translators working on the same visualization share it.
+        A visualization coming from a `SavedObjectCache` is not memoized: the
+        index-pattern is revalidated through that cache instead.
         """
+        if self._saved_object_cache is not None:
+            return self._fetch_index(using=using)
+        if using not in self._data_source_cache:
+            self._data_source_cache[using] = self._fetch_index(using=using)
+        return self._data_source_cache[using]
+
+    def _fetch_index(self, using):
         if hasattr(self.visualization, "savedSearchId"):
             return self.related_search(using=using).index(using=using)
         search_source = self.visualization.kibanaSavedObjectMeta.searchSourceJSON
         refs = getattr(self, "_kibana_references", [])
         doc_id = resolve_index_pattern_document_id(search_source, refs)
         if doc_id:
-            return get_index_pattern_or_data_view(doc_id, self.meta.index, using=using)
+            return get_index_pattern_or_data_view(
+                doc_id, self.meta.index, using=using, cache=self._saved_object_cache
+            )
         raw = first_input_control_index_pattern_ref(self.visState)
         if raw:
             resolved = get_index_pattern_or_data_view_flexible(
+                raw, self.meta.index, using=using, cache=self._saved_object_cache
+            )
+            if resolved is not None:
+                return resolved
+        raise ValueError(
+            "Could not resolve data source from searchSourceJSON, references, "
+            "or input control visState (missing index / indexPattern)"
+        )
+
+    async def aindex(self, using):
+        """
+        Asynchronous version of `index`, sharing its cache: once awaited, `index`
+        does not issue any request for the same connection.
+        """
+        if using not in self._data_source_cache:
+            self._data_source_cache[using] = await self._afetch_index(using=using)
+        return self._data_source_cache[using]
+
+    async def _afetch_index(self, using):
+        if hasattr(self.visualization, "savedSearchId"):
+            search = await self.arelated_search(using=using)
+            return await search.aindex(using=using)
+        search_source = self.visualization.kibanaSavedObjectMeta.searchSourceJSON
+        refs = getattr(self, "_kibana_references", [])
+        doc_id = resolve_index_pattern_document_id(search_source, refs)
+        if doc_id:
+            return await aget_index_pattern_or_data_view(
+                doc_id, self.meta.index, using=using
+            )
+        raw = first_input_control_index_pattern_ref(self.visState)
+        if raw:
+            resolved = await aget_index_pattern_or_data_view_flexible(
                 raw, self.meta.index, using=using
             )
             if resolved is not None:
@@ -201,6 +561,55 @@ class Dashboard(BaseDocument):
     _type = "dashboard"
     json_attrs = ["panelsJSON", "optionsJSON"]
 
+    # Documents of the panels linked by a `SavedObjectGraph`, keyed by
+    # `(type, using)`.
+    _panels_cache = None
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._panels_cache = {}
+
+    def _panels(self, klass, using, missing):
+        panels = [panel for panel in self.panelsJSON if panel.type == klass._type]
+        if (klass._type, using) not in self._panels_cache:
+            return (
+                klass.mget(
+                    docs=[f"{klass._type}:" + panel["id"] for panel in panels],
+                    index=self.meta.index,
+                    missing=missing,
+                    using=using,
+                )
+                if panels
+                else []
+            )
+        documents = self._panels_cache[(klass._type, using)]
+        if missing == "raise" and None in documents:
+            ids = [
+                f"{klass._type}:" + panel["id"]
+                for panel, document in zip(panels, documents)
+                if document is None
+            ]
+            raise NotFoundError(
+                404, "Documents %s not found." % ", ".join(ids), {"docs": ids}
+            )
+        if missing == "skip":
+            return [document for document in documents if document is not None]
+        return list(documents)
+
+    async def _apanels(self, klass, using, missing):
+        if (klass._type, using) not in self._panels_cache:
+            ids = [
+                f"{klass._type}:" + panel["id"]
+                for panel in self.panelsJSON
+                if panel.type == klass._type
+            ]
+            self._panels_cache[(klass._type, using)] = (
+                await amget_documents(klass, ids, self.meta.index, using=using)
+                if ids
+                else []
+            )
+        return self._panels(klass, using=using, missing=missing)
+
     def visualizations(self, *, using, missing="skip"):
         """
         Does the join automatically by parsing panelsJSON.
@@ -208,17 +617,7 @@ class Dashboard(BaseDocument):
         :param str missing: Check https://elasticsearch-dsl.readthedocs.io/en/latest/api.html#elasticsearch_dsl.Document.mget
         :param str using: connection alias to use, defaults to ``'default'``
         """
-        panels = [panel for panel in self.panelsJSON if panel.type == "visualization"]
-        return (
-            Visualization.mget(
-                docs=["visualization:" + panel["id"] for panel in panels],
-                index=self.meta.index,
-                missing=missing,
-                using=using,
-            )
-            if panels
-            else []
-        )
+        return self._panels(Visualization, using=using, missing=missing)
 
     def searches(self, *, using, missing="skip"):
         """
@@ -227,14 +626,202 @@ class Dashboard(BaseDocument):
         :param str missing: Check https://elasticsearch-dsl.readthedocs.io/en/latest/api.html#elasticsearch_dsl.Document.mget
         :param str using: connection alias to use, defaults to ``'default'``
         """
-        panels = [panel for panel in self.panelsJSON if panel.type == "search"]
-        return (
-            Search.mget(
-                docs=["search:" + panel["id"] for panel in panels],
-                index=self.meta.index,
-                missing=missing,
-                using=using,
+        return self._panels(Search, using=using, missing=missing)
+
+    async def avisualizations(self, *, using, missing="skip"):
+        """
+        Asynchronous version of `visualizations`, sharing its cache.
+        """
+        return await self._apanels(Visualization, using=using, missing=missing)
+
+    async def asearches(self, *, using, missing="skip"):
+        """
+        Asynchronous version of `searches`, sharing its cache.
+        """
+        return await self._apanels(Search, using=using, missing=missing)
+
+
+SAVED_OBJECT_CLASSES = {
+    klass._type: klass
+    for klass in (Dashboard, DataView, IndexPattern, Search, Visualization)
+}
+
+
+class SavedObjectGraph:
+    """
+    Loader of dashboards and of the saved objects they depend on
+    (visualizations, searches, index-patterns & data-views).
+
+    The graph is walked level by level, with a single `mget` per level for all
+    the ids (deduplicated) not fetched yet. The loaded objects are then linked
+    together, so that `Dashboard.visualizations`, `Dashboard.searches`,
+    `Visualization.related_search` and `index` do not issue any request for
+    the same connection.
+
+    Data sources only referenced by title (input controls) are not loaded and
+    are still resolved on demand.
+
+    :param using: Elasticsearch connection.
+    """
+
+    def __init__(self, using=None):
+        self.using = using
+        # Fetched documents (None if missing) keyed by (index, id).
+        self.documents = {}
+        self.nb_requests = 0
+
+    @classmethod
+    def load(cls, dashboards, using=None):
+        """
+        Load the dependencies of the given dashboards.
+
+        :param list dashboards: Dashboards (already fetched).
+        :return SavedObjectGraph:
+        """
+        graph = cls(using=using)
+        pending = graph._add_dashboards(dashboards)
+        while pending:
+            keys = [
+                key for document in pending for key in graph._dependencies(document)
+            ]
+            pending = graph._fetch(keys)
+        graph._link_all(dashboards)
+        return graph
+
+    @classmethod
+    async def aload(cls, dashboards, using=None):
+        """
+        Asynchronous version of `load`, on an asynchronous connection (see
+        `AsyncElasticsearchExtClient`).
+        """
+        graph = cls(using=using)
+        pending = graph._add_dashboards(dashboards)
+        while pending:
+            keys = [
+                key for document in pending for key in graph._dependencies(document)
+            ]
+            pending = await graph._afetch(keys)
+        graph._link_all(dashboards)
+        return graph
+
+    def get(self, index, id):
+        """
+        Returns a loaded document (None if missing or not loaded).
+        """
+        return self.documents.get((index, id))
+
+    def _dependencies(self, document):
+        index = document.meta.index
+        if isinstance(document, Dashboard):
+            return [
+                (index, f"{panel.type}:{panel['id']}")
+                for panel in document.panelsJSON
+                if panel.type in ("search", "visualization")
+            ]
+        if isinstance(document, Visualization) and hasattr(
+            document.visualization, "savedSearchId"
+        ):
+            return [(index, f"search:{document.visualization.savedSearchId}")]
+        if isinstance(document, (Search, Visualization)):
+            try:
+                return [(index, id) for id in document.data_source_ids()]
+            except (AttributeError, KeyError):
+                return []
+        return []
+
+    def _add_dashboards(self, dashboards):
+        for dashboard in dashboards:
+            self.documents[(dashboard.meta.index, dashboard.meta.id)] = dashboard
+        return list(dashboards)
+
+    def _link_all(self, dashboards):
+        for document in [*dashboards, *self.documents.values()]:
+            if document is not None:
+                self._link(document)
+
+    def _missing_ids(self, keys):
+        """
+        Returns the ids not fetched yet (deduplicated), grouped by index.
+        """
+        ids_by_index = {}
+        for index, id in keys:
+            if (index, id) not in self.documents:
+                ids_by_index.setdefault(index, {})[id] = None
+        return {index: list(ids) for index, ids in ids_by_index.items()}
+
+    def _add_hits(self, index, ids, response):
+        """
+        Store the documents of a `mget` response, and returns the found ones.
+        """
+        self.nb_requests += 1
+        fetched = []
+        for id, hit in zip(ids, response["docs"]):
+            klass = SAVED_OBJECT_CLASSES.get(id.split(":")[0])
+            document = klass.from_es(hit) if klass and hit.get("found") else None
+            self.documents[(index, id)] = document
+            if document is not None:
+                fetched.append(document)
+        return fetched
+
+    def _fetch(self, keys):
+        """
+        Fetch the documents not fetched yet with one `mget` per index, and
+        returns them.
+        """
+        es = BaseDocument._get_connection(self.using)
+        fetched = []
+        for index, ids in self._missing_ids(keys).items():
+            response = es.mget(
+                body={"docs": [{"_id": id} for id in ids]},
+                index=index,
+                doc_type=BaseDocument._doc_type.name,
             )
-            if panels
-            else []
-        )
+            fetched.extend(self._add_hits(index, ids, response))
+        return fetched
+
+    async def _afetch(self, keys):
+        es = BaseDocument._get_connection(self.using)
+        fetched = []
+        for index, ids in self._missing_ids(keys).items():
+            response = await es.mget(
+                body={"docs": [{"_id": id} for id in ids]},
+                index=index,
+                doc_type=BaseDocument._doc_type.name,
+            )
+            fetched.extend(self._add_hits(index, ids, response))
+        return fetched
+
+    def _index_pattern(self, document):
+        if isinstance(document, Visualization) and hasattr(
+            document.visualization, "savedSearchId"
+        ):
+            search = self.get(
+                document.meta.index, f"search:{document.visualization.savedSearchId}"
+            )
+            return self._index_pattern(search) if search is not None else None
+        for index, id in self._dependencies(document):
+            if self.get(index, id) is not None:
+                return self.get(index, id)
+        return None
+
+    def _link(self, document):
+        using = self.using
+        if isinstance(document, Dashboard):
+            for klass in (Visualization, Search):
+                document._panels_cache[(klass._type, using)] = [
+                    self.get(document.meta.index, f"{klass._type}:{panel['id']}")
+                    for panel in document.panelsJSON
+                    if panel.type == klass._type
+                ]
+        if isinstance(document, Visualization) and hasattr(
+            document.visualization, "savedSearchId"
+        ):
+            search = self.get(
+                document.meta.index, f"search:{document.visualization.savedSearchId}"
+            )
+            if search is not None:
+                document._related_search_cache[using] = search
+        if isinstance(document, (Search, Visualization)):
+            index_pattern = self._index_pattern(document)
+            if index_pattern is not None:
+                document._data_source_cache[using] = index_pattern
@@ -1,21 +1,126 @@
 # -*- coding: utf-8 -*-
 
+import copy
+
 import elasticsearch_dsl
+from elasticsearch.exceptions import TransportError
+from elasticsearch_dsl.response import Response
 import hjson
 import json
 
+from pybana.helpers.cache import LRUCache
 from pybana.kibana_refs import kibana_saved_object_data_source_dict
 from pybana.translators.elastic.buckets import BucketTranslator, compute_auto_interval
 from pybana.translators.elastic.metrics import MetricTranslator
+from .dashboard import DashboardExecutor, PanelResult
 from .filter import FilterTranslator
 from .utils import SearchListProxy
 
-__all__ = ("ElasticTranslator", "FilterTranslator")
+__all__ = (
+    "DashboardExecutor",
+    "ElasticTranslator",
+    "FilterTranslator",
+    "LegacyTranslationPlan",
+    "PanelResult",
+)
+
+# Maximum number of translation plans kept in memory.
+PLAN_CACHE_SIZE = 512
+
+
+class LegacyTranslationPlan:
+    """
+    Part of the translation of a legacy visualization which does not depend on
+    the scope: the fields of the index-pattern, the parsed state, the filters
+    and the aggregations.
+
+    Aggregations only depend on the scope through the timezone and the interval
+    of date histograms. They are built once per distinct binding, and each
+    search returned by `bind` gets its own copy of them.
+
+    :param Visualization visualization: The visualization.
+    :param IndexPattern index_pattern: The index-pattern of the visualization.
+    :param bool datasweet_pushdown: See `ElasticTranslator`.
+    """
+
+    def __init__(self, visualization, index_pattern, datasweet_pushdown=False):
+        ip = kibana_saved_object_data_source_dict(index_pattern)
+        self.fields = {field["name"]: field for field in json.loads(ip["fields"])}
+        self.index = ip["title"]
+        self.ts = ip["timeFieldName"]
+        self.state = json.loads(visualization.visualization["visState"])
+        self.segment_aggs = [
+            agg
+            for agg in self.state["aggs"]
+            if agg["schema"] in ("segment", "group", "split", "bucket")
+        ]
+        self.metric_aggs = [
+            agg for agg in self.state["aggs"] if agg["schema"] in ("metric",)
+        ]
+        self.filters = visualization.filters()
+        self.datasweet_pushdown = datasweet_pushdown
+        self._bodies = LRUCache(maxsize=16)
+
+    def bindings(self, scope):
+        """
+        Returns the values of the scope on which the aggregations depend.
+        """
+        return (
+            str(scope.tzinfo),
+            *(
+                compute_auto_interval(agg["params"]["interval"], scope.beg, scope.end)
+                for agg in self.segment_aggs
+                if agg["type"] == "date_histogram"
+            ),
+        )
+
+    def _search(self, scope):
+        search = elasticsearch_dsl.Search(index=self.index)
+        proxy = search.aggs
+        for agg in self.segment_aggs:
+            proxy = BucketTranslator().translate(
+                proxy, agg, self.state, scope, self.fields
+            )
+        for agg in self.metric_aggs:
+            field = self.fields.get(agg.get("params", {}).get("field"))
+            MetricTranslator(datasweet_pushdown=self.datasweet_pushdown).translate(
+                proxy, agg, self.state, field
+            )
+        return search[:0]
+
+    def bind(self, scope):
+        """
+        Returns the search of the visualization for the given scope.
+        """
+        key = self.bindings(scope)
+        body = self._bodies.get(key)
+        if body is None:
+            body = self._bodies[key] = self._search(scope).to_dict()
+        search = elasticsearch_dsl.Search(index=self.index).update_from_dict(
+            copy.deepcopy(body)
+        )
+        search = search.filter(
+            "range",
+            **{self.ts: {"gte": scope.beg.isoformat(), "lte": scope.end.isoformat()}}
+        )
+        return search.filter(self.filters)
 
 
 class ElasticTranslator:
-    def __init__(self, using):
+    """
+    Translate a visualization into an elasticsearch_dsl Search.
+
+    :param using: Elasticsearch connection.
+    :param bool datasweet_pushdown: If true, datasweet formulas are computed by
+        elasticsearch using pipeline aggregations when possible.
+    """
+
+    # Translation plans shared by all the translators.
+    plans = LRUCache(maxsize=PLAN_CACHE_SIZE)
+
+    def __init__(self, using, datasweet_pushdown=False):
         self._using = using
+        self._datasweet_pushdown = datasweet_pushdown
 
     def translate_vega(self, visualization, scope):
         def replace_magic_keywords(node):
@@ -96,32 +201,38 @@ class ElasticTranslator:
             else SearchListProxy([translate_data_item(d) for d in data])
         )
 
+    def plan(self, visualization, index_pattern):
+        """
+        Returns the translation plan of a legacy visualization.
+
+        Plans are cached per connection, as long as the visualization and its
+        index-pattern are not modified (documents must have been fetched with
+        their version).
+        """
+        revisions = (visualization.revision(), index_pattern.revision())
+        if None in revisions:
+            return LegacyTranslationPlan(
+                visualization, index_pattern, self._datasweet_pushdown
+            )
+        key = (
+            self._using,
+            visualization.meta.index,
+            visualization.meta.id,
+            index_pattern.meta.index,
+            index_pattern.meta.id,
+            *revisions,
+            self._datasweet_pushdown,
+        )
+        plan = self.plans.get(key)
+        if plan is None:
+            plan = self.plans[key] = LegacyTranslationPlan(
+                visualization, index_pattern, self._datasweet_pushdown
+            )
+        return plan
+
     def translate_legacy(self, visualization, scope):
         index_pattern = visualization.index(using=self._using)
-        ip = kibana_saved_object_data_source_dict(index_pattern)
-        fields = {field["name"]: field for field in json.loads(ip["fields"])}
-        index = ip["title"]
-        ts = ip["timeFieldName"]
-        search = elasticsearch_dsl.Search(index=index).filter(
-            "range",
-            **{ts: {"gte": scope.beg.isoformat(), "lte": scope.end.isoformat()}}
-        )
-        state = json.loads(visualization.visualization["visState"])
-        segment_aggs = [
-            agg
-            for agg in state["aggs"]
-            if agg["schema"] in ("segment", "group", "split", "bucket")
-        ]
-        metric_aggs = [agg for agg in state["aggs"] if agg["schema"] in ("metric",)]
-        proxy = search.aggs
-        for agg in segment_aggs:
-            proxy = BucketTranslator().translate(proxy, agg, state, scope, fields)
-        for agg in metric_aggs:
-            field = fields.get(agg.get("params", {}).get("field"))
-            MetricTranslator().translate(proxy, agg, state, field)
-        search = search[:0]
-        search = search.filter(visualization.filters())
-        return search
+        return self.plan(visualization, index_pattern).bind(scope)
 
     def translate(self, visualization, scope):
         """
@@ -134,3 +245,38 @@ class ElasticTranslator:
             return self.translate_vega(visualization, scope)
         else:
             return self.translate_legacy(visualization, scope)
+
+    async def aexecute(self, visualization, scope):
+        """
+        Translate a visualization and execute its search on an asynchronous
+        connection (see `AsyncElasticsearchExtClient`). The searches of vega
+        visualizations with several data are executed with a single `_msearch`.
+
+        :param elasticsearch_dsl.Document visualization: Visualization fetched from a kibana index.
+        :param Scope scope: Scope to use for data fetching.
+        :return: Response (or list of responses for vega visualizations with several data).
+        """
+        if visualization.visState["type"] != "vega":
+            await visualization.aindex(using=self._using)
+        search = self.translate(visualization, scope)
+        es = elasticsearch_dsl.connections.get_connection(self._using)
+        if not isinstance(search, SearchListProxy):
+            response = await es.search(
+                index=search._index, body=search.to_dict(), **search._params
+            )
+            return Response(search, response)
+        if not search:
+            return []
+        items = []
+        for s in search:
+            header = {"index": s._index} if s._index else {}
+            header.update(s._params)
+            items.append((header, s.to_dict()))
+        responses = []
+        for s, response in zip(search, (await es.msearch(body=items))["responses"]):
+            if response.get("error"):
+                raise TransportError(
+                    "N/A", response["error"].get("type"), response["error"]
+                )
+            responses.append(Response(s, response))
+        return responses
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from elasticsearch.exceptions import NotFoundError, TransportError
+from elasticsearch_dsl import connections
+from elasticsearch_dsl.response import Response
+
+from .utils import SearchListProxy
+
+__all__ = ("DashboardExecutor", "PanelResult")
+
+# Default maximum size (in bytes) of the body of a `_msearch` request.
+DEFAULT_MAX_REQUEST_SIZE = 10 * 1024 * 1024
+
+# Visualizations which do not fetch data.
+NO_DATA_TYPES = ("input_control_vis", "markdown")
+
+
+class PanelResult:
+    """
+    Result of the execution of a dashboard panel.
+
+    :param panel: The panel (an item of `Dashboard.panelsJSON`).
+    :param Visualization visualization: The visualization (None if not found).
+    :param search: Search (or SearchListProxy for vega visualizations with several data).
+    :param response: Response (or list of responses for vega visualizations with several data).
+    :param Exception error: Error raised while translating or executing the panel.
+    """
+
+    def __init__(self, panel, visualization=None, search=None):
+        self.panel = panel
+        self.visualization = visualization
+        self.search = search
+        self.response = None
+        self.error = None
+
+
+class DashboardExecutor:
+    """
+    Execute the searches of all the panels of a dashboard with as few `_msearch`
+    requests as possible.
+
+    Errors are isolated: if a panel can not be translated or executed, the
+    error is stored in its `PanelResult` and other panels are not affected.
+
+    :param using: Elasticsearch connection.
+    :param int max_request_size: Maximum size (in bytes) of a `_msearch` body.
+        A search bigger than this size is sent alone.
+    :param ElasticTranslator translator: Translator of the visualizations
+        (default: `ElasticTranslator(using)`).
+    """
+
+    def __init__(
+        self, using, max_request_size=DEFAULT_MAX_REQUEST_SIZE, translator=None
+    ):
+        from pybana import ElasticTranslator
+
+        self._using = using
+        self._translator = translator or ElasticTranslator(using=using)
+        self.max_request_size = max_request_size
+
+    def translate(self, dashboard, scope):
+        """
+        Returns a `PanelResult` without response for each visualization panel,
+        keyed by panel id.
+        """
+        from pybana import SavedObjectGraph
+
+        panels = [
+            panel for panel in dashboard.panelsJSON if panel.type == "visualization"
+        ]
+        SavedObjectGraph.load([dashboard], using=self._using)
+        visualizations = dashboard.visualizations(using=self._using, missing="none")
+        results = {}
+        for panel, visualization in zip(panels, visualizations):
+            result = PanelResult(panel, visualization)
+            results[
+                panel["panelIndex"] if "panelIndex" in panel else panel["id"]
+            ] = result
+            if visualization is None:
+                result.error = NotFoundError(404, "visualization:%s" % panel["id"])
+                continue
+            if visualization.visState["type"] in NO_DATA_TYPES:
+                continue
+            try:
+                result.search = self._translator.translate(visualization, scope)
+            except Exception as e:
+                result.error = e
+        return results
+
+    def _batches(self, results):
+        """
+        Yield lists of `(result, position, search, header, body)` whose msearch
+        body does not exceed `max_request_size`.
+        """
+        batch = []
+        size = 0
+        for result in results.values():
+            if result.search is None:
+                continue
+            searches = (
+                result.search
+                if isinstance(result.search, SearchListProxy)
+                else [result.search]
+            )
+            for position, search in enumerate(searches):
+                header = {"index": search._index} if search._index else {}
+                header.update(search._params)
+                body = search.to_dict()
+                # Only serialized to measure the request, the client sends it
+                length = len(json.dumps(header)) + len(json.dumps(body)) + 2
+                if batch and size + length > self.max_request_size:
+                    yield batch
+                    batch = []
+                    size = 0
+                batch.append((result, position, search, header, body))
+                size += length
+        if batch:
+            yield batch
+
+    def _execute_batch(self, batch):
+        es = connections.get_connection(self._using or "default")
+        try:
+            responses = es.msearch(
+                body=[item for *_, header, body in batch for item in (header, body)]
+            )
+        except Exception as e:
+            for result, *_ in batch:
+                result.error = e
+            return
+        for (result, position, search, *_), response in zip(
+            batch, responses["responses"]
+        ):
+            if response.get("error"):
+                result.error = TransportError(
+                    "N/A", response["error"].get("type"), response["error"]
+                )
+                continue
+            response = Response(search, response)
+            if isinstance(result.search, SearchListProxy):
+                if result.response is None:
+                    result.response = [None] * len(result.search)
+                result.response[position] = response
+            else:
+                result.response = response
+
+    def execute(self, dashboard, scope):
+        """
+        Translate and execute all the visualization panels of a dashboard.
+
+        :param Dashboard dashboard: The dashboard.
+        :param Scope scope: Scope to use for data fetching.
+        :return dict: `PanelResult` keyed by panel id.
+        """
+        results = self.translate(dashboard, scope)
+        for batch in self._batches(results):
+            self._execute_batch(batch)
+        for result in results.values():
+            if result.error is not None:
+                result.response = None
+        return results
@@ -1,7 +1,15 @@
 # -*- coding: utf-8 -*-
 
+import ast
 import json
 
+from elasticsearch_dsl.aggs import Bucket
+
+from pybana.helpers.datasweet import (
+    UnsupportedFormulaError,
+    datasweet_parse,
+    is_variable,
+)
 from .utils import get_field_arg
 
 """
@@ -116,6 +124,226 @@ class DatasweetMetric(BaseMetric):
         pass
 
 
+PAINLESS_BINOPS = {
+    ast.Add: "+",
+    ast.Sub: "-",
+    ast.Mult: "*",
+    ast.Div: "/",
+    ast.Mod: "%",
+}
+
+PAINLESS_CMPOPS = {
+    ast.Eq: "==",
+    ast.NotEq: "!=",
+    ast.Lt: "<",
+    ast.LtE: "<=",
+    ast.Gt: ">",
+    ast.GtE: ">=",
+}
+
+PAINLESS_BOOLOPS = {ast.And: "&&", ast.Or: "||"}
+
+PAINLESS_FUNCS = {"ceil": "Math.ceil", "floor": "Math.floor", "round": "Math.rint"}
+
+# Series functions computed by a parent pipeline aggregation.
+SERIES_PIPELINES = {
+    "cusum": ("cumulative_sum", {}),
+    "derivative": ("derivative", {}),
+    "prev": ("serial_diff", {"lag": 1}),
+}
+
+# Bucket aggregations which accept parent pipeline aggregations.
+HISTOGRAM_AGGS = ("date_histogram", "histogram")
+
+
+class DatasweetPainlessCompiler(ast.NodeVisitor):
+    """
+    Compile a datasweet formula into a painless script usable by a
+    `bucket_script` aggregation.
+
+    Series functions (`cusum`, `derivative`, `prev`) applied on a variable are
+    computed by parent pipeline aggregations which are only allowed when the
+    parent bucket agg is an histogram.
+
+    Conditions (of `if` or ternary expressions) must be comparisons, possibly
+    combined with `and`, `or` & `not`: painless does not cast numbers to
+    booleans.
+
+    An `UnsupportedFormulaError` is raised if the formula can not be compiled.
+
+    :param dict agg: The datasweet agg.
+    :param dict state: Visualization state.
+    :param bool series: True if series functions are allowed.
+    """
+
+    def __init__(self, agg, state, series=False, _seen=()):
+        self.agg = agg
+        self.state = state
+        self.series = series
+        self.buckets_path = {}
+        self.pipelines = {}
+        self._aggs = {agg["id"]: agg for agg in state["aggs"]}
+        self._seen = (*_seen, agg["id"])
+
+    def compile(self):
+        try:
+            tree = datasweet_parse(self.agg["params"]["formula"])
+        except (SyntaxError, ValueError) as e:
+            raise UnsupportedFormulaError(str(e))
+        if isinstance(tree.body, (ast.Compare, ast.BoolOp)):
+            raise UnsupportedFormulaError("A formula must return a number")
+        return self.visit(tree.body)
+
+    def generic_visit(self, node):
+        raise UnsupportedFormulaError(f"{node.__class__.__name__} is not supported")
+
+    def _path(self, aggid):
+        agg = self._aggs.get(aggid)
+        if agg is None or aggid in self._seen:
+            raise UnsupportedFormulaError(f"agg{aggid} can not be referenced")
+        if agg["type"] == "count":
+            return "_count"
+        if agg["type"] in ("avg", "cardinality", "max", "min", "sum"):
+            return aggid
+        if agg["type"] == "median":
+            return f"{aggid}[50.0]"
+        if agg["type"] == "std_dev":
+            return f"{aggid}.std_deviation"
+        if agg["type"] == DatasweetMetric.aggtype:
+            # The referenced formula must be computed by elasticsearch as well
+            DatasweetPainlessCompiler(
+                agg, self.state, self.series, _seen=self._seen
+            ).compile()
+            return aggid
+        raise UnsupportedFormulaError(f"{agg['type']} can not be referenced")
+
+    def visit_Name(self, node):
+        if not is_variable(node.id):
+            raise UnsupportedFormulaError(f"{node.id} is not a variable")
+        self.buckets_path[node.id] = self._path(node.id[3:])
+        return f"params.{node.id}"
+
+    def visit_Constant(self, node):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise UnsupportedFormulaError(f"{node.value!r} is not supported")
+        # Always use doubles as painless would use integer divisions otherwise
+        return repr(float(node.value))
+
+    def visit_BinOp(self, node):
+        left, right = self.visit(node.left), self.visit(node.right)
+        if isinstance(node.op, ast.Pow):
+            return f"Math.pow({left}, {right})"
+        if type(node.op) not in PAINLESS_BINOPS:
+            raise UnsupportedFormulaError(f"{node.op} is not supported")
+        return f"({left} {PAINLESS_BINOPS[type(node.op)]} {right})"
+
+    def visit_UnaryOp(self, node):
+        operand = self.visit(node.operand)
+        if isinstance(node.op, ast.USub):
+            return f"(-{operand})"
+        if isinstance(node.op, ast.UAdd):
+            return operand
+        raise UnsupportedFormulaError(f"{node.op} is not supported")
+
+    def _condition(self, node):
+        """
+        Compile a condition. Only comparisons, combined with boolean operators,
+        are supported.
+        """
+        if isinstance(node, ast.Compare):
+            operands = [self.visit(node.left), *map(self.visit, node.comparators)]
+            tests = []
+            for i, op in enumerate(node.ops):
+                if type(op) not in PAINLESS_CMPOPS:
+                    raise UnsupportedFormulaError(f"{op} is not supported")
+                tests.append(
+                    f"{operands[i]} {PAINLESS_CMPOPS[type(op)]} {operands[i + 1]}"
+                )
+            return "(%s)" % " && ".join(tests)
+        if isinstance(node, ast.BoolOp):
+            op = PAINLESS_BOOLOPS[type(node.op)]
+            return "(%s)" % f" {op} ".join(map(self._condition, node.values))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return f"(!{self._condition(node.operand)})"
+        raise UnsupportedFormulaError("A condition must be a comparison")
+
+    def visit_IfExp(self, node):
+        test = self._condition(node.test)
+        return f"({test} ? {self.visit(node.body)} : {self.visit(node.orelse)})"
+
+    def _visit_series(self, func, args):
+        if not self.series or len(args) != 1 or not isinstance(args[0], ast.Name):
+            raise UnsupportedFormulaError(f"{func} is not supported here")
+        variable = self.visit(args[0])
+        name = f"{func}_{args[0].id}"
+        aggtype, params = SERIES_PIPELINES[func]
+        self.pipelines[f"{self.agg['id']}_{name}"] = (
+            aggtype,
+            {"buckets_path": self.buckets_path[args[0].id], **params},
+        )
+        self.buckets_path[name] = f"{self.agg['id']}_{name}"
+        if func == "prev":
+            return f"({variable} - params.{name})"
+        return f"params.{name}"
+
+    def visit_Call(self, node):
+        func = node.func.id if isinstance(node.func, ast.Name) else None
+        if node.keywords or func is None:
+            raise UnsupportedFormulaError("Unsupported call")
+        if func in SERIES_PIPELINES:
+            return self._visit_series(func, node.args)
+        if func == "_if" and len(node.args) == 3:
+            test = self._condition(node.args[0])
+            return "(%s ? %s : %s)" % (test, *map(self.visit, node.args[1:]))
+        args = list(map(self.visit, node.args))
+        if func in PAINLESS_FUNCS and len(args) == 1:
+            return f"{PAINLESS_FUNCS[func]}({args[0]})"
+        if func == "trunc" and len(args) == 1:
+            return f"((double) (long) {args[0]})"
+        if func in ("min", "max") and args:
+            ret = args[0]
+            for arg in args[1:]:
+                ret = f"Math.{func}({ret}, {arg})"
+            return ret
+        if func == "sum" and args:
+            return "(%s)" % " + ".join(args)
+        if func == "avg" and args:
+            return "((%s) / %r)" % (" + ".join(args), float(len(args)))
+        if func == "count":
+            return repr(float(len(args)))
+        raise UnsupportedFormulaError(f"{func} is not supported")
+
+
+class DatasweetPipelineMetric(DatasweetMetric):
+    """
+    Translator which computes datasweet formulas on elasticsearch side using
+    `bucket_script` (and `cumulative_sum`, `derivative` or `serial_diff` for
+    series functions).
+
+    Formulas which can not be compiled are left to the python evaluation.
+    """
+
+    def translate(self, proxy, agg, state, field):
+        if not isinstance(proxy, Bucket):
+            # bucket_script must be nested in a multi-bucket aggregation
+            return
+        compiler = DatasweetPainlessCompiler(
+            agg, state, series=getattr(proxy, "name", None) in HISTOGRAM_AGGS
+        )
+        try:
+            script = compiler.compile()
+        except UnsupportedFormulaError:
+            return
+        for name, (aggtype, params) in compiler.pipelines.items():
+            proxy.pipeline(name, aggtype, **params)
+        proxy.pipeline(
+            agg["id"],
+            "bucket_script",
+            buckets_path=compiler.buckets_path,
+            script=script,
+        )
+
+
 class TopHitsMetric(BaseMetric):
     """
     Translator for top_hits metric.
@@ -158,5 +386,16 @@ TRANSLATORS = {
 
 
 class MetricTranslator:
+    """
+    :param bool datasweet_pushdown: If true, datasweet formulas are computed by
+        elasticsearch when possible.
+    """
+
+    def __init__(self, datasweet_pushdown=False):
+        self.datasweet_pushdown = datasweet_pushdown
+
     def translate(self, proxy, agg, state, field):
-        TRANSLATORS[agg["type"]]().translate(proxy, agg, state, field)
+        translator = TRANSLATORS[agg["type"]]
+        if self.datasweet_pushdown and translator is DatasweetMetric:
+            translator = DatasweetPipelineMetric
+        translator().translate(proxy, agg, state, field)
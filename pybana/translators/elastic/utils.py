@@ -1,6 +1,6 @@
 import inspect
 
-from elasticsearch_dsl import Search
+from elasticsearch_dsl import MultiSearch, Search
 
 
 class SearchListProxy(list):
@@ -20,6 +20,23 @@ class SearchListProxy(list):
         assert isinstance(obj, Search)
         return super().append(obj, **kwargs)
 
+    def execute(self, ignore_cache=False, raise_on_error=True):
+        """
+        Execute all the searches with a single `_msearch` request and return the
+        list of responses (in the same order as the searches).
+
+        Searches are executed one by one if they do not share the same connection.
+        """
+        if not self:
+            return []
+        usings = {id(search._using) for search in self}
+        if len(usings) > 1:
+            return [search.execute(ignore_cache=ignore_cache) for search in self]
+        multi = MultiSearch(using=self[0]._using)
+        for search in self:
+            multi = multi.add(search)
+        return multi.execute(ignore_cache=ignore_cache, raise_on_error=raise_on_error)
+
 
 def get_proxy_method(method_name):
     def proxy_method(self, *args, **kwargs):
@@ -37,7 +54,7 @@ for name, method in inspect.getmembers(
     or inspect.ismethod(v)
     or inspect.isdatadescriptor(v),
 ):
-    if not name.startswith("__"):
+    if not name.startswith("__") and name not in SearchListProxy.__dict__:
         setattr(SearchListProxy, name, get_proxy_method(name))
 
 
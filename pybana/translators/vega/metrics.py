@@ -2,9 +2,13 @@
 
 import elasticsearch_dsl as esl
 import math
-from pybana.helpers.datasweet import datasweet_eval
+from pybana.helpers.datasweet import (
+    UnsupportedFormulaError,
+    datasweet_eval,
+    datasweet_eval_series,
+)
 
-__all__ = ("VEGA_METRICS",)
+__all__ = ("VEGA_METRICS", "contribute_series")
 
 
 class BaseMetric:
@@ -64,12 +68,24 @@ class DatasweetMetric(BaseMetric):
     aggtype = "datasweet_formula"
 
     def contribute(self, agg, bucket, response):
+        if agg["id"] in bucket:
+            # Already evaluated by `contribute_series` or by elasticsearch
+            return bucket[agg["id"]]["value"]
         ret = datasweet_eval(agg["params"]["formula"], bucket)
         bucket[agg["id"]] = {
             "value": None if isinstance(ret, float) and math.isnan(ret) else ret
         }
         return ret
 
+    def contribute_series(self, agg, buckets, response):
+        """
+        Evaluate the formula once over all the buckets and store the result in
+        each bucket.
+        """
+        values = datasweet_eval_series(agg["params"]["formula"], buckets)
+        for bucket, value in zip(buckets, values):
+            bucket[agg["id"]] = {"value": value}
+
 
 class TopHitsMetric(BaseMetric):
     """
@@ -124,3 +140,30 @@ VEGA_METRICS = {
         TopHitsMetric,
     ]
 }
+
+
+def contribute_series(metric_aggs, buckets, response):
+    """
+    Evaluate the datasweet formulas of `metric_aggs` over a serie of buckets.
+
+    If a formula can not be evaluated on series (eg. it uses boolean operators),
+    it is left to the per bucket evaluation.
+
+    :param list metric_aggs: Metric aggs of the visualization.
+    :param list buckets: Leaf buckets of a group, in the order of the x axis.
+    :param response: Elasticsearch response.
+    """
+    for agg in metric_aggs:
+        if agg["type"] == CountMetric.aggtype:
+            # Formulas may refer to the count which is only set on contribution
+            for bucket in buckets:
+                CountMetric().contribute(agg, bucket, response)
+        elif agg["type"] == DatasweetMetric.aggtype:
+            if all(agg["id"] in bucket for bucket in buckets):
+                # Computed by elasticsearch
+                continue
+            try:
+                DatasweetMetric().contribute_series(agg, buckets, response)
+            except UnsupportedFormulaError:
+                # Fallback on per bucket evaluation
+                pass
@@ -1,9 +1,17 @@
 # -*- coding: utf-8 -*-
 
+import pickle
+
 import hjson
 import pynumeral
 
-from pybana.helpers import format_timestamp, get_scaled_date_format, percentage
+from pybana.helpers import (
+    compile_date_format,
+    format_timestamp,
+    get_scaled_date_format,
+    percentage,
+)
+from pybana.helpers.cache import LRUCache
 from pybana.translators.elastic.buckets import (
     compute_auto_interval,
     duration_from_interval,
@@ -18,15 +26,222 @@ from .constants import (
     DEFAULT_PADDING,
 )
 from .colormaps import get_interval_color
-from .metrics import VEGA_METRICS
+from .metrics import VEGA_METRICS, contribute_series
 from .visualization import ContextVisualization
 
 __all__ = ("VegaTranslator",)
 
+# Maximum number of spec skeletons kept in memory.
+SKELETON_CACHE_SIZE = 256
+
+
+def _document_key(document):
+    """
+    Returns the (index, id, revision) of a saved object.
+    """
+    return (document.meta.index, document.meta.id, document.revision())
+
+
+class ResponsePlan:
+    """
+    Extraction plan of the points of a response for a visualization: how the
+    key of each level of buckets is read, and how each metric of a leaf bucket
+    is turned into a point. It is built once per translation, and the buckets
+    are then walked iteratively.
+
+    The parts of the points which only depend on a metric (label, axis...) are
+    computed on its first point.
+
+    :param VegaTranslator translator: Translator.
+    :param ContextVisualization state: Visualization state.
+    :param scaled_date_format: Date format for date histograms
+    :param locale: Locale for date formatting
+    """
+
+    def __init__(self, translator, state, scaled_date_format=None, locale=None):
+        self.translator = translator
+        self.state = state
+        self.levels = []
+        for agg in state.bucket_aggs():
+            agg_params = agg.get("params", {})
+            self.levels.append(
+                (
+                    agg,
+                    agg["schema"] == "segment",
+                    agg_params.get("customLabel") or agg_params.get("field") or "x",
+                )
+            )
+        self.scaled_date_format = scaled_date_format
+        self.locale = locale
+        self.date_formatter = compile_date_format(scaled_date_format, locale)
+        # Keys of the date histograms already formatted.
+        self._date_keys = {}
+        self.metrics = [
+            (m, agg, VEGA_METRICS[agg["type"]]())
+            for m, agg in enumerate(state.metric_aggs())
+        ]
+        self.has_series = "seriesParams" in state._state["params"]
+        self._specs = {}
+
+    def _spec(self, m, agg, metric):
+        """
+        Returns the label, the y field & axis (if any) and the duration flag
+        of a metric.
+        """
+        spec = self._specs.get(m)
+        if spec is None:
+            state = self.state
+            y_field = axis = None
+            if self.has_series:
+                axis = state.series_params(agg)["valueAxis"]
+                y_field = state.y(state.valueax(axis))
+            spec = self._specs[m] = (
+                state.metric_label(agg),
+                y_field,
+                axis,
+                self.translator._is_duration_bucket(state, agg, metric),
+            )
+        return spec
+
+    def _contribute_series(self, root, response):
+        """
+        Evaluate the datasweet formulas over the series of the response: the
+        leaf buckets of each group, in the order of the segment (x) axis.
+        """
+        nodes = [(root, ())]
+        for agg, is_segment, _ in self.levels:
+            nodes = [
+                (
+                    bucket,
+                    groups
+                    if is_segment
+                    else groups + (bucket.get("key_as_string") or bucket.get("key"),),
+                )
+                for node, groups in nodes
+                for bucket in node[agg["id"]]["buckets"]
+            ]
+        series = {}
+        for bucket, groups in nodes:
+            series.setdefault(groups, []).append(bucket)
+        metric_aggs = self.state.metric_aggs()
+        for buckets in series.values():
+            contribute_series(metric_aggs, buckets, response)
+
+    def _children(self, node, depth, response):
+        """
+        Returns an iterator of the (bucket, key) of a level of buckets. The
+        keys of date histograms are formatted all at once.
+        """
+        buckets = node[self.levels[depth][0]["id"]]["buckets"]
+        if self.levels[depth][0]["type"] == "date_histogram":
+            keys = self.date_formatter.format_many(
+                [bucket.get("key") for bucket in buckets], self._date_keys
+            )
+        else:
+            keys = [
+                bucket.get("key_as_string") or bucket.get("key") for bucket in buckets
+            ]
+        return zip(buckets, keys)
+
+    def _leaf_points(self, node, response, segment, groups):
+        group = " - ".join(map(str, filter(bool, groups)))
+        for m, agg, metric in self.metrics:
+            try:
+                y = metric.contribute(agg, node, response)
+            except Exception:
+                if not agg.get("hidden"):
+                    raise
+                # Ignore errors when the value is not displayed
+                y = None
+                node[agg["id"]] = {"value": None}
+            if y is None:
+                continue
+            label, y_field, axis, duration = self._spec(m, agg, metric)
+            if segment is None:
+                point = {"group": group, "x": "all", "y": y, "m": m, "metric": label}
+                tooltip = {"x": "all"}
+            else:
+                x, key, x_label = segment
+                point = {
+                    "x": x,
+                    "key": key,
+                    "x_label": x_label,
+                    "group": group,
+                    "y": y,
+                    "m": m,
+                    "metric": label,
+                }
+                tooltip = {x_label: x}
+            if y_field is not None:
+                point[y_field] = y
+                point["axis"] = axis
+            tooltip[label] = self.translator._format_duration(y) if duration else y
+            if group:
+                tooltip["group"] = group
+            point["tooltip"] = tooltip
+            yield point
+
+    def iter_points(self, root, response):
+        """
+        Yield the points of a response, in the order of its buckets.
+
+        :param dict root: The aggregations of the response.
+        :param response: Elasticsearch response.
+        """
+        if not self.levels:
+            yield from self._leaf_points(root, response, None, ())
+            return
+        if self.translator._datasweet_series:
+            self._contribute_series(root, response)
+        last = len(self.levels) - 1
+        # Stack of (children iterator, depth, segment, groups) where segment is
+        # (x, key, x_label) of the innermost segment bucket, and groups is the
+        # (shared) tuple of the keys of the group buckets.
+        stack = [(self._children(root, 0, response), 0, None, ())]
+        while stack:
+            children, depth, segment, groups = stack[-1]
+            item = next(children, None)
+            if item is None:
+                stack.pop()
+                continue
+            child, key = item
+            _, is_segment, x_label = self.levels[depth]
+            if is_segment:
+                child_segment, child_groups = (key, child.get("key"), x_label), groups
+            else:
+                child_segment, child_groups = segment, groups + (key,)
+            if depth == last:
+                yield from self._leaf_points(
+                    child, response, child_segment, child_groups
+                )
+            else:
+                stack.append(
+                    (
+                        self._children(child, depth + 1, response),
+                        depth + 1,
+                        child_segment,
+                        child_groups,
+                    )
+                )
+
 
 class VegaTranslator:
-    def __init__(self, using):
+    """
+    Translate a visualization and its elasticsearch response into a vega spec.
+
+    :param using: Elasticsearch connection.
+    :param bool datasweet_series: If true, datasweet formulas are evaluated once
+        per group over its buckets along the x axis using numpy (series
+        functions such as `cusum` or `derivative` then behave as in kibana).
+        Requires numpy (`pip install pybana[series]`).
+    """
+
+    # Spec skeletons (pickled) shared by all the translators.
+    skeletons = LRUCache(maxsize=SKELETON_CACHE_SIZE)
+
+    def __init__(self, using, datasweet_series=False):
         self._using = using
+        self._datasweet_series = datasweet_series
 
     def conf(self, state):
         return {
@@ -125,15 +340,7 @@ class VegaTranslator:
         return key
 
     def _iter_response(
-        self,
-        node,
-        bucket_aggs,
-        it,
-        point,
-        state,
-        response,
-        scaled_date_format=None,
-        locale=None,
+        self, node, state, response, scaled_date_format=None, locale=None
     ):
         """
         Iterate through response and yield each point.
@@ -147,80 +354,13 @@ class VegaTranslator:
         - axis: The axis on which the point should be displayed
 
         :param node dict: The node of the response. Should start at `response.aggregations`.
-        :param bucket_aggs list: List of bucket aggs
-        :param it: Iterator on bucket_aggs.
-        :param point: The point currently being filled.
         :param state: Visualization state.
         :param response: Elasticsearch response.
         :param scaled_date_format: Date format for date histograms
         :param locale: Locale for date formatting
         """
-        if it == len(bucket_aggs):
-            point["group"] = " - ".join(
-                map(str, filter(bool, point.setdefault("groups", [])))
-            )
-            for m, metric_agg in enumerate(state.metric_aggs()):
-                metric = VEGA_METRICS[metric_agg["type"]]()
-                try:
-                    y = metric.contribute(metric_agg, node, response)
-                except Exception as e:
-                    if metric_agg.get("hidden"):
-                        # Ignore errors when the value is not displayed
-                        y = None
-                        node[metric_agg["id"]] = {"value": None}
-                    else:
-                        raise e
-                if y is None:
-                    continue
-                childpoint = point.copy()
-                # handling case where no bucket aggs
-                childpoint.setdefault("x", "all")
-                childpoint.pop("groups")
-                childpoint.update(
-                    {"y": y, "m": m, "metric": state.metric_label(metric_agg)}
-                )
-                if "seriesParams" in state._state["params"]:
-                    series_params = state.series_params(metric_agg)
-                    ax = state.valueax(series_params["valueAxis"])
-                    childpoint.update(
-                        {state.y(ax): y, "axis": series_params["valueAxis"]}
-                    )
-                tooltip = {
-                    childpoint.get("x_label", "x"): childpoint["x"],
-                    childpoint["metric"]: self._format_duration(y)
-                    if self._is_duration_bucket(state, metric_agg, metric)
-                    else y,
-                }
-                if childpoint["group"]:
-                    tooltip["group"] = childpoint["group"]
-                childpoint["tooltip"] = tooltip
-                yield childpoint
-            return
-        agg = bucket_aggs[it]
-        aggnode = node[agg["id"]]
-        for child in aggnode["buckets"]:
-            childpoint = point.copy()
-            key = self._get_node_key(child, agg, scaled_date_format, locale)
-            if agg["schema"] == "segment":
-                childpoint["x"] = key
-                childpoint["key"] = child.get("key")
-                agg_params = agg.get("params", {})
-                childpoint["x_label"] = (
-                    agg_params.get("customLabel") or agg_params.get("field") or "x"
-                )
-            else:
-                childpoint.setdefault("groups", []).append(key)
-            for obj in self._iter_response(
-                child,
-                bucket_aggs,
-                it + 1,
-                childpoint,
-                state,
-                response,
-                scaled_date_format,
-                locale,
-            ):
-                yield obj
+        plan = ResponsePlan(self, state, scaled_date_format, locale)
+        return plan.iter_points(node, response)
 
     def data_line_bar(self, conf, state, response, scope):
         data = {"name": "table", "values": []}
@@ -267,17 +407,15 @@ class VegaTranslator:
                     }
                 ]
 
-        for item in self._iter_response(
-            response.aggregations.to_dict(),
-            state.bucket_aggs(),
-            0,
-            {},
-            state,
-            response,
-            scaled_date_format,
-            scope.locale,
-        ):
-            data["values"].append(item)
+        data["values"].extend(
+            self._iter_response(
+                response.aggregations.to_dict(),
+                state,
+                response,
+                scaled_date_format,
+                scope.locale,
+            )
+        )
 
         for ax in state.valueaxes():
             if state.stacked_applied(ax):
@@ -392,15 +530,17 @@ class VegaTranslator:
                 }
             )
 
-    def scales(self, conf, state):
-        conf["scales"] = [
-            self._scale_x(state),
-            *self._scales_y(state),
-            self._scale_axis(state),
+    def _static_scales(self, state):
+        return [self._scale_x(state), *self._scales_y(state), self._scale_axis(state)]
+
+    def _data_scales(self, state, conf):
+        return [
             *self._scales_metric(state, conf),
             self._scale_group(state, conf["data"]),
         ]
 
+    def scales(self, conf, state):
+        conf["scales"] = self._static_scales(state) + self._data_scales(state, conf)
         return conf
 
     def axes(self, conf, state):
@@ -1000,17 +1140,72 @@ class VegaTranslator:
         conf["marks"] = marks
         return conf
 
-    def translate_legacy(self, visualization, response, scope):
+    def _build_skeleton(self, state):
+        skeleton = {"conf": self.conf(state), "scales": self._static_scales(state)}
+        skeleton.update(self.axes({}, state))
+        skeleton.update(self.legends({}, state))
+        if state.type() not in ["gauge", "goal"]:
+            skeleton.update(self.marks({}, state, None))
+        return skeleton
+
+    def skeleton(self, visualization, state, scope):
+        """
+        Returns the parts of the spec of a legacy visualization which do not
+        depend on the response: `conf`, the scales which are not computed from
+        the data, `axes`, `legends` and `marks` (except for gauges).
+
+        Skeletons are cached per connection, revision of the visualization and
+        of the config, and locale (documents must have been fetched with their
+        version). A skeleton built with the index-pattern is also bound to its
+        revision: the index-pattern is only fetched to revalidate such
+        skeletons. They are kept pickled: each call returns a new copy, that the
+        caller may modify.
+        """
+        revisions = (visualization.revision(), scope.config.revision())
+        if None in revisions:
+            return self._build_skeleton(state)
+        key = (
+            self._using,
+            visualization.meta.index,
+            visualization.meta.id,
+            *revisions,
+            scope.locale,
+        )
+        entry = self.skeletons.get(key)
+        if entry is not None:
+            index_pattern_key, pickled = entry
+            if index_pattern_key is None or index_pattern_key == (
+                _document_key(state.index_pattern)
+            ):
+                return pickle.loads(pickled)
+        skeleton = self._build_skeleton(state)
+        index_pattern = state.loaded_index_pattern()
+        index_pattern_key = (
+            None if index_pattern is None else _document_key(index_pattern)
+        )
+        if index_pattern_key is None or index_pattern_key[-1] is not None:
+            self.skeletons[key] = (
+                index_pattern_key,
+                pickle.dumps(skeleton, pickle.HIGHEST_PROTOCOL),
+            )
+        return skeleton
+
+    def translate_legacy(self, visualization, response, scope, index_pattern=None):
         state = ContextVisualization(
-            visualization=visualization, config=scope.config, using=self._using
+            visualization=visualization,
+            config=scope.config,
+            using=self._using,
+            index_pattern=index_pattern,
         )
 
-        ret = self.conf(state)
-        ret = self.data(ret, state, response, scope)
-        ret = self.scales(ret, state)
-        ret = self.axes(ret, state)
-        ret = self.legends(ret, state)
-        ret = self.marks(ret, state, response)
+        skeleton = self.skeleton(visualization, state, scope)
+        ret = self.data(skeleton["conf"], state, response, scope)
+        ret["scales"] = skeleton["scales"] + self._data_scales(state, ret)
+        for part in ("axes", "legends", "marks"):
+            if part in skeleton:
+                ret[part] = skeleton[part]
+        if state.type() in ["gauge", "goal"]:
+            ret = self.marks_gauge(ret, state, response)
         return ret
 
     def _fix_empty_image_urls(self, marks):
@@ -1084,15 +1279,18 @@ class VegaTranslator:
 
         return ret
 
-    def translate(self, visualization, response, scope):
+    def translate(self, visualization, response, scope, index_pattern=None):
         """
         Transform a kibana visualization object and an elasticsearch_dsl response into a vega object.
 
         :param elasticsearch_dsl.Document visualization: Visualization fetched from a kibana index.
         :param elasticsearch_dsl.response.Response visualization: Visualization fetched from a kibana index.
         :param Scope scope: The scope associated for data fetching.
+        :param IndexPattern index_pattern: Index-pattern of the visualization (fetched if needed when not given).
         """
         if visualization.visState["type"] == "vega":
             return self.translate_vega(visualization, response, scope)
         else:
-            return self.translate_legacy(visualization, response, scope)
+            return self.translate_legacy(
+                visualization, response, scope, index_pattern=index_pattern
+            )
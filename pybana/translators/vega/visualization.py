@@ -10,12 +10,21 @@ class ContextVisualization:
     """
     Represent a visualization with a context.
 
+    The state is indexed once (aggregations by id & schema, series by
+    aggregation & value axis, value axes by id), so that the lookups done
+    for each point of a response are O(1). The state must not be modified.
+
     :param Visualization visualization: Visualization deserialized.
     :param pybana.Config config: Config of the kibana instance.
+    :param using: Elasticsearch connection used to fetch the index-pattern.
+    :param IndexPattern index_pattern: Index-pattern of the visualization. If not
+        given, it is fetched when needed.
     """
 
-    def __init__(self, visualization, config, using=None):
-        self._index_pattern = visualization.index(using=using)
+    def __init__(self, visualization, config, using=None, index_pattern=None):
+        self._visualization = visualization
+        self._using = using
+        self._index_pattern = index_pattern
         self._state = visualization.visState.to_dict()
         self._ui_state = visualization.uiStateJSON.to_dict()
         self._config = config
@@ -25,12 +34,73 @@ class ContextVisualization:
             ),
             **self._ui_state.get("vis", {}).get("colors", {}),
         }
+        self._index_state()
+
+    def _index_state(self):
+        aggs = self._state["aggs"]
+        params = self._state.get("params", {})
+        self._aggs_by_id = {}
+        self._aggs_by_schema = {}
+        for agg in aggs:
+            self._aggs_by_id.setdefault(agg["id"], agg)
+            self._aggs_by_schema.setdefault(agg["schema"], []).append(agg)
+        self._bucket_aggs = [
+            agg for agg in aggs if agg["schema"] in ("segment", "group", "bucket")
+        ]
+        self._series_by_agg = {}
+        self._series_by_axis = {}
+        for serie in params.get("seriesParams") or []:
+            self._series_by_agg.setdefault(serie["data"]["id"], serie)
+            self._series_by_axis.setdefault(serie["valueAxis"], []).append(serie)
+        self._valueaxes = params.get("valueAxes", [])
+        self._valueaxes_by_id = {}
+        for ax in self._valueaxes:
+            self._valueaxes_by_id.setdefault(ax["id"], ax)
+        # Metric aggregations (with their series) by value axis, and flags
+        # derived from them, computed on first use.
+        self._metrics_by_axis = None
+        self._flags = {}
+
+    @property
+    def index_pattern(self):
+        if self._index_pattern is None:
+            self._index_pattern = self._visualization.index(using=self._using)
+        return self._index_pattern
+
+    def loaded_index_pattern(self):
+        """
+        Returns the index-pattern if it was given or already fetched, else None
+        (it is not fetched).
+        """
+        return self._index_pattern
 
     def singleton(self):
-        return all(map(lambda agg: agg["schema"] != "segment", self._state["aggs"]))
+        return "segment" not in self._aggs_by_schema
 
     def _aggs_by_type(self, typ):
-        return [agg for agg in self._state["aggs"] if agg["schema"] == typ]
+        return self._aggs_by_schema.get(typ, [])
+
+    def _cached_flag(self, name, ax, compute):
+        key = (name, ax["id"])
+        if key not in self._flags:
+            self._flags[key] = compute(ax)
+        return self._flags[key]
+
+    def _metrics_axes(self):
+        """
+        Returns the metric aggregations (with their series) by value axis id.
+        """
+        if self._metrics_by_axis is None:
+            self._metrics_by_axis = {}
+            for agg in self.metric_aggs():
+                param = self.series_params(agg)
+                self._metrics_by_axis.setdefault(param["valueAxis"], []).append(
+                    (agg, param)
+                )
+        return self._metrics_by_axis
+
+    def _axis_metrics(self, ax):
+        return self._metrics_axes().get(ax["id"], [])
 
     def type(self):
         return self._state["type"]
@@ -39,8 +109,10 @@ class ContextVisualization:
         """
         Returns the agg corresponding to the agg identifier.
         """
-        aggs = self._state["aggs"]
-        return [agg for agg in aggs if agg["id"] == aggid][0]
+        try:
+            return self._aggs_by_id[aggid]
+        except KeyError:
+            raise IndexError(aggid)
 
     def is_duration_agg(self, agg):
         """
@@ -50,8 +122,11 @@ class ContextVisualization:
         """
         params = agg["params"]
         field = params.get("field")
-        field_formats = self._index_pattern.fieldFormatMap
-        fmt = field_formats.to_dict().get(field) if field and field_formats else None
+        if not field:
+            # No need to fetch the index-pattern
+            return False
+        field_formats = self.index_pattern.fieldFormatMap
+        fmt = field_formats.to_dict().get(field) if field_formats else None
         return (
             fmt
             and fmt["id"] == "number"
@@ -59,21 +134,16 @@ class ContextVisualization:
         )
 
     def series_params(self, agg):
-        return [
-            param
-            for param in self._state["params"]["seriesParams"]
-            if param["data"]["id"] == agg["id"]
-        ][0]
+        try:
+            return self._series_by_agg[agg["id"]]
+        except KeyError:
+            raise IndexError(agg["id"])
 
     def bucket_aggs(self):
         """
         Return all the aggregations that generate bucketing.
         """
-        return [
-            agg
-            for agg in self._state["aggs"]
-            if agg["schema"] in ("segment", "group", "bucket")
-        ]
+        return self._bucket_aggs
 
     def segment_aggs(self):
         return self._aggs_by_type("segment")
@@ -118,61 +188,55 @@ class ContextVisualization:
         return len(self.group_aggs()) > 0 and not self.groups_stacked(ax)
 
     def groups_stacked(self, ax):
-        return (
-            any(
-                [
-                    param.get("mode") == "stacked"
-                    for param in self._state["params"]["seriesParams"]
-                    if param["valueAxis"] == ax["id"]
-                ]
+        return self._cached_flag(
+            "groups_stacked",
+            ax,
+            lambda ax: any(
+                param.get("mode") == "stacked"
+                for param in self._series_by_axis.get(ax["id"], [])
             )
-            and len(self.group_aggs()) > 0
+            and len(self.group_aggs()) > 0,
         )
 
     def metrics_side_by_side(self, ax):
-        return len(
-            [
-                agg
-                for agg in self.metric_aggs()
-                if self.series_params(agg)["valueAxis"] == ax["id"]
-            ]
-        ) > 1 and not self.metrics_stacked(ax)
+        return len(self._axis_metrics(ax)) > 1 and not self.metrics_stacked(ax)
 
     def metrics_stacked(self, ax):
-        aggs = [
-            (agg, self.series_params(agg))
-            for agg in self.metric_aggs()
-            if self.series_params(agg)["valueAxis"] == ax["id"]
-        ]
-
-        return (
-            any([param.get("mode") == "stacked" for agg, param in aggs])
-            and len(aggs) > 1
+        return self._cached_flag(
+            "metrics_stacked",
+            ax,
+            lambda ax: any(
+                param.get("mode") == "stacked" for agg, param in self._axis_metrics(ax)
+            )
+            and len(self._axis_metrics(ax)) > 1,
         )
 
     def multi_axis(self):
-        aggs = self.metric_aggs()
-        axis = set([self.series_params(agg)["valueAxis"] for agg in aggs])
-        return len(axis) > 1
+        return len(self._metrics_axes()) > 1
 
     def stacked_applied(self, ax):
         return self.metrics_stacked(ax) or self.groups_stacked(ax)
 
     def valueax(self, axid):
-        return [ax for ax in self.valueaxes() if ax["id"] == axid][0]
+        try:
+            return self._valueaxes_by_id[axid]
+        except KeyError:
+            raise IndexError(axid)
 
     def valueaxserie(self, ax):
         """
         Returns first serie of the given axe.
         """
-        series = self._state["params"]["seriesParams"]
-        return [serie for serie in series if serie["valueAxis"] == ax["id"]][0]
+        try:
+            return self._series_by_axis[ax["id"]][0]
+        except KeyError:
+            raise IndexError(ax["id"])
 
     def valueaxtype(self, ax):
         return self.valueaxserie(ax)["type"]
 
     def valueaxes(self):
-        return self._state["params"].get("valueAxes", [])
+        return self._valueaxes
 
     def y(self, ax):
         axid = ax["id"].split("-")[-1]
@@ -14,9 +14,15 @@ with open("HISTORY.md") as history_file:
 with open("requirements.txt") as requirements_file:
     requirements = [req.strip("\n") for req in requirements_file.readlines()]
 
+# elasticsearch-async is the asynchronous client of elasticsearch-py 6.x
+extras_requirements = {
+    "async": ["elasticsearch-async>=6.0,<7"],
+    "series": ["numpy>=1.16"],
+}
+
 setup_requirements = ["pytest-runner"]
 
-test_requirements = ["pytest"]
+test_requirements = ["pytest", "numpy>=1.16"]
 setup(
     author="Guillaume Thomas",
     author_email="guillaume.thomas@inuse.eu",
@@ -30,6 +36,7 @@ setup(
         "Programming Language :: Python :: 3.7",
     ],
     description="Python client for kibana. Provide ORM & vega rendering of visualizations",
+    extras_require=extras_requirements,
     install_requires=requirements,
     license="MIT license",
     long_description=readme + "\n\n" + history,
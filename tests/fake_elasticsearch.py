@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+from urllib.parse import unquote
+
+from elasticsearch import Elasticsearch, NotFoundError
+from elasticsearch.serializer import JSONSerializer
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "..", "pybana", "index.json")
+
+
+def load_fixture_hits():
+    """
+    Returns the documents of the fixtures, by id.
+    """
+    with open(FIXTURES, "r") as fd:
+        return {hit["_id"]: hit for hit in map(json.loads, fd)}
+
+
+def empty_response(header, body):
+    return {"took": 1, "hits": {"total": 0, "hits": []}}
+
+
+class FakeTransport:
+    """
+    Transport of an elasticsearch-py client which serves the saved objects of
+    the fixtures and records the requests, so that the tests go through the
+    actual signatures of the client methods.
+
+    :param str version: Version of the cluster.
+    :param search: Callable `(header, body)` returning the response of a
+        search (`_search`, `_msearch` or scroll).
+    """
+
+    serializer = JSONSerializer()
+
+    def __init__(self, version="6.8.0", search=empty_response):
+        self.version = version
+        self.search = search
+        self.documents = load_fixture_hits()
+        # Version of the documents (1 if not set)
+        self.versions = {}
+        # (method, url, params, body) of the requests
+        self.requests = []
+        # Responses of other endpoints (`_mapping`...), by name
+        self.responses = {}
+
+    def bodies(self, endpoint):
+        """
+        Returns the bodies of the requests sent to an endpoint (`_mget`,
+        `_msearch`...).
+        """
+        return [
+            body
+            for method, url, params, body in self.requests
+            if url.rstrip("/").rsplit("/", 1)[-1] == endpoint
+        ]
+
+    def gets(self):
+        """
+        Returns the (id, params) of the documents fetched with a get.
+        """
+        return [
+            (unquote(url.rsplit("/", 1)[-1]), params)
+            for method, url, params, body in self.requests
+            if method == "GET" and len(url.strip("/").split("/")) == 3
+        ]
+
+    def hit(self, id):
+        if id not in self.documents:
+            return {"_id": id, "found": False}
+        return {
+            **self.documents[id],
+            "_version": self.versions.get(id, 1),
+            "found": True,
+        }
+
+    def perform_request(self, method, url, headers=None, params=None, body=None):
+        self.requests.append((method, url, params, body))
+        parts = [unquote(part) for part in url.split("/") if part]
+        if not parts:
+            return {"version": {"number": self.version}}
+        if parts[-1] in self.responses:
+            return self.responses[parts[-1]]
+        if parts[-1] == "_bulk":
+            return {"errors": False, "items": []}
+        if parts[-1] == "_mget":
+            return {"docs": [self.hit(doc["_id"]) for doc in body["docs"]]}
+        if parts[-1] == "_msearch":
+            lines = [json.loads(line) for line in body.splitlines() if line]
+            return {
+                "responses": [
+                    self.search(header, body)
+                    for header, body in zip(lines[::2], lines[1::2])
+                ]
+            }
+        if parts[-1] == "_search":
+            return self.search({"index": parts[0] if len(parts) > 1 else None}, body)
+        if parts == ["_search", "scroll"]:
+            return {} if method == "DELETE" else self.search({}, body)
+        if len(parts) == 3 and method == "GET":
+            hit = self.hit(parts[2])
+            if not hit["found"]:
+                raise NotFoundError(404, "not_found", hit)
+            if (params or {}).get("_source") == b"false":
+                del hit["_source"]
+            return hit
+        if len(parts) == 3 and method in ("POST", "PUT"):
+            version = self.versions.get(parts[2], 1) + 1
+            return {"_id": parts[2], "_version": version, "result": "updated"}
+        if len(parts) == 3 and method == "DELETE":
+            return {"_id": parts[2], "result": "deleted"}
+        raise NotImplementedError(f"{method} {url}")
+
+
+class FakeAsyncTransport(FakeTransport):
+    """
+    Same as `FakeTransport`, with a coroutine `perform_request` (as the
+    transport of `elasticsearch-async`).
+    """
+
+    async def perform_request(self, method, url, headers=None, params=None, body=None):
+        return super().perform_request(
+            method, url, headers=headers, params=params, body=body
+        )
+
+
+def fake_elasticsearch(transport_class=FakeTransport, **kwargs):
+    """
+    Returns an elasticsearch-py client using a fake transport.
+    """
+    es = Elasticsearch()
+    es.transport = transport_class(**kwargs)
+    return es
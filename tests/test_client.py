@@ -4,16 +4,25 @@ import sys
 BASE_DIRECTORY = os.path.join(os.path.dirname(__file__), "..")  # NOQA
 sys.path.insert(0, BASE_DIRECTORY)  # NOQA
 
+import asyncio  # noqa: E402
 import copy  # noqa: E402
-import datetime  # noqa: E402
+import io  # noqa: E402
 import json  # noqa: E402
+import time  # noqa: E402
 import unittest  # noqa: E402
+from elasticsearch import Connection, Elasticsearch  # noqa: E402
 from elasticsearch.exceptions import TransportError  # noqa: E402
 from elasticsearch.helpers import scan  # noqa: E402
+from elasticsearch_dsl import MultiSearch, Search  # noqa: E402
+from pybana.elastic.async_client import AsyncElasticsearchExtClient  # noqa: E402
+from fake_elasticsearch import FakeAsyncTransport, fake_elasticsearch  # noqa: E402
+from pybana.elastic.instrumentation import RegistryAdapter  # noqa: E402
 from pybana.elastic.elastic_client import (  # noqa: E402
     ElasticsearchExt,
+    ElasticsearchExtClient,
     ScrollsCache,
     _get_scroll_id,
+    _iter_bulk_lines,
 )  # noqa: E402
 
 # from ..client.base import JSONSerializer
@@ -94,6 +103,20 @@ class TestV6ToV8Case(unittest.TestCase):
         assert list(
             v6_to_v8.fix_actions([{"_type": "toto", "val": "A"}, {"val": "B"}])
         ) == [{"val": "A"}, {"val": "B"}]
+        # Only the metadata is fixed, not the documents
+        assert list(
+            v6_to_v8.fix_actions(
+                [
+                    {"_type": "doc", "_source": {"_type": "a", "b": [{"_type": "c"}]}},
+                    {"index": {"_index": "a", "_type": "doc"}},
+                    {"delete": {"_index": "a", "_type": "doc", "_id": "1"}},
+                ]
+            )
+        ) == [
+            {"_source": {"_type": "a", "b": [{"_type": "c"}]}},
+            {"index": {"_index": "a"}},
+            {"delete": {"_index": "a", "_id": "1"}},
+        ]
 
     def test_fusion_mappings_v8(self):
         with pytest.raises(RuntimeError):
@@ -308,6 +331,83 @@ class TestV6ToV8Case(unittest.TestCase):
         ]:
             assert v6_to_v8.fix_mappings(origin) == expected, title
 
+    def test_fix_mappings_cache(self):
+        mappings = {
+            "doc": {
+                "properties": {"a": {"type": "keyword"}},
+                "dynamic_templates": [{"strings": {"match_mapping_type": "string"}}],
+            }
+        }
+        original = copy.deepcopy(mappings)
+        shared = v6_to_v8._shared_mappings(mappings)
+        self.assertEqual(shared["properties"], {"a": {"type": "keyword"}})
+        # Same content: same (read-only) result, and the original is untouched
+        self.assertIs(v6_to_v8._shared_mappings(copy.deepcopy(original)), shared)
+        self.assertEqual(mappings, original)
+        with pytest.raises(TypeError):
+            shared["properties"]["b"] = {}
+        with pytest.raises(TypeError):
+            shared["dynamic_templates"].append({})
+        mutable = copy.deepcopy(shared)
+        mutable["properties"]["b"] = {}
+        self.assertEqual(
+            json.loads(json.dumps(shared))["properties"], original["doc"]["properties"]
+        )
+        # The public method returns a mutable copy, with or without types
+        for value in (original, shared):
+            fixed = v6_to_v8.fix_mappings(value)
+            self.assertEqual(fixed, shared)
+            self.assertIs(type(fixed["properties"]), dict)
+            fixed["properties"]["b"] = {}
+        self.assertIsNot(v6_to_v8.fix_mappings(mappings), mappings)
+        self.assertNotIn("b", shared["properties"])
+
+        template = {"index_patterns": ["a-*"], "mappings": original}
+        shared = v6_to_v8._shared_template(template)
+        self.assertIs(v6_to_v8._shared_template(copy.deepcopy(template)), shared)
+        self.assertEqual(shared["settings"]["index"]["codec"], "best_compression")
+        fixed = v6_to_v8.fix_template(template)
+        fixed["settings"]["index"]["codec"] = "default"
+        self.assertNotIn("settings", template)
+        self.assertNotIn("settings", template)
+        self.assertEqual(fixed["mappings"]["properties"], {"a": {"type": "keyword"}})
+
+    def test_fix_bulk_lines(self):
+        source = '{"_type": "nested", "a": [1, 2]}'
+        body = "\n".join(
+            [
+                '{"index": {"_index": "a", "_type": "doc", "_id": "1"}}',
+                source,
+                '{"delete": {"_index": "a", "_id": "2"}}',
+                '{"update": {"_index": "a", "_id": "3"}}',
+                '{"doc": {"a": 1}}',
+                "",
+            ]
+        )
+        expected = [
+            '{"index": {"_index": "a", "_id": "1"}}',
+            source,
+            '{"delete": {"_index": "a", "_id": "2"}}',
+            '{"update": {"_index": "a", "_id": "3"}}',
+            '{"doc": {"a": 1}}',
+        ]
+        for origin in (
+            body,
+            body.encode(),
+            io.StringIO(body),
+            io.BytesIO(body.encode()),
+        ):
+            found = list(v6_to_v8.fix_bulk_lines(_iter_bulk_lines(origin)))
+            self.assertEqual(found, expected)
+        self.assertEqual(
+            list(
+                v6_to_v8.fix_bulk_lines(
+                    [{"index": {"_index": "a", "_type": "doc"}}, {"_type": "x"}]
+                )
+            ),
+            [{"index": {"_index": "a"}}, {"_type": "x"}],
+        )
+
     def test_fix_histogram(self):
         fixed_origin = {"date_histogram": {"interval": "10m"}}
         fixed_dest = {"date_histogram": {"fixed_interval": "10m"}}
@@ -341,6 +441,43 @@ class TestV6ToV8Case(unittest.TestCase):
             found = v6_to_v8.fix_search_body(origin)
             assert found == expected, title
 
+        # Only the paths leading to a date histogram are copied
+        terms = {"terms": {"field": "a", "include": list(range(100))}}
+        origin = {
+            "aggs": {
+                "a": terms,
+                "b": {"date_histogram": {"field": "ts", "interval": "1d"}},
+            }
+        }
+        origin_copy = copy.deepcopy(origin)
+        found = v6_to_v8.fix_search_body(origin)
+        self.assertEqual(origin, origin_copy)
+        self.assertEqual(
+            found["aggs"]["b"]["date_histogram"],
+            {"field": "ts", "calendar_interval": "1d"},
+        )
+        self.assertIs(found["aggs"]["a"], terms)
+        self.assertIs(v6_to_v8.fix_search_body(terms), terms)
+        self.assertEqual(
+            v6_to_v8.fix_search_body(json.dumps(origin)),
+            json.dumps(found, sort_keys=True),
+        )
+
+    def test_fix_msearch_body(self):
+        origin = [
+            {"index": "a", "type": "doc"},
+            {"aggs": {"x": {"date_histogram": {"interval": "1d"}}}},
+            {},
+            {},
+        ]
+        expected = [
+            {"index": "a"},
+            {"aggs": {"x": {"date_histogram": {"calendar_interval": "1d"}}}},
+            {},
+            {},
+        ]
+        self.assertEqual(v6_to_v8.fix_msearch_body(origin), expected)
+
     def test_fix_search_params(self):
         for (origin, expected, title) in [
             ({}, {}, "empty"),
@@ -435,13 +572,34 @@ class TestScrollsCache(unittest.TestCase):
         self.assertEqual(sc.clear_scroll_cache(), 0)
         self.assertEqual(sc.nb_scrolls_added, 2)
         self.assertIn("a", sc.cache)
-        sc.cache["a"].date = datetime.datetime.now() - datetime.timedelta(hours=2)
+        sc.cache["a"].deadline = time.monotonic() - 1
         self.assertEqual(sc.clear_scroll_cache(), 1)
         self.assertEqual(sc.nb_scrolls_added, 2)
+        self.assertEqual(sc.nb_expired, 1)
         self.assertEqual(len(sc), 1)
         self.assertNotIn("a", sc.cache)
         self.assertEqual(sc.fix_results({}), {})
 
+    def test_scroll_cache_keep_alive(self):
+        sc = ScrollsCache(max_size=2)
+        sc.add_item(results={"_scroll_id": "a"}, doc_type="toto", scroll="1m")
+        sc.add_item(results={"_scroll_id": "b"}, doc_type="toto", scroll="2h")
+        self.assertEqual(sc.cache["a"].keep_alive, 60)
+        self.assertEqual(sc.cache["b"].keep_alive, 7200)
+        # The context expiring first is evicted
+        sc.add_item(results={"_scroll_id": "c"}, doc_type="toto", scroll="30s")
+        self.assertEqual(sorted(sc.cache), ["b", "c"])
+        self.assertEqual((sc.nb_live, sc.nb_evicted), (2, 1))
+        # A scroll request postpones the expiry, even if the scroll id changes
+        sc.cache["c"].deadline = time.monotonic() - 1
+        results = sc.fix_results(
+            {"_scroll_id": "d", "hits": {"hits": [{}]}}, scroll="5m", scroll_id="c"
+        )
+        self.assertEqual(results["hits"]["hits"][0]["_type"], "toto")
+        self.assertEqual(sorted(sc.cache), ["b", "d"])
+        self.assertEqual(sc.cache["d"].keep_alive, 300)
+        self.assertEqual(sc.clear_scroll_cache(), 0)
+
     def test_scroll_id(self):
         self.assertEqual(_get_scroll_id("", {}), "")
         self.assertEqual(_get_scroll_id("", {"scroll_id": "a", "_scroll_id": "b"}), "b")
@@ -450,6 +608,285 @@ class TestScrollsCache(unittest.TestCase):
         self.assertEqual(_get_scroll_id(["e", "f"], {}), "e")
 
 
+class TestClusterInfoCase(unittest.TestCase):
+    def test_cluster_info(self):
+        calls = []
+
+        def info(**kwargs):
+            calls.append(kwargs)
+            return {
+                "cluster_name": "pybana",
+                "cluster_uuid": "uuid",
+                "version": {"number": "8.%d.0" % len(calls), "build_flavor": "default"},
+            }
+
+        es = Elasticsearch()
+        es.info = info
+        client = ElasticsearchExtClient(es)
+        # No request until the metadata is needed
+        self.assertEqual(len(calls), 0)
+        self.assertEqual(client.version_major, 8)
+        self.assertEqual(client.version, "8.1.0")
+        self.assertEqual(client.cluster_info.build_flavor, "default")
+        self.assertEqual(client.cluster_info.cluster_uuid, "uuid")
+        # Shared by the clients of the same connection
+        self.assertEqual(ElasticsearchExtClient(es).version, "8.1.0")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(client.refresh_cluster_info().version, "8.2.0")
+        self.assertEqual(client.version, "8.2.0")
+        self.assertEqual(len(calls), 2)
+
+
+class TestMsearchCase(unittest.TestCase):
+    def test_msearch(self):
+        calls = []
+
+        def msearch(body, **kwargs):
+            items = list(body)
+            calls.append((items, kwargs))
+            return {
+                "responses": [
+                    {"error": {"type": "index_not_found_exception"}, "status": 404}
+                    if header.get("index") in ("missing", ["missing"])
+                    else {"hits": {"total": {"value": 1}, "hits": [{"_id": "1"}]}}
+                    for header in items[::2]
+                ]
+            }
+
+        es = Elasticsearch()
+        es.info = lambda **kwargs: {"version": {"number": "8.6.0"}}
+        es.msearch = msearch
+        client = ElasticsearchExtClient(es)
+        search = {"aggs": {"a": {"date_histogram": {"interval": "1d"}}}}
+        results = client.msearch(
+            [({"index": "a", "type": "doc"}, search), ({"index": "missing"}, {})]
+        )
+        items, kwargs = calls[-1]
+        self.assertEqual(
+            items,
+            [
+                {"index": "a"},
+                {"aggs": {"a": {"date_histogram": {"calendar_interval": "1d"}}}},
+                {"index": "missing"},
+                {},
+            ],
+        )
+        self.assertIsNone(kwargs["doc_type"])
+        first, second = results["responses"]
+        self.assertEqual(first["hits"]["total"], 1)
+        self.assertEqual(first["hits"]["hits"][0]["_type"], "doc")
+        self.assertEqual(second["status"], 404)
+
+        ms = MultiSearch(index="b").add(Search()).add(Search(index="missing"))
+        results = client.msearch(ms)
+        items, kwargs = calls[-1]
+        self.assertEqual(kwargs["index"], ["b"])
+        self.assertEqual(len(items), 4)
+        self.assertIn("error", results["responses"][1])
+
+
+class FakeScanTransport:
+    """
+    Transport serving 25 documents sliced by id, with scrolls (v6) or points
+    in time (v8).
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.scrolls = {}
+        self.closed = []
+
+    def page(self, body, after, size):
+        slice = body.get("slice", {"id": 0, "max": 1})
+        ids = [i for i in range(25) if i % slice["max"] == slice["id"] and i > after]
+        return [{"_id": str(i), "sort": [i]} for i in ids[:size]]
+
+    def perform_request(self, method, url, headers=None, params=None, body=None):
+        if url == "/":
+            return {"version": {"number": self.version}}
+        if url == "/_pit":
+            self.closed.append(body["id"])
+            return {}
+        if url.endswith("/_pit"):
+            return {"id": "pit"}
+        if url == "/_search/scroll" and method == "DELETE":
+            self.closed.extend(body["scroll_id"])
+            return {}
+        if url == "/_search/scroll":
+            scroll_body, size, after = self.scrolls[body["scroll_id"]]
+        else:
+            scroll_body, size = body, int(params["size"])
+            after = body.get("search_after", [-1])[0]
+        hits = self.page(scroll_body, after, size)
+        results = {"hits": {"total": {"value": 25}, "hits": hits}}
+        if "scroll" in (params or {}) or url == "/_search/scroll":
+            scroll_id = "scroll-%d" % scroll_body.get("slice", {"id": 0})["id"]
+            after = int(hits[-1]["_id"]) if hits else after
+            self.scrolls[scroll_id] = (scroll_body, size, after)
+            results["_scroll_id"] = scroll_id
+        return results
+
+
+class TestParallelScanCase(unittest.TestCase):
+    def scan(self, version, **kwargs):
+        es = Elasticsearch()
+        es.transport = FakeScanTransport(version)
+        client = ElasticsearchExtClient(es)
+        hits = list(client.parallel_scan("index", doc_type="doc", **kwargs))
+        self.assertEqual(sorted(int(hit["_id"]) for hit in hits), list(range(25)))
+        return es.transport, hits
+
+    def test_parallel_scan_pit(self):
+        transport, hits = self.scan("8.6.0", slices=3, size=4)
+        self.assertEqual(transport.closed, ["pit"])
+        self.assertTrue(all(hit["_type"] == "doc" for hit in hits))
+
+    def test_parallel_scan_scroll(self):
+        transport, hits = self.scan("6.8.0", slices=2, size=5, queue_size=1)
+        self.assertEqual(sorted(transport.closed), ["scroll-0", "scroll-1"])
+        transport, hits = self.scan("6.8.0", slices=1, size=10)
+
+    def test_parallel_scan_close_error(self):
+        class Pages:
+            """
+            Pages of a slice which can not be closed (eg. the scroll can not
+            be cleared).
+            """
+
+            def __iter__(self):
+                return iter([[{"_id": "1"}]])
+
+            def close(self):
+                raise TransportError("N/A", "Connection error")
+
+        es = Elasticsearch()
+        es.transport = FakeScanTransport("6.8.0")
+        client = ElasticsearchExtClient(es)
+        client._scan_slice_scroll = lambda *args: Pages()
+        # The error is raised instead of blocking the consumer
+        with self.assertRaises(TransportError):
+            list(client.parallel_scan("index", doc_type="doc", slices=2))
+
+
+class FakeConnection(Connection):
+    """
+    Connection to a v8 cluster answering an empty result to every search.
+    """
+
+    def perform_request(
+        self, method, url, params=None, body=None, timeout=None, ignore=(), headers=None
+    ):
+        if url == "/":
+            data = {"version": {"number": "8.6.0"}}
+        else:
+            data = {"took": 5, "hits": {"total": {"value": 0}, "hits": []}}
+        return 200, {"content-type": "application/json"}, json.dumps(data)
+
+
+class TestInstrumentationCase(unittest.TestCase):
+    def test_instrumentation(self):
+        metrics = []
+        client = ElasticsearchExtClient(
+            Elasticsearch(connection_class=FakeConnection),
+            instrumentation=metrics.append,
+        )
+        self.assertEqual(client.version_major, 8)
+        # Request made outside of any operation
+        self.assertEqual(metrics[-1].operation, "GET /")
+        self.assertEqual(metrics[-1].request_bytes, 0)
+
+        body = {"query": {"match_all": {}}}
+        client.search(index="i", doc_type="doc", body=body)
+        search = metrics[-1]
+        self.assertEqual(len(metrics), 2)
+        self.assertEqual(search.operation, "search")
+        self.assertEqual(search.index, "i")
+        self.assertEqual(search.nb_requests, 1)
+        self.assertEqual(
+            search.request_bytes, len(client.transport.serializer.dumps(body))
+        )
+        self.assertGreater(search.response_bytes, 0)
+        self.assertEqual(search.took, 5)
+        self.assertGreaterEqual(search.wall_time, search.transport_time)
+        self.assertAlmostEqual(
+            search.client_overhead_time, search.wall_time - search.transport_time
+        )
+
+        observations = []
+        adapter = RegistryAdapter(
+            lambda name, value, labels: observations.append((name, value, labels))
+        )
+        adapter.observe(search)
+        self.assertIn(
+            (
+                "pybana_elasticsearch_took_milliseconds",
+                5,
+                {"operation": "search", "index": "i", "error": ""},
+            ),
+            observations,
+        )
+
+        # Nothing is wrapped without instrumentation
+        client = ElasticsearchExtClient(Elasticsearch(connection_class=FakeConnection))
+        self.assertNotIn("search", vars(client))
+        self.assertIs(
+            client.transport.perform_request, client.transport._perform_request_fixed
+        )
+
+
+class TestAsyncClientCase(unittest.TestCase):
+    def test_async_client(self):
+        def search(header, body):
+            if "scroll_id" in body:
+                return {"_scroll_id": "s2", "hits": {"total": {"value": 1}, "hits": []}}
+            return {
+                "_scroll_id": "s1",
+                "hits": {"total": {"value": 1}, "hits": [{"_id": "1"}]},
+            }
+
+        es = fake_elasticsearch(FakeAsyncTransport, version="8.6.0", search=search)
+        es.transport.responses["_mapping"] = {
+            "index": {"mappings": {"properties": {"a": {"type": "keyword"}}}}
+        }
+        client = AsyncElasticsearchExtClient(es)
+        requests = es.transport.requests
+
+        async def run():
+            self.assertEqual(await client.get_version_major(), 8)
+            search = {"aggs": {"a": {"date_histogram": {"interval": "1d"}}}}
+            results = await client.search(
+                index="i", doc_type="doc", body=search, scroll="1m"
+            )
+            self.assertEqual(results["hits"]["total"], 1)
+            self.assertEqual(results["hits"]["hits"][0]["_type"], "doc")
+            self.assertEqual(
+                requests[-1][3],
+                {"aggs": {"a": {"date_histogram": {"calendar_interval": "1d"}}}},
+            )
+            results = await client.scroll(scroll_id="s1", scroll="1m")
+            self.assertEqual(results["hits"]["total"], 1)
+            self.assertEqual(list(client.scroll_cache.cache), ["s2"])
+            await client.bulk(
+                '{"index": {"_index": "i", "_type": "doc"}}\n{"_type": "x"}\n'
+            )
+            self.assertEqual(
+                requests[-1][3], '{"index": {"_index": "i"}}\n{"_type": "x"}\n'
+            )
+            mapping = await client.indices.get_mapping(index="index", doc_type="doc")
+            self.assertIn("doc", mapping["index"]["mappings"])
+            # The typeless endpoints are used on elasticsearch 7+
+            await client.index(index="i", doc_type="doc", body={}, id="1", version=2)
+            self.assertEqual(
+                requests[-1][:3],
+                ("PUT", "/i/_doc/1", {"version": "2", "version_type": b"external"}),
+            )
+            await client.delete(index="i", doc_type="doc", id="1")
+            self.assertEqual(requests[-1][:2], ("DELETE", "/i/_doc/1"))
+
+        asyncio.run(run())
+        self.assertEqual([url for _, url, _, _ in requests].count("/"), 1)
+
+
 class TestElaticsearchClientCase(unittest.TestCase):
     def test_simple_es_ops_primary(self):
         self.simple_es_operations("http://localhost:9200")
@@ -11,19 +11,25 @@ import datetime  # noqa: E402
 import elasticsearch  # noqa: E402
 import elasticsearch_dsl  # noqa: E402
 import json  # noqa: E402
+from unittest import mock  # noqa: E402
 from pybana import (  # noqa: E402
     Scope,
+    Config,
     ElasticTranslator,
+    IndexPattern,
     Kibana,
+    SavedObjectCache,
     VegaTranslator,
     VegaRenderer,
     VEGA_METRICS,
+    Visualization,
 )
 from pybana.translators.elastic.buckets import (  # noqa: E402
     format_from_interval,
     compute_auto_interval,
 )
 from pybana.elastic.elastic_client import ElasticsearchExtClient  # noqa: E402
+from fake_elasticsearch import FakeAsyncTransport, fake_elasticsearch  # noqa: E402
 import pytest  # noqa: E402
 import pytz  # noqa: E402
 
@@ -99,6 +105,29 @@ def load_data(elastic, index):
     elasticsearch.helpers.bulk(elastic, actions(), refresh="wait_for")
 
 
+def load_fixture_hit(id):
+    """
+    Returns a document of the fixtures as returned by a get.
+    """
+    datafn = os.path.join(BASE_DIRECTORY, "pybana/index.json")
+    with open(datafn, "r") as fd:
+        for line in fd:
+            hit = json.loads(line)
+            if hit["_id"] == id:
+                return {**hit, "found": True}
+    return {"_id": id, "found": False}
+
+
+def load_fixture_document(klass, id, **meta):
+    """
+    Load a document from the fixtures without elasticsearch.
+    """
+    hit = load_fixture_hit(id)
+    if not hit["found"]:
+        raise KeyError(id)
+    return klass.from_es({**hit, **meta})
+
+
 def test_client_v6():
     client_test("v6")
 
@@ -268,6 +297,157 @@ def vega_visualization_test(version):
         VegaTranslator(using=elastic).translate(visualization, response, scope)
 
 
+def test_search_list_proxy_execute():
+    from pybana.translators.elastic.utils import SearchListProxy
+
+    elastic = fake_elasticsearch(
+        search=lambda header, body: {
+            "hits": {"total": int(header["index"][0]), "hits": []}
+        }
+    )
+    searches = SearchListProxy(
+        [elasticsearch_dsl.Search(using=elastic, index=str(i)) for i in range(3)]
+    )
+    responses = searches.execute()
+    assert len(elastic.transport.bodies("_msearch")) == 1
+    assert [response.hits.total for response in responses] == [0, 1, 2]
+    assert SearchListProxy().execute() == []
+
+
+def test_dashboard_executor():
+    from pybana import Dashboard, DashboardExecutor
+    from pybana.translators.elastic.utils import SearchListProxy
+
+    def search(header, body):
+        if header.get("index") == ["error"]:
+            return {"error": {"type": "search_phase_execution_exception"}}
+        return {"hits": {"total": 1, "hits": []}}
+
+    class FakeTranslator:
+        def translate(self, visualization, scope):
+            key = visualization.meta.id.split(":")[-1]
+            if key == "6eab7cb0-fb18-11e9-84e4-078763638bf3":
+                return SearchListProxy(
+                    [
+                        elasticsearch_dsl.Search(index=index)
+                        for index in ("a", "error", "b")
+                    ]
+                )
+            raise ValueError(key)
+
+    dashboard = load_fixture_document(
+        Dashboard, "dashboard:f57a7160-fb18-11e9-84e4-078763638bf3"
+    )
+    elastic = fake_elasticsearch(search=search)
+    executor = DashboardExecutor(
+        using=elastic, translator=FakeTranslator(), max_request_size=30
+    )
+    results = executor.execute(dashboard, None)
+    assert len(elastic.transport.bodies("_msearch")) == 3
+    # The visualizations & their index-pattern are fetched with 2 mget
+    assert len(elastic.transport.bodies("_mget")) == 2
+    # markdown
+    assert results["1"].search is None and results["1"].error is None
+    assert isinstance(results["2"].error, elasticsearch.TransportError)
+    assert results["2"].response is None
+
+    elastic.transport.requests.clear()
+    executor.max_request_size = 1000
+    executor._translator.translate = lambda visualization, scope: (
+        elasticsearch_dsl.Search(index="a")
+    )
+    results = executor.execute(dashboard, None)
+    assert len(elastic.transport.bodies("_msearch")) == 1
+    assert results["2"].response.hits.total == 1
+
+    # Headers & bodies are passed as dicts, fixed one by one on v7+
+    elastic = ElasticsearchExtClient(fake_elasticsearch(version="8.6.0", search=search))
+    executor = DashboardExecutor(using=elastic, translator=executor._translator)
+    results = executor.execute(dashboard, None)
+    (body,) = elastic.es.transport.bodies("_msearch")
+    assert json.loads(body.splitlines()[0]) == {"index": ["a"]}
+    assert results["2"].response.hits.total == 1
+
+
+def test_saved_object_graph():
+    from pybana import Dashboard, SavedObjectGraph
+
+    elastic = fake_elasticsearch()
+    dashboards = [
+        load_fixture_document(
+            Dashboard, "dashboard:f57a7160-fb18-11e9-84e4-078763638bf3"
+        ),
+        load_fixture_document(
+            Dashboard, "dashboard:f57a7160-fb18-11e9-84e4-078763638bf3"
+        ),
+    ]
+    graph = SavedObjectGraph.load(dashboards, using=elastic)
+    assert graph.nb_requests == 2
+    mgets = elastic.transport.bodies("_mget")
+    assert [[doc["_id"] for doc in body["docs"]] for body in mgets] == [
+        [
+            "visualization:821adde0-fb13-11e9-84e4-078763638bf3",
+            "visualization:6eab7cb0-fb18-11e9-84e4-078763638bf3",
+        ],
+        ["index-pattern:6c172f80-fb13-11e9-84e4-078763638bf3"],
+    ]
+    # The objects are linked: no more requests
+    for dashboard in dashboards:
+        visualizations = dashboard.visualizations(using=elastic)
+        assert len(visualizations) == 2
+        assert (
+            visualizations[1].index(using=elastic).meta.id
+            == "index-pattern:6c172f80-fb13-11e9-84e4-078763638bf3"
+        )
+    assert dashboards[0].searches(using=elastic) == []
+    assert len(elastic.transport.requests) == 2
+
+
+def test_async_kibana():
+    import asyncio
+    from pybana import AsyncKibana
+
+    elastic = fake_elasticsearch(
+        FakeAsyncTransport,
+        search=lambda header, body: {"hits": {"total": 3, "hits": []}},
+    )
+    kibana = AsyncKibana(using=elastic)
+    scope = Scope(
+        datetime.datetime(2019, 1, 1, tzinfo=pytz.utc),
+        datetime.datetime(2019, 1, 3, tzinfo=pytz.utc),
+        pytz.utc,
+        None,
+    )
+
+    async def run():
+        dashboard = await kibana.dashboard("f57a7160-fb18-11e9-84e4-078763638bf3")
+        visualizations = await dashboard.avisualizations(using=elastic)
+        assert len(visualizations) == 2
+        index_pattern = await visualizations[1].aindex(using=elastic)
+        assert index_pattern.meta.id == (
+            "index-pattern:6c172f80-fb13-11e9-84e4-078763638bf3"
+        )
+        with pytest.raises(elasticsearch.NotFoundError):
+            await kibana.visualization("missing")
+        visualization = await kibana.visualization(
+            "e19d9640-ffdc-11e9-b6bd-4d907ad3c29d"
+        )
+        return await ElasticTranslator(using=elastic).aexecute(visualization, scope)
+
+    response = asyncio.run(run())
+    assert response.hits.total == 3
+    endpoints = [url.rsplit("/", 1)[-1] for _, url, _, _ in elastic.transport.requests]
+    assert [
+        endpoint if endpoint.startswith("_") else "get" for endpoint in endpoints
+    ] == ["get", "_mget", "get", "get", "get", "get", "_search"]
+    # The synchronous methods share the caches filled by the asynchronous ones
+    dashboard = kibana.klasses["dashboard"].from_es(
+        load_fixture_hit("dashboard:f57a7160-fb18-11e9-84e4-078763638bf3")
+    )
+    asyncio.run(dashboard.avisualizations(using=elastic))
+    assert len(dashboard.visualizations(using=elastic)) == 2
+
+
 def test_elastic_translator_helpers():
     assert format_from_interval("1y") == "yyyy"
     assert format_from_interval("1q") == "yyyy-MM"
@@ -328,6 +508,374 @@ def vega_renderer_momentFormat(version):
     renderer.to_svg(spec)
 
 
+def test_translation_plan():
+    visualization = load_fixture_document(
+        Visualization, "visualization:e19d9640-ffdc-11e9-b6bd-4d907ad3c29d", _version=1
+    )
+    index_pattern = load_fixture_document(
+        IndexPattern, "index-pattern:6c172f80-fb13-11e9-84e4-078763638bf3", _version=1
+    )
+    translator = ElasticTranslator(using=None)
+    plan = translator.plan(visualization, index_pattern)
+    assert translator.plan(visualization, index_pattern) is plan
+    scope = Scope(
+        datetime.datetime(2019, 1, 1, tzinfo=pytz.utc),
+        datetime.datetime(2019, 1, 3, tzinfo=pytz.utc),
+        pytz.utc,
+        None,
+    )
+    search = plan.bind(scope).to_dict()
+    assert search["query"]["bool"]["filter"][0]["range"]["ts"] == {
+        "gte": "2019-01-01T00:00:00+00:00",
+        "lte": "2019-01-03T00:00:00+00:00",
+    }
+    assert list(search["aggs"].values())[0]["date_histogram"]["interval"] == "1h"
+    scope.end = datetime.datetime(2019, 3, 1, tzinfo=pytz.utc)
+    search = plan.bind(scope).to_dict()
+    assert list(search["aggs"].values())[0]["date_histogram"]["interval"] == "1d"
+
+    # Searches do not share their aggregations with the plan
+    search = plan.bind(scope)
+    expected = search.to_dict()
+    list(search.aggs._params["aggs"].values())[0].interval = "1y"
+    assert plan.bind(scope).to_dict() == expected
+
+    # A new revision of the visualization invalidates the plan
+    visualization = load_fixture_document(
+        Visualization, "visualization:e19d9640-ffdc-11e9-b6bd-4d907ad3c29d", _version=2
+    )
+    assert translator.plan(visualization, index_pattern) is not plan
+    # Plans are not shared between connections
+    assert ElasticTranslator(using="other").plan(visualization, index_pattern) is not (
+        translator.plan(visualization, index_pattern)
+    )
+
+
+def test_vega_skeleton():
+    from elasticsearch_dsl.response import Response
+
+    index_pattern = load_fixture_document(
+        IndexPattern, "index-pattern:6c172f80-fb13-11e9-84e4-078763638bf3", _version=1
+    )
+    config = Config.from_es(
+        {
+            "_index": ".kibana",
+            "_id": "config:6.8.0",
+            "_version": 1,
+            "_source": {"type": "config", "config": {}},
+        }
+    )
+    aggregations = {
+        "2": {
+            "buckets": [
+                {"key": 1546300800000, "3": {"buckets": [{"key": "a", "doc_count": 1}]}}
+            ]
+        }
+    }
+
+    def translate(
+        version,
+        using=None,
+        index_pattern=index_pattern,
+        config=config,
+        id="5fa0ea20-ffdc-11e9-b6bd-4d907ad3c29d",
+        aggregations=aggregations,
+    ):
+        visualization = load_fixture_document(
+            Visualization,
+            f"visualization:{id}",
+            **({"_version": version} if version else {}),
+        )
+        response = Response(
+            elasticsearch_dsl.Search(),
+            {"hits": {"total": 1, "hits": []}, "aggregations": aggregations},
+        )
+        scope = Scope(
+            datetime.datetime(2019, 1, 1, tzinfo=pytz.utc),
+            datetime.datetime(2019, 1, 3, tzinfo=pytz.utc),
+            pytz.utc,
+            config,
+        )
+        return VegaTranslator(using=using).translate_legacy(
+            visualization, response, scope, index_pattern=index_pattern
+        )
+
+    VegaTranslator.skeletons.clear()
+    spec = translate(None)
+    assert len(VegaTranslator.skeletons) == 0
+    assert translate(1) == spec
+    cached = translate(1)
+    assert cached == spec
+    assert VegaTranslator.skeletons.hits == 1
+    # Specs are copies which can be modified
+    cached["marks"].append({})
+    cached["axes"][0]["title"] = "title"
+    assert translate(1) == spec
+    # A new revision of the visualization invalidates the skeleton
+    translate(2)
+    assert len(VegaTranslator.skeletons) == 2
+    # Skeletons are not shared between connections
+    translate(2, using="other")
+    assert len(VegaTranslator.skeletons) == 3
+    # Nothing is cached without the revision of the config
+    translate(3, config=Config(config={}))
+    assert len(VegaTranslator.skeletons) == 3
+
+    # The index-pattern is not fetched when the skeleton does not depend on it
+    elastic = fake_elasticsearch()
+    translate(1, using=elastic, index_pattern=None)
+    assert translate(1, using=elastic, index_pattern=None) == spec
+    assert elastic.transport.gets() == []
+
+    # Skeletons depending on the index-pattern are bound to its revision
+    VegaTranslator.skeletons.clear()
+    kwargs = {
+        "id": "96645fc0-d636-11ea-8206-6f7030d7dd42",
+        "aggregations": {"2": {"buckets": [{"key": 1546300800000, "1": {"value": 1}}]}},
+    }
+    builds = []
+    build_skeleton = VegaTranslator._build_skeleton
+    with mock.patch.object(
+        VegaTranslator,
+        "_build_skeleton",
+        lambda self, state: builds.append(state) or build_skeleton(self, state),
+    ):
+        translate(1, **kwargs)
+        translate(1, **kwargs)
+        assert len(builds) == 1
+        index_pattern.meta.version = 2
+        translate(1, **kwargs)
+        assert len(builds) == 2
+        translate(1, **kwargs)
+        assert len(builds) == 2
+
+
+def test_iter_response():
+    from pybana.translators.vega.visualization import ContextVisualization
+
+    visualization = load_fixture_document(
+        Visualization, "visualization:5fa0ea20-ffdc-11e9-b6bd-4d907ad3c29d"
+    )
+    index_pattern = load_fixture_document(
+        IndexPattern, "index-pattern:6c172f80-fb13-11e9-84e4-078763638bf3"
+    )
+    state = ContextVisualization(
+        visualization, Config(config={}), index_pattern=index_pattern
+    )
+    aggregations = {
+        "2": {
+            "buckets": [
+                {
+                    "key": 1546300800000 + i * 3600000,
+                    "3": {
+                        "buckets": [
+                            {"key": "a", "doc_count": 1},
+                            {"key": "", "doc_count": 0},
+                        ]
+                    },
+                }
+                for i in range(2)
+            ]
+        }
+    }
+    points = list(
+        VegaTranslator(using=None)._iter_response(
+            aggregations, state, {"hits": {"total": 1}}, "YYYY-MM-DD HH:mm", "en"
+        )
+    )
+    assert [(point["x"], point["group"], point["y"]) for point in points] == [
+        ("2019-01-01 00:00", "a", 1),
+        ("2019-01-01 00:00", "", 0),
+        ("2019-01-01 01:00", "a", 1),
+        ("2019-01-01 01:00", "", 0),
+    ]
+    assert points[0]["key"] == 1546300800000
+    assert points[0]["tooltip"] == {
+        points[0]["x_label"]: "2019-01-01 00:00",
+        points[0]["metric"]: 1,
+        "group": "a",
+    }
+    assert "group" not in points[1]["tooltip"]
+
+
+def test_vega_datasweet_series():
+    from elasticsearch_dsl.response import Response
+
+    hit = load_fixture_hit("visualization:5fa0ea20-ffdc-11e9-b6bd-4d907ad3c29d")
+    vis_state = json.loads(hit["_source"]["visualization"]["visState"])
+    series_params = vis_state["params"]["seriesParams"]
+    for id, formula in [
+        ("4", "cusum(agg1)"),
+        ("5", "sum(agg1)"),
+        # Ternary expressions are evaluated per bucket
+        ("6", "agg1 if agg1 > 1 else 0"),
+    ]:
+        vis_state["aggs"].append(
+            {
+                "id": id,
+                "enabled": True,
+                "type": "datasweet_formula",
+                "schema": "metric",
+                "params": {"formula": formula},
+            }
+        )
+        series_params.append({**series_params[0], "data": {"label": id, "id": id}})
+    hit["_source"]["visualization"]["visState"] = json.dumps(vis_state)
+    index_pattern = load_fixture_document(
+        IndexPattern, "index-pattern:6c172f80-fb13-11e9-84e4-078763638bf3"
+    )
+    scope = Scope(
+        datetime.datetime(2019, 1, 1, tzinfo=pytz.utc),
+        datetime.datetime(2019, 1, 3, tzinfo=pytz.utc),
+        pytz.utc,
+        Config(config={}),
+    )
+    # date_histogram (x axis) > terms (group)
+    aggregations = {
+        "2": {
+            "buckets": [
+                {
+                    "key": 1546300800000 + i * 3600000,
+                    "3": {
+                        "buckets": [
+                            {"key": "a", "doc_count": i + 1},
+                            {"key": "b", "doc_count": 10},
+                        ]
+                    },
+                }
+                for i in range(3)
+            ]
+        }
+    }
+    response = Response(
+        elasticsearch_dsl.Search(),
+        {"hits": {"total": 1, "hits": []}, "aggregations": aggregations},
+    )
+    spec = VegaTranslator(using=None, datasweet_series=True).translate_legacy(
+        Visualization.from_es(hit), response, scope, index_pattern=index_pattern
+    )
+    values = {}
+    for point in spec["data"][0]["values"]:
+        values.setdefault((point["group"], point["metric"]), []).append(point["y"])
+    # Series are computed along the x axis, for each group
+    assert values[("a", "4")] == [1, 3, 6]
+    assert values[("b", "4")] == [10, 20, 30]
+    assert values[("a", "5")] == [6, 6, 6]
+    assert values[("b", "5")] == [30, 30, 30]
+    assert values[("a", "6")] == [0, 2, 3]
+
+
+def test_context_visualization_lookups():
+    from pybana.translators.vega.visualization import ContextVisualization
+
+    visualization = load_fixture_document(
+        Visualization, "visualization:e19d9640-ffdc-11e9-b6bd-4d907ad3c29d"
+    )
+    state = ContextVisualization(visualization, Config(config={}))
+    metric = state.get_agg("1")
+    assert metric["schema"] == "metric"
+    assert state.metric_aggs() == [metric]
+    assert state.segment_aggs() == state.bucket_aggs() == [state.get_agg("2")]
+    assert state.group_aggs() == []
+    assert not state.singleton()
+    ax = state.valueax("ValueAxis-1")
+    assert state.series_params(metric)["valueAxis"] == ax["id"]
+    assert state.valueaxserie(ax) is state.series_params(metric)
+    assert state.valueaxtype(ax) == "line"
+    assert not state.metrics_stacked(ax)
+    assert not state.metrics_side_by_side(ax)
+    assert not state.groups_stacked(ax)
+    assert not state.multi_axis()
+    with pytest.raises(IndexError):
+        state.get_agg("3")
+    with pytest.raises(IndexError):
+        state.valueax("ValueAxis-2")
+
+
+def test_shared_index_pattern():
+    from pybana.translators.vega.visualization import ContextVisualization
+
+    visualization = load_fixture_document(
+        Visualization, "visualization:e19d9640-ffdc-11e9-b6bd-4d907ad3c29d"
+    )
+    index_pattern = load_fixture_document(
+        IndexPattern, "index-pattern:6c172f80-fb13-11e9-84e4-078763638bf3"
+    )
+    fetches = []
+
+    def fetch_index(using):
+        fetches.append(using)
+        return index_pattern
+
+    visualization._fetch_index = fetch_index
+    assert visualization.index(using=None) is index_pattern
+    assert visualization.index(using=None) is index_pattern
+    assert fetches == [None]
+
+    # A given index-pattern is never fetched
+    state = ContextVisualization(
+        visualization, Config(config={}), using="other", index_pattern=index_pattern
+    )
+    assert state.index_pattern is index_pattern
+    assert fetches == [None]
+    state = ContextVisualization(visualization, Config(config={}), using="other")
+    assert state.index_pattern is index_pattern
+    assert fetches == [None, "other"]
+
+
+def test_saved_object_cache():
+    es = fake_elasticsearch()
+
+    def gets():
+        # (id, True if the source was fetched)
+        return [
+            (id, params.get("_source") != b"false")
+            for id, params in es.transport.gets()
+        ]
+
+    cache = SavedObjectCache()
+    kibana = Kibana(using=es, index=".kibana", cache=cache)
+    vis_id = "e19d9640-ffdc-11e9-b6bd-4d907ad3c29d"
+    visualization = kibana.visualization(vis_id)
+    assert kibana.visualization(vis_id) is visualization
+    assert gets() == [(f"visualization:{vis_id}", True)] + [
+        (f"visualization:{vis_id}", False)
+    ]
+    # Nested lookups go through the cache
+    index_pattern = visualization.index(using=es)
+    assert len(cache) == 2
+    assert visualization.index(using=es) is index_pattern
+
+    # A new revision of a nested document is not hidden by a memo
+    es.transport.versions[index_pattern.meta.id] = 2
+    assert visualization.index(using=es) is not index_pattern
+
+    # A new revision is fetched again
+    es.transport.versions[f"visualization:{vis_id}"] = 2
+    assert kibana.visualization(vis_id) is not visualization
+    visualization = kibana.visualization(vis_id)
+    assert gets()[-2:] == [
+        (f"visualization:{vis_id}", True),
+        (f"visualization:{vis_id}", False),
+    ]
+
+    # No revalidation during the ttl
+    cache.ttl = 60
+    es.transport.requests.clear()
+    assert kibana.visualization(vis_id) is visualization
+    assert gets() == []
+
+    # Saving a document invalidates it
+    visualization.save(using=es)
+    assert len(cache) == 1
+    assert kibana.visualization(vis_id) is not visualization
+
+    # Documents bigger than the cache are not kept
+    cache = SavedObjectCache(maxbytes=10)
+    Kibana(using=es, cache=cache).visualization(vis_id)
+    assert len(cache) == 0
+
+
 def test_datasweet():
     import pybana.helpers.datasweet as ds
 
@@ -366,11 +914,91 @@ def test_datasweet():
 
     assert ds.datasweet_eval("1 / 0", {}) is None
 
+    ds.datasweet_compile.cache_clear()
+    for value in range(3):
+        assert ds.datasweet_eval("agg1 * 2", {"1": {"value": value}}) == 2 * value
+    info = ds.datasweet_compile.cache_info()
+    assert (info.hits, info.misses) == (2, 1)
+
+    buckets = [{"1": {"value": v}, "2": {"value": 2}} for v in (1, 2, None, 4)]
+    assert ds.datasweet_eval_series("cusum(agg2)", buckets) == [2, 4, 6, 8]
+    assert ds.datasweet_eval_series("derivative(agg1)", buckets) == [
+        None,
+        1,
+        None,
+        None,
+    ]
+    assert ds.datasweet_eval_series("prev(agg1)", buckets) == [None, 1, 2, None]
+    assert ds.datasweet_eval_series("ifnan(agg1, 0) / agg2", buckets) == [0.5, 1, 0, 2]
+    assert ds.datasweet_eval_series("agg1 / 0", buckets) == [None] * 4
+    with pytest.raises(ds.UnsupportedFormulaError):
+        ds.datasweet_eval_series("agg1 and agg2", buckets)
+
     with pytest.raises(ValueError):
         tree = ast.parse("x + 1", mode="eval")
         tree = ds.DatasweetTransformer().visit(tree)
 
 
+def test_datasweet_pushdown():
+    from pybana.translators.elastic.metrics import MetricTranslator
+
+    state = {
+        "aggs": [
+            {"id": "1", "type": "avg", "schema": "metric", "params": {"field": "f"}},
+            {"id": "2", "type": "count", "schema": "metric", "params": {}},
+            {
+                "id": "3",
+                "type": "datasweet_formula",
+                "schema": "metric",
+                "params": {"formula": "if(agg1 > 1, agg1 / agg2, 0) + cusum(agg2)"},
+            },
+            {
+                "id": "4",
+                "type": "datasweet_formula",
+                "schema": "metric",
+                "params": {"formula": "next(agg1)"},
+            },
+        ]
+    }
+    translator = MetricTranslator(datasweet_pushdown=True)
+    search = elasticsearch_dsl.Search()
+    proxy = search.aggs.bucket("0", "date_histogram", field="ts")
+    for agg in state["aggs"]:
+        translator.translate(proxy, agg, state, None)
+    aggs = search.to_dict()["aggs"]["0"]["aggs"]
+    assert aggs["3_cusum_agg2"] == {"cumulative_sum": {"buckets_path": "_count"}}
+    assert aggs["3"]["bucket_script"] == {
+        "buckets_path": {"agg1": "1", "agg2": "_count", "cusum_agg2": "3_cusum_agg2"},
+        "script": "(((params.agg1 > 1.0) ? (params.agg1 / params.agg2) : 0.0) + params.cusum_agg2)",
+    }
+    # next can not be computed by elasticsearch
+    assert "4" not in aggs
+
+    # Conditions must be comparisons as painless does not cast numbers to booleans
+    for formula, script in [
+        ("if(agg1, agg1, 0)", None),
+        ("1 if not agg1 else 0", None),
+        ("agg1 + (agg1 > 1)", None),
+        (
+            "agg1 if not (agg1 > 1 and agg2 < 2) else 0",
+            "((!((params.agg1 > 1.0) && (params.agg2 < 2.0))) ? params.agg1 : 0.0)",
+        ),
+    ]:
+        agg = {**state["aggs"][2], "params": {"formula": formula}}
+        search = elasticsearch_dsl.Search()
+        proxy = search.aggs.bucket("0", "date_histogram", field="ts")
+        translator.translate(proxy, agg, state, None)
+        aggs = search.to_dict()["aggs"]["0"].get("aggs", {})
+        assert aggs.get("3", {}).get("bucket_script", {}).get("script") == script
+
+    # Series functions require an histogram
+    search = elasticsearch_dsl.Search()
+    proxy = search.aggs.bucket("0", "terms", field="s")
+    for agg in state["aggs"]:
+        translator.translate(proxy, agg, state, None)
+    assert list(search.to_dict()["aggs"]["0"]["aggs"]) == ["1"]
+
+
 def test_datetime():
     import pybana.helpers.datetime as dt
 
@@ -382,3 +1010,65 @@ def test_datetime():
     assert dt.convert("Y [coucou]") == "Y [coucou]"
     assert dt.convert("[coucou] Y"), "[coucou] Y"
     assert dt.convert("[a [coucou]]"), "[a [coucou]]"
+
+
+def test_datetime_formatter():
+    import pybana.helpers.datetime as dt
+
+    formatter = dt.compile_date_format("MMM Do YYYY, dddd HH:mm:ss.SSS A", "fr")
+    assert dt.compile_date_format("MMM Do YYYY, dddd HH:mm:ss.SSS A", "fr") is formatter
+    assert formatter(1546300800123) == "janv. 1er 2019, mardi 00:00:00.123 AM"
+    assert dt.format_timestamp(1546300800123, "LLL [{x}]", "xx") == (
+        "January 1, 2019 12:00 AM {x}"
+    )
+    assert dt.format_timestamp(1546300800000) == "2019-01-01T00:00:00+00:00"
+    formatter = dt.DateFormatter("YYYY-MM-DD HH:mm Z", tz="Europe/Paris")
+    memo = {}
+    assert formatter.format_many([1546300800000, 1561939200000], memo) == [
+        "2019-01-01 01:00 +01:00",
+        "2019-07-01 02:00 +02:00",
+    ]
+    assert memo[1546300800000] == "2019-01-01 01:00 +01:00"
+    with pytest.raises(dt.UnknownMomentTokenError):
+        dt.DateFormatter("w")
+
+
+def test_datetime_scaled_formats():
+    import pybana.helpers.datetime as dt
+
+    scaled = [
+        ["", "HH:mm:ss.SSS"],
+        ["PT1S", "HH:mm:ss"],
+        ["PT1M", "HH:mm"],
+        ["PT1H", "YYYY-MM-DD HH:mm"],
+        ["P1DT", "YYYY-MM-DD"],
+        ["P1M", "YYYY-MM"],
+        ["P1Y", "YYYY"],
+    ]
+    config = Config(
+        config={"dateFormat:scaled": json.dumps(scaled), "dateFormat": "LLL"}
+    )
+    table = dt.get_scaled_date_formats(config)
+    assert dt.get_scaled_date_formats(Config(config=config.config.to_dict())) is table
+    assert [str(duration) for duration in table.durations][0] == "1 second"
+    assert table.default == "HH:mm:ss.SSS"
+    assert dt.get_scaled_date_format(config, datetime.timedelta(hours=3)) == (
+        "YYYY-MM-DD HH:mm"
+    )
+    assert table.get(datetime.timedelta(days=1)) == "YYYY-MM-DD"
+    assert table.get(datetime.timedelta(milliseconds=10)) == "HH:mm:ss.SSS"
+    # Unreachable entries are dropped
+    table = dt.ScaledDateFormats(json.dumps([["PT1H", "a"], ["PT1M", "b"]]), "c")
+    assert table.formats == ["b"]
+    assert table.get(datetime.timedelta(days=1)) == "b"
+    assert table.get(datetime.timedelta(seconds=1)) == "c"
+
+
+def test_json_attrs():
+    visualization = load_fixture_document(
+        Visualization, "visualization:5fa0ea20-ffdc-11e9-b6bd-4d907ad3c29d"
+    )
+    assert visualization.visState.to_dict()["type"] == "histogram"
+    assert visualization.visState is visualization.visState
+    # Parsed json attributes are not stored in the documents
+    assert "_json_attrs_cache" not in visualization.to_dict()